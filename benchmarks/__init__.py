@@ -0,0 +1,9 @@
+"""
+Benchmarks and load tests for the bot.
+
+Every module is runnable from the repository root, e.g.::
+
+    python -m benchmarks.load_test --users 20 --iterations 5
+
+None of them need network access or Telegram credentials.
+"""
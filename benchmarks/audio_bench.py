@@ -0,0 +1,302 @@
+"""
+Micro-benchmarks for ``process_audio`` across formats, durations and scenarios.
+
+Every measurement runs in a fresh worker process so peak RSS and CPU time
+are not polluted by earlier runs. Besides time and memory, each run counts
+the processes it spawned and the bytes it read from and wrote to disk
+(this process and its ffmpeg children). Scenarios:
+
+    metadata   re-export with tags only, no cut
+    short_cut  keep 10 seconds from the middle of the track
+    long_cut   keep everything except the first and last 5%
+
+Usage:
+    python -m benchmarks.audio_bench
+    python -m benchmarks.audio_bench --formats mp3,ogg --durations 10,600,7200 --repeat 3
+    python -m benchmarks.audio_bench --backends ffmpeg,pydub --durations 600
+"""
+
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from benchmarks.common import encode_media, write_results
+
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+FORMATS = ("mp3", "wav", "ogg", "wma")
+SCENARIOS = ("metadata", "short_cut", "long_cut")
+BACKENDS = ("ffmpeg", "pydub")
+DEFAULT_DURATIONS = (10, 60, 600)
+
+
+def scenario_range(scenario: str, duration: float):
+    """Return the (start, end) cut for a scenario, or (None, None) for no cut."""
+    if scenario == "metadata":
+        return None, None
+    if scenario == "short_cut":
+        middle = duration / 2
+        return max(0.0, middle - 5), min(duration, middle + 5)
+    if scenario == "long_cut":
+        return duration * 0.05, duration * 0.95
+    raise ValueError(f"Unknown scenario {scenario}")
+
+
+def input_path(cache_dir: Path, fmt: str, duration: float) -> Path:
+    """Synthetic input for ``fmt``/``duration``, generated once and cached on disk."""
+    path = cache_dir / f"tone_{int(duration)}s.{fmt}"
+    if not path.exists():
+        encode_media(duration, fmt, output_path=str(path))
+    return path
+
+
+def _directory_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class _SpawnCounter:
+    """Count ``subprocess.Popen`` calls made while active."""
+
+    def __init__(self):
+        self.count = 0
+        self._original = None
+
+    def __enter__(self) -> "_SpawnCounter":
+        self._original = subprocess.Popen.__init__
+        counter = self
+
+        def counting_init(popen, *args, **kwargs):
+            counter.count += 1
+            counter._original(popen, *args, **kwargs)
+
+        subprocess.Popen.__init__ = counting_init
+        return self
+
+    def __exit__(self, *exc) -> None:
+        subprocess.Popen.__init__ = self._original
+
+
+def _block_io() -> Dict[str, int]:
+    """Blocks read and written by this process and its waited-for children, in bytes."""
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    # ru_inblock/ru_oublock count 512-byte blocks on Linux
+    return {"read": (own.ru_inblock + children.ru_inblock) * 512,
+            "write": (own.ru_oublock + children.ru_oublock) * 512}
+
+
+class _TempDiskSampler(threading.Thread):
+    """Poll a directory and remember the largest total size seen."""
+
+    def __init__(self, path: str, interval: float = 0.02):
+        super().__init__(daemon=True)
+        self.path = path
+        self.interval = interval
+        self.peak = 0
+        self._stop_event = threading.Event()
+
+    def run(self) -> None:
+        while not self._stop_event.is_set():
+            self.peak = max(self.peak, _directory_size(self.path))
+            time.sleep(self.interval)
+
+    def stop(self) -> int:
+        self._stop_event.set()
+        self.join()
+        self.peak = max(self.peak, _directory_size(self.path))
+        return self.peak
+
+
+def run_worker(source: str, scenario: str, duration: float, **process_kwargs) -> Dict:
+    """Run one ``process_audio`` call in this process and measure it.
+
+    Temporary files are redirected to a private directory so their peak
+    size can be sampled while the render is running.
+    """
+    temp_dir = tempfile.mkdtemp(prefix="audio_bench_tmp_")
+    tempfile.tempdir = temp_dir
+    os.environ["TMPDIR"] = temp_dir
+
+    from tools.audio_utils import process_audio
+
+    output_dir = tempfile.mkdtemp(prefix="audio_bench_out_")
+    output = os.path.join(output_dir, f"output{Path(source).suffix}")
+    start_time, end_time = scenario_range(scenario, duration)
+
+    sampler = _TempDiskSampler(temp_dir)
+    sampler.start()
+    io_before = _block_io()
+    usage_before = resource.getrusage(resource.RUSAGE_SELF)
+    children_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    wall_start = time.perf_counter()
+    with _SpawnCounter() as spawns:
+        success, message = process_audio(
+            input_path=source,
+            output_path=output,
+            start_time=start_time,
+            end_time=end_time,
+            language="en",
+            title="Benchmark",
+            artist="Bench",
+            album="Bench",
+            **process_kwargs
+        )
+    wall = time.perf_counter() - wall_start
+    io_after = _block_io()
+    usage_after = resource.getrusage(resource.RUSAGE_SELF)
+    children_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    peak_temp = sampler.stop()
+
+    cpu_self = (usage_after.ru_utime - usage_before.ru_utime) + (usage_after.ru_stime - usage_before.ru_stime)
+    cpu_children = (children_after.ru_utime - children_before.ru_utime) + (children_after.ru_stime - children_before.ru_stime)
+    output_size = os.path.getsize(output) if os.path.exists(output) else 0
+    for path in (output_dir, temp_dir):
+        shutil.rmtree(path, ignore_errors=True)
+    from tools.audio_utils import get_backend
+    return {
+        "backend": get_backend().name,
+        "success": success,
+        "message": message if not success else None,
+        "wall_seconds": wall,
+        "cpu_seconds": cpu_self + cpu_children,
+        "cpu_self_seconds": cpu_self,
+        "cpu_children_seconds": cpu_children,
+        # ru_maxrss is reported in kilobytes on Linux. For children it is an
+        # upper bound: the high-water mark survives fork+exec, so it can
+        # include this interpreter's RSS at spawn time.
+        "peak_rss_mb": usage_after.ru_maxrss / 1024,
+        "peak_children_rss_mb": children_after.ru_maxrss / 1024,
+        "peak_temp_mb": peak_temp / (1024 * 1024),
+        "output_mb": output_size / (1024 * 1024),
+        "processes": spawns.count,
+        "disk_read_mb": (io_after["read"] - io_before["read"]) / (1024 * 1024),
+        "disk_write_mb": (io_after["write"] - io_before["write"]) / (1024 * 1024),
+    }
+
+
+def measure(source: Path, scenario: str, duration: float, extra_args: Optional[List[str]] = None,
+            backend: Optional[str] = None) -> Dict:
+    """Run :func:`run_worker` in a fresh interpreter and return its measurements.
+
+    ``backend`` selects the ``AUDIO_BACKEND`` of the worker; by default it
+    inherits this process's environment.
+    """
+    command = [sys.executable, "-m", "benchmarks.audio_bench", "--worker",
+               json.dumps({"source": str(source), "scenario": scenario, "duration": duration}),
+               *(extra_args or [])]
+    env = dict(os.environ, LOG_LEVEL=os.environ.get("LOG_LEVEL", "WARNING"))
+    if backend:
+        env["AUDIO_BACKEND"] = backend
+    result = subprocess.run(command, cwd=ROOT_DIR, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    if result.returncode != 0:
+        return {"success": False, "message": result.stderr.strip().splitlines()[-1:] or "worker failed"}
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def _aggregate(runs: List[Dict]) -> Dict:
+    """Keep the median wall time run and the worst peak memory/disk across repeats."""
+    successful = [run for run in runs if run.get("success")]
+    if not successful:
+        return runs[-1]
+    successful.sort(key=lambda run: run["wall_seconds"])
+    result = dict(successful[len(successful) // 2])
+    for key in ("peak_rss_mb", "peak_children_rss_mb", "peak_temp_mb", "disk_write_mb"):
+        result[key] = max(run[key] for run in successful)
+    result["wall_seconds_all"] = [run["wall_seconds"] for run in successful]
+    result["repeat"] = len(successful)
+    return result
+
+
+def run_suite(formats, durations, scenarios, repeat: int = 1, cache_dir: Optional[Path] = None,
+              extra_args: Optional[List[str]] = None, verbose: bool = True,
+              backends: Optional[List[str]] = None) -> Dict[str, Dict]:
+    """Measure every case; keys get a ``/<backend>`` suffix when comparing several backends."""
+    backends = backends or [None]
+    cache_dir = cache_dir or Path(tempfile.gettempdir()) / "audio_bench_inputs"
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    results = {}
+    for fmt in formats:
+        for duration in durations:
+            source = input_path(cache_dir, fmt, duration)
+            for scenario in scenarios:
+                for backend in backends:
+                    key = f"{fmt}/{int(duration)}s/{scenario}"
+                    if len(backends) > 1:
+                        key += f"/{backend}"
+                    runs = [measure(source, scenario, duration, extra_args, backend) for _ in range(repeat)]
+                    results[key] = _aggregate(runs)
+                    if verbose:
+                        print_row(key, results[key])
+    return results
+
+
+def print_row(key: str, result: Dict) -> None:
+    if not result.get("success"):
+        print(f"{key:<33} FAILED {result.get('message')}")
+        return
+    print(f"{key:<33} wall {result['wall_seconds']:>8.2f}s  cpu {result['cpu_seconds']:>8.2f}s  "
+          f"rss {result['peak_rss_mb']:>8.1f}MB  ffmpeg rss {result['peak_children_rss_mb']:>7.1f}MB  "
+          f"temp {result['peak_temp_mb']:>8.1f}MB  procs {result.get('processes', 0):>2}  "
+          f"disk w {result.get('disk_write_mb', 0):>7.1f}MB")
+
+
+def _csv(value: str) -> List[str]:
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark process_audio across formats and durations")
+    parser.add_argument("--formats", default=",".join(FORMATS), help="Comma separated input formats")
+    parser.add_argument("--durations", default=",".join(map(str, DEFAULT_DURATIONS)),
+                        help="Comma separated input durations in seconds (up to 7200)")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Comma separated scenarios")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per case; the median wall time is kept")
+    parser.add_argument("--backends", help="Comma separated audio backends to compare (default: AUDIO_BACKEND)")
+    parser.add_argument("--cache-dir", help="Where generated inputs are kept between runs")
+    parser.add_argument("--output", help="Results JSON path (default: benchmarks/baselines/audio.json)")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        params = json.loads(args.worker)
+        print(json.dumps(run_worker(params["source"], params["scenario"], params["duration"])))
+        return 0
+
+    formats = _csv(args.formats)
+    scenarios = _csv(args.scenarios)
+    durations = [float(value) for value in _csv(args.durations)]
+    backends = _csv(args.backends) if args.backends else None
+    for name, values, allowed in (("formats", formats, FORMATS), ("scenarios", scenarios, SCENARIOS),
+                                  ("backends", backends or [], BACKENDS)):
+        unknown = set(values) - set(allowed)
+        if unknown:
+            parser.error(f"Unknown {name}: {', '.join(sorted(unknown))}")
+
+    results = run_suite(formats, durations, scenarios, args.repeat,
+                        Path(args.cache_dir) if args.cache_dir else None, backends=backends)
+    path = write_results("audio", {"params": {"formats": formats, "durations": durations,
+                                               "scenarios": scenarios, "repeat": args.repeat,
+                                               "backends": backends},
+                                    "results": results}, args.output)
+    print(f"\nResults written to {path}")
+    return 0 if all(result.get("success") for result in results.values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
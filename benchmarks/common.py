@@ -0,0 +1,148 @@
+"""Helpers shared by the benchmark scripts: statistics, synthetic media and result files."""
+
+import json
+import math
+import os
+import platform
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional
+
+
+BASELINES_DIR = Path(__file__).parent / "baselines"
+
+
+def use_temp_database(prefix: str = "bench_") -> str:
+    """Point ``DATABASE_URL`` at a throw-away SQLite file.
+
+    Must be called before ``database`` is imported, because the engine is
+    created at import time.
+    """
+    if "database.database" in sys.modules:
+        raise RuntimeError("use_temp_database() must run before the database module is imported")
+    path = os.path.join(tempfile.mkdtemp(prefix=prefix), "bench.sqlite")
+    os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{path}"
+    return path
+
+
+def percentile(values: Iterable[float], pct: float) -> float:
+    """Linear-interpolated percentile, ``pct`` in [0, 100]."""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    rank = (len(ordered) - 1) * pct / 100
+    low = math.floor(rank)
+    high = math.ceil(rank)
+    if low == high:
+        return ordered[low]
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def summarize(latencies: Iterable[float]) -> Dict[str, float]:
+    """Return count, mean and p50/p95/p99/max of a list of latencies in seconds."""
+    values = list(latencies)
+    if not values:
+        return {"count": 0, "mean": 0.0, "p50": 0.0, "p95": 0.0, "p99": 0.0, "max": 0.0}
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values),
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": max(values),
+    }
+
+
+def format_table(rows: Dict[str, Dict[str, Any]], columns: Iterable[str], unit_scale: float = 1000.0, unit: str = "ms") -> str:
+    """Format ``{row_name: {column: value}}`` as a fixed-width text table."""
+    columns = list(columns)
+    labels = [column if column == "count" else f"{column} ({unit})" for column in columns]
+    widths = [max(14, len(label) + 2) for label in labels]
+    header = f"{'operation':<16}" + "".join(f"{label:>{width}}" for label, width in zip(labels, widths))
+    lines = [header, "-" * len(header)]
+    for name, stats in rows.items():
+        cells = []
+        for column, width in zip(columns, widths):
+            value = stats.get(column, 0)
+            cells.append(f"{value:>{width}}" if column == "count" else f"{value * unit_scale:>{width}.1f}")
+        lines.append(f"{name:<16}" + "".join(cells))
+    return "\n".join(lines)
+
+
+def sine_pcm(seconds: float, sample_rate: int = 44100, channels: int = 2, frequency: float = 441.0) -> bytes:
+    """Signed 16-bit little-endian PCM of a sine tone.
+
+    One period is computed and repeated, so even hours of audio are cheap
+    to generate.
+    """
+    period_frames = max(1, round(sample_rate / frequency))
+    period = bytearray()
+    for i in range(period_frames):
+        sample = int(0.5 * 32767 * math.sin(2 * math.pi * i / period_frames))
+        period += struct.pack("<h", sample) * channels
+    total_frames = int(seconds * sample_rate)
+    repeats, remainder = divmod(total_frames, period_frames)
+    return bytes(period) * repeats + bytes(period[:remainder * 2 * channels])
+
+
+def wav_bytes(seconds: float, sample_rate: int = 44100, channels: int = 2) -> bytes:
+    """A complete in-memory WAV file containing a sine tone."""
+    pcm = sine_pcm(seconds, sample_rate, channels)
+    header = b"RIFF" + struct.pack("<I", 36 + len(pcm)) + b"WAVE"
+    header += b"fmt " + struct.pack("<IHHIIHH", 16, 1, channels, sample_rate, sample_rate * channels * 2, channels * 2, 16)
+    header += b"data" + struct.pack("<I", len(pcm))
+    return header + pcm
+
+
+def encode_media(seconds: float, fmt: str, output_path: Optional[str] = None, sample_rate: int = 44100, channels: int = 2) -> bytes:
+    """Encode a synthetic tone with ffmpeg into ``fmt`` (mp3, ogg, wma, ...).
+
+    WAV is produced without ffmpeg. When ``output_path`` is given the result
+    is written there and an empty bytes object is returned, so multi-hour
+    inputs never have to be held in memory.
+    """
+    if fmt == "wav" and output_path is None:
+        return wav_bytes(seconds, sample_rate, channels)
+    if not shutil.which("ffmpeg"):
+        raise RuntimeError("ffmpeg is required to generate non-WAV benchmark media")
+    codecs = {"mp3": ["-c:a", "libmp3lame", "-b:a", "192k"], "ogg": ["-c:a", "libvorbis", "-q:a", "4"],
+              "wma": ["-c:a", "wmav2", "-b:a", "192k"], "wav": ["-c:a", "pcm_s16le"],
+              "flac": ["-c:a", "flac"], "m4a": ["-c:a", "aac", "-b:a", "192k"], "opus": ["-c:a", "libopus", "-b:a", "96k"]}
+    container = {"wma": "asf", "m4a": "ipod"}.get(fmt, fmt)
+    command = ["ffmpeg", "-v", "error", "-y", "-f", "lavfi",
+               "-i", f"sine=frequency=441:sample_rate={sample_rate}:duration={seconds}",
+               "-ac", str(channels), *codecs[fmt], "-f", container, output_path or "pipe:1"]
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+    return b"" if output_path else result.stdout
+
+
+def environment_info() -> Dict[str, Any]:
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+    }
+
+
+def write_results(name: str, results: Dict[str, Any], path: Optional[str] = None) -> Path:
+    """Write benchmark results as JSON; defaults to ``benchmarks/baselines/<name>.json``."""
+    target = Path(path) if path else BASELINES_DIR / f"{name}.json"
+    target.parent.mkdir(parents=True, exist_ok=True)
+    payload = {"benchmark": name, "environment": environment_info(), **results}
+    with open(target, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False, indent=2)
+    return target
+
+
+def load_results(name: str, path: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    target = Path(path) if path else BASELINES_DIR / f"{name}.json"
+    if not target.exists():
+        return None
+    with open(target, "r", encoding="utf-8") as f:
+        return json.load(f)
@@ -0,0 +1,229 @@
+"""
+Database layer benchmark and concurrency stress test.
+
+Runs a weighted mix of the model classmethods the handlers call most from N
+concurrent coroutines and records throughput, per-operation latency and
+errors. "database is locked" failures are counted through an engine
+``handle_error`` listener, so they are seen even when a classmethod
+swallows the exception (``AdminsPermissions.is_admin`` does).
+
+Usage:
+    python -m benchmarks.db_stress --concurrency 1,8,32 --duration 10
+    python -m benchmarks.db_stress --database-url postgresql+asyncpg://... --concurrency 64
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from benchmarks.common import format_table, summarize, use_temp_database, write_results
+
+
+DEFAULT_WEIGHTS = {
+    "users_get": 30,
+    "set_waiting_for": 10,
+    "audio_create": 10,
+    "audio_update": 20,
+    "audio_delete": 8,
+    "is_admin": 12,
+    "stats_counts": 2,
+}
+
+
+class _AdminsClient:
+    """Stand-in client for ``AdminsPermissions``; chats are pre-seeded so it is rarely used."""
+
+    async def get_chat(self, chat_id: int):
+        raise ValueError(f"Chat {chat_id} not seeded")
+
+    async def get_chat_members(self, chat_id: int, filter=None):
+        return
+        yield
+
+
+class DatabaseStress:
+    def __init__(self, weights: Dict[str, int], seed: int = 0):
+        self.weights = weights
+        self.seed = seed
+        self.client = _AdminsClient()
+        self.latencies: Dict[str, List[float]] = {name: [] for name in weights}
+        self.errors: Dict[str, int] = {name: 0 for name in weights}
+        self.lock_errors = 0
+        self.db_errors = 0
+
+    def attach_error_listener(self) -> None:
+        from sqlalchemy import event
+        from database.database import engine
+
+        def on_error(context) -> None:
+            self.db_errors += 1
+            if "database is locked" in str(context.original_exception).lower():
+                self.lock_errors += 1
+
+        event.listen(engine.sync_engine, "handle_error", on_error)
+
+    async def seed_data(self, workers: int, chats: int = 10) -> None:
+        from database import AdminsPermissions, Chats, Users
+
+        for worker in range(workers):
+            await Users.create(user_id=self.user_id(worker), full_name=f"Stress {worker}", language="en")
+        for chat in range(chats):
+            chat_id = self.chat_id(chat)
+            await Chats.chat_status_change(chat_id=chat_id, chat_type="supergroup", chat_title=f"Stress {chat}",
+                                           is_active=True, is_admin=True)
+            admin_list = [(self.user_id(worker), {"can_restrict_members": worker % 2 == 0})
+                          for worker in range(workers)]
+            await AdminsPermissions.create(client=self.client, chat_id=chat_id, admin_list=admin_list)
+
+    @staticmethod
+    def user_id(worker: int) -> int:
+        return 500000 + worker
+
+    @staticmethod
+    def chat_id(index: int) -> int:
+        return -1000000000 - index
+
+    async def _operation(self, name: str, worker: int, rng: random.Random, audio_ids: List[int]) -> None:
+        from database import AdminsPermissions, AudioFiles, Chats, Users
+
+        user_id = self.user_id(worker)
+        if name == "users_get":
+            await Users.get(user_id=user_id)
+        elif name == "set_waiting_for":
+            await Users.set_waiting_for(user_id=user_id, wait_input="title",
+                                        audio_id=audio_ids[-1] if audio_ids else None,
+                                        waiting_for_message_id=rng.randint(1, 10 ** 6))
+        elif name == "audio_create":
+            audio = await AudioFiles.create(user_id=user_id, file_id=f"stress_{worker}_{rng.random()}",
+                                            file_name="stress.mp3", file_size=rng.randint(10 ** 5, 10 ** 7),
+                                            mime_type="audio/mpeg", file_date=datetime.now())
+            audio_ids.append(audio["audio_id"])
+        elif name == "audio_update":
+            if audio_ids:
+                await AudioFiles.update(user_id=user_id, audio_id=rng.choice(audio_ids),
+                                        title=f"Title {rng.random()}", cut_start=1, cut_end=30)
+        elif name == "audio_delete":
+            if audio_ids:
+                await Users.clear_waiting_for(user_id=user_id)
+                await AudioFiles.delete(user_id=user_id, audio_id=audio_ids.pop(rng.randrange(len(audio_ids))))
+        elif name == "is_admin":
+            await AdminsPermissions.is_admin(self.client, self.chat_id(rng.randrange(10)), user_id, "can_restrict_members")
+        elif name == "stats_counts":
+            await Users.count()
+            await Users.count_by(is_active=True)
+            await Chats.count()
+            await Chats.count_by(is_active=True)
+        else:
+            raise ValueError(f"Unknown operation {name}")
+
+    async def worker(self, worker: int, deadline: float) -> None:
+        rng = random.Random(self.seed * 100003 + worker)
+        names = list(self.weights)
+        weights = [self.weights[name] for name in names]
+        audio_ids: List[int] = []
+        while time.perf_counter() < deadline:
+            name = rng.choices(names, weights)[0]
+            start = time.perf_counter()
+            try:
+                await self._operation(name, worker, rng, audio_ids)
+            except Exception:
+                self.errors[name] += 1
+            else:
+                self.latencies[name].append(time.perf_counter() - start)
+
+    async def run(self, concurrency: int, duration: float) -> Dict:
+        start = time.perf_counter()
+        await asyncio.gather(*(self.worker(worker, start + duration) for worker in range(concurrency)))
+        elapsed = time.perf_counter() - start
+        operations = {}
+        for name in self.weights:
+            stats = summarize(self.latencies[name])
+            stats["errors"] = self.errors[name]
+            stats["throughput"] = stats["count"] / elapsed
+            operations[name] = stats
+        total = sum(stats["count"] for stats in operations.values())
+        return {
+            "concurrency": concurrency,
+            "elapsed": elapsed,
+            "operations_per_second": total / elapsed,
+            "lock_errors": self.lock_errors,
+            "db_errors": self.db_errors,
+            "operations": operations,
+        }
+
+
+async def run_db_stress(concurrency: int = 8, duration: float = 5.0, weights: Optional[Dict[str, int]] = None,
+                        seed: int = 0) -> Dict:
+    """Create the tables, seed data and run one stress level.
+
+    The database comes from ``DATABASE_URL``; call ``use_temp_database()``
+    first for an isolated SQLite file.
+    """
+    from database import create_tables
+
+    await create_tables()
+    stress = DatabaseStress(weights or DEFAULT_WEIGHTS, seed)
+    stress.attach_error_listener()
+    await stress.seed_data(concurrency)
+    return await stress.run(concurrency, duration)
+
+
+def print_results(result: Dict) -> None:
+    print(f"\nconcurrency {result['concurrency']}: {result['operations_per_second']:.1f} ops/s, "
+          f"{result['lock_errors']} lock errors, {result['db_errors']} database errors")
+    print(format_table(result["operations"], ("count", "mean", "p50", "p95", "p99", "max")))
+    failed = {name: stats["errors"] for name, stats in result["operations"].items() if stats["errors"]}
+    if failed:
+        print("failed calls: " + ", ".join(f"{name}={count}" for name, count in failed.items()))
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Stress the database layer with concurrent mixed workloads")
+    parser.add_argument("--concurrency", default="1,8,32", help="Comma separated numbers of concurrent coroutines")
+    parser.add_argument("--duration", type=float, default=5.0, help="Seconds to run each concurrency level")
+    parser.add_argument("--weights", help="Override the mix, e.g. users_get=50,audio_update=50")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--database-url", help="Database to stress (default: a temporary SQLite file)")
+    parser.add_argument("--output", help="Results JSON path (default: benchmarks/baselines/db.json)")
+    args = parser.parse_args(argv)
+
+    weights = dict(DEFAULT_WEIGHTS)
+    if args.weights:
+        weights = {}
+        for item in args.weights.split(","):
+            name, _, value = item.partition("=")
+            if name.strip() not in DEFAULT_WEIGHTS:
+                parser.error(f"Unknown operation {name}")
+            weights[name.strip()] = int(value)
+
+    os.environ.setdefault("LOG_LEVEL", "CRITICAL")
+    levels = []
+    for concurrency in [int(value) for value in args.concurrency.split(",") if value.strip()]:
+        # Every level gets a fresh database so earlier rows don't skew the next one
+        if args.database_url:
+            os.environ["DATABASE_URL"] = args.database_url
+        levels.append(_run_level(concurrency, args.duration, weights, args.seed, args.database_url is None))
+        print_results(levels[-1])
+
+    path = write_results("db", {"params": {"duration": args.duration, "weights": weights, "seed": args.seed},
+                                "levels": levels}, args.output)
+    print(f"\nResults written to {path}")
+    return 0
+
+
+def _run_level(concurrency: int, duration: float, weights: Dict[str, int], seed: int, temp_database: bool) -> Dict:
+    """Run one level in a fresh interpreter state so the engine is bound to a new database."""
+    for name in [name for name in sys.modules if name == "database" or name.startswith("database.")]:
+        del sys.modules[name]
+    if temp_database:
+        use_temp_database("db_stress_")
+    return asyncio.run(run_db_stress(concurrency, duration, weights, seed))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
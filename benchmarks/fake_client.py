@@ -0,0 +1,251 @@
+"""
+A local stand-in for ``pyrogram.Client``.
+
+It dispatches synthetic updates through registered handlers the same way
+Pyrogram's dispatcher does (first matching handler of a group wins) and
+implements the Client methods the bot calls, keeping media in memory and
+recording every outgoing message instead of talking to Telegram.
+"""
+
+import asyncio
+import io
+import itertools
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Union
+from pyrogram import ContinuePropagation, StopPropagation
+from pyrogram.enums import ChatType, ParseMode
+from pyrogram.handlers import CallbackQueryHandler, MessageHandler
+from pyrogram.handlers.handler import Handler
+from pyrogram.types import Audio, CallbackQuery, Chat, Document, Message, Photo, Thumbnail, User, Voice
+
+
+class FakeClient:
+    """Minimal in-memory implementation of the Client API used by the handlers.
+
+    Args:
+        latency: Seconds to sleep on every API call, to emulate round trips
+        upload_bandwidth: Bytes per second used to emulate upload time (0 for instant)
+        download_bandwidth: Bytes per second used to emulate download time (0 for instant)
+    """
+
+    def __init__(self, latency: float = 0.0, upload_bandwidth: float = 0, download_bandwidth: float = 0):
+        self.latency = latency
+        self.upload_bandwidth = upload_bandwidth
+        self.download_bandwidth = download_bandwidth
+        self.parse_mode = ParseMode.DEFAULT
+        self.me = User(id=1, is_bot=True, first_name="Bench", username="bench_bot")
+        self.me._client = self
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.executor = ThreadPoolExecutor(4, thread_name_prefix="FakeClientHandler")
+        self.handlers: Dict[int, List[Handler]] = {}
+        self.media: Dict[str, bytes] = {}
+        self.sent: Dict[int, List[Message]] = {}
+        self.api_calls: Dict[str, int] = {}
+        self.uploads: Dict[int, int] = {}
+        self.download_dir = tempfile.mkdtemp(prefix="fake_client_")
+        self._ids = itertools.count(1000)
+
+    # Handler registration and dispatch
+
+    def add_handler(self, handler: Handler, group: int = 0) -> tuple:
+        self.handlers.setdefault(group, []).append(handler)
+        return handler, group
+
+    async def dispatch(self, update: Union[Message, CallbackQuery]) -> bool:
+        """Run ``update`` through the handlers, returning True if one handled it."""
+        self.loop = self.loop or asyncio.get_running_loop()
+        handler_type = CallbackQueryHandler if isinstance(update, CallbackQuery) else MessageHandler
+        handled = False
+        for group in sorted(self.handlers):
+            for handler in self.handlers[group]:
+                if not isinstance(handler, handler_type) or not await handler.check(self, update):
+                    continue
+                handled = True
+                try:
+                    await handler.callback(self, update)
+                except StopPropagation:
+                    return handled
+                except ContinuePropagation:
+                    continue
+                break
+        return handled
+
+    # Synthetic updates
+
+    def user(self, user_id: int) -> User:
+        user = User(id=user_id, is_bot=False, first_name=f"User{user_id}", username=f"user{user_id}", language_code="en")
+        user._client = self
+        return user
+
+    def private_chat(self, user_id: int) -> Chat:
+        return Chat(id=user_id, type=ChatType.PRIVATE, first_name=f"User{user_id}", client=self)
+
+    def message(self, user_id: int, text: Optional[str] = None, **media: Any) -> Message:
+        return Message(client=self, id=next(self._ids), from_user=self.user(user_id),
+                       chat=self.private_chat(user_id), date=datetime.now(), text=text, **media)
+
+    def callback_query(self, user_id: int, data: str, message: Optional[Message] = None) -> CallbackQuery:
+        message = message or self.message(user_id)
+        return CallbackQuery(client=self, id=str(next(self._ids)), from_user=self.user(user_id),
+                             chat_instance=str(user_id), message=message, data=data)
+
+    def add_media(self, data: bytes, file_id: Optional[str] = None) -> str:
+        file_id = file_id or f"media_{next(self._ids)}"
+        self.media[file_id] = data
+        return file_id
+
+    def audio_message(self, user_id: int, data: bytes, file_name: str = "bench.mp3", mime_type: str = "audio/mpeg",
+                      duration: int = 0, title: Optional[str] = None, as_document: bool = False,
+                      media_group_id: Optional[str] = None, file_size: Optional[int] = None) -> Message:
+        """``file_size`` overrides the reported size, e.g. to replay a recorded upload with smaller media."""
+        file_id = self.add_media(data)
+        file_size = file_size or len(data)
+        if as_document:
+            media = Document(client=self, file_id=file_id, file_unique_id=f"u{file_id}", file_name=file_name,
+                             mime_type=mime_type, file_size=file_size, date=datetime.now())
+            return self.message(user_id, document=media, media_group_id=media_group_id)
+        media = Audio(client=self, file_id=file_id, file_unique_id=f"u{file_id}", duration=duration,
+                      file_name=file_name, mime_type=mime_type, file_size=file_size, date=datetime.now(), title=title)
+        return self.message(user_id, audio=media, media_group_id=media_group_id)
+
+    def voice_message(self, user_id: int, data: bytes, duration: int = 0, file_size: Optional[int] = None) -> Message:
+        file_id = self.add_media(data)
+        media = Voice(client=self, file_id=file_id, file_unique_id=f"u{file_id}", duration=duration,
+                      mime_type="audio/ogg", file_size=file_size or len(data), date=datetime.now())
+        return self.message(user_id, voice=media)
+
+    def photo_message(self, user_id: int, data: bytes, width: int, height: int,
+                      file_size: Optional[int] = None) -> Message:
+        file_id = self.add_media(data)
+        size = Thumbnail(client=self, file_id=file_id, file_unique_id=f"u{file_id}", width=width, height=height,
+                         file_size=file_size or len(data))
+        return self.message(user_id, photo=Photo(client=self, sizes=[size], date=datetime.now()))
+
+    def last_sent(self, chat_id: int) -> Optional[Message]:
+        messages = self.sent.get(chat_id)
+        return messages[-1] if messages else None
+
+    # Client API
+
+    async def _api(self, name: str) -> None:
+        self.api_calls[name] = self.api_calls.get(name, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def _transfer(self, size: int, bandwidth: float) -> None:
+        if bandwidth:
+            await asyncio.sleep(size / bandwidth)
+
+    def _outgoing(self, chat_id: int, **fields: Any) -> Message:
+        message = Message(client=self, id=next(self._ids), from_user=self.me, chat=self.private_chat(chat_id),
+                          date=datetime.now(), outgoing=True, **fields)
+        self.sent.setdefault(chat_id, []).append(message)
+        return message
+
+    async def get_me(self) -> User:
+        await self._api("get_me")
+        return self.me
+
+    async def send_message(self, chat_id: int, text: str, reply_markup=None, **kwargs) -> Message:
+        await self._api("send_message")
+        return self._outgoing(chat_id, text=text, reply_markup=reply_markup)
+
+    async def edit_message_text(self, chat_id: int, message_id: int, text: str, reply_markup=None, **kwargs) -> Message:
+        await self._api("edit_message_text")
+        return self._outgoing(chat_id, text=text, reply_markup=reply_markup)
+
+    async def delete_messages(self, chat_id: int, message_ids, revoke: bool = True, **kwargs) -> int:
+        await self._api("delete_messages")
+        return 1 if isinstance(message_ids, int) else len(list(message_ids))
+
+    async def answer_callback_query(self, callback_query_id: str, text: str = None, show_alert: bool = None, **kwargs) -> bool:
+        await self._api("answer_callback_query")
+        return True
+
+    async def download_media(self, message, file_name: str = None, in_memory: bool = False, **kwargs):
+        await self._api("download_media")
+        file_id = message if isinstance(message, str) else self._media_of(message).file_id
+        data = self.media[file_id]
+        await self._transfer(len(data), self.download_bandwidth)
+        if in_memory:
+            buffer = io.BytesIO(data)
+            buffer.name = file_name or file_id
+            return buffer
+        fd, path = tempfile.mkstemp(prefix=f"{file_id}_", dir=self.download_dir)
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        return path
+
+    async def stream_media(self, message, limit: int = 0, offset: int = 0):
+        await self._api("stream_media")
+        file_id = message if isinstance(message, str) else self._media_of(message).file_id
+        data = self.media[file_id]
+        chunk_size = 1024 * 1024
+        chunks = [data[i:i + chunk_size] for i in range(0, len(data), chunk_size)]
+        chunks = chunks[offset:] if offset >= 0 else chunks[offset:]
+        for index, chunk in enumerate(chunks):
+            if limit and index >= limit:
+                break
+            await self._transfer(len(chunk), self.download_bandwidth)
+            yield chunk
+
+    async def _upload(self, chat_id: int, media) -> int:
+        self.uploads[chat_id] = self.uploads.get(chat_id, 0) + 1
+        return await self._read_upload(media)
+
+    async def _read_upload(self, media) -> int:
+        if media is None or (isinstance(media, str) and not os.path.exists(media)):
+            return 0
+        if isinstance(media, str):
+            size = os.path.getsize(media)
+        else:
+            size = len(media.read())
+        await self._transfer(size, self.upload_bandwidth)
+        return size
+
+    async def send_audio(self, chat_id: int, audio, **kwargs) -> Message:
+        await self._api("send_audio")
+        await self._upload(chat_id, audio)
+        await self._read_upload(kwargs.get("thumb"))
+        return self._outgoing(chat_id, caption=kwargs.get("caption"))
+
+    async def send_voice(self, chat_id: int, voice, **kwargs) -> Message:
+        await self._api("send_voice")
+        await self._upload(chat_id, voice)
+        return self._outgoing(chat_id, caption=kwargs.get("caption"))
+
+    async def send_photo(self, chat_id: int, photo, **kwargs) -> Message:
+        await self._api("send_photo")
+        await self._upload(chat_id, photo)
+        return self._outgoing(chat_id, caption=kwargs.get("caption"), reply_markup=kwargs.get("reply_markup"))
+
+    async def send_document(self, chat_id: int, document, **kwargs) -> Message:
+        await self._api("send_document")
+        await self._upload(chat_id, document)
+        return self._outgoing(chat_id, caption=kwargs.get("caption"))
+
+    async def send_media_group(self, chat_id: int, media: list, **kwargs) -> List[Message]:
+        await self._api("send_media_group")
+        for item in media:
+            await self._upload(chat_id, item.media)
+        return [self._outgoing(chat_id) for _ in media]
+
+    async def get_chat(self, chat_id: int) -> Chat:
+        await self._api("get_chat")
+        return self.private_chat(chat_id)
+
+    @staticmethod
+    def _media_of(message: Message):
+        for attribute in ("audio", "document", "voice"):
+            media = getattr(message, attribute, None)
+            if media:
+                return media
+        if message.photo:
+            return message.photo.sizes[-1]
+        raise ValueError("Message has no media")
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,154 @@
+"""
+Cover-art processing benchmark focused on event loop blocking.
+
+A ticker coroutine wakes up every millisecond while ``download_and_process_image``
+runs against ``FakeClient`` and records how late each wake-up is. The time
+the loop was blocked is the sum of those delays above a small tolerance.
+
+Modes:
+    inline    the processing call made directly in the coroutine (the old behavior)
+    thread    ``download_and_process_image`` as shipped, processing in a worker thread
+
+Usage:
+    python -m benchmarks.image_bench
+    python -m benchmarks.image_bench --sizes 1280x1280,4000x3000 --presets fast,quality --repeat 5
+"""
+
+import argparse
+import asyncio
+import io
+import os
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
+
+from benchmarks.common import write_results
+
+
+DEFAULT_SIZES = ((1280, 1280), (2560, 2560), (4000, 3000))
+MODES = ("inline", "thread")
+BLOCK_TOLERANCE = 0.002
+
+
+def make_photo(width: int, height: int, fmt: str = "JPEG") -> bytes:
+    """A noisy photo, so compression and decoding cost is realistic."""
+    from PIL import Image
+    image = Image.effect_noise((width, height), 48).convert("RGB")
+    buffer = io.BytesIO()
+    image.save(buffer, fmt, quality=92)
+    return buffer.getvalue()
+
+
+class LoopMonitor:
+    """Measure how late a periodic wake-up is, to detect blocking calls."""
+
+    def __init__(self, interval: float = 0.001):
+        self.interval = interval
+        self.delays: List[float] = []
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self) -> None:
+        while True:
+            expected = time.perf_counter() + self.interval
+            await asyncio.sleep(self.interval)
+            self.delays.append(max(0.0, time.perf_counter() - expected))
+
+    def __enter__(self) -> "LoopMonitor":
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._task.cancel()
+
+    @property
+    def max_block(self) -> float:
+        return max(self.delays, default=0.0)
+
+    @property
+    def blocked(self) -> float:
+        return sum(delay for delay in self.delays if delay > BLOCK_TOLERANCE)
+
+
+async def _inline(client, file_id: str, preset: str) -> Optional[str]:
+    """Download then process in the coroutine itself, as the handler did before."""
+    from tools.image_utils import process_image
+    original = await client.download_media(file_id)
+    fd, output = tempfile.mkstemp(suffix=".jpg")
+    os.close(fd)
+    process_image(original, output, (500, 500), None, preset)
+    os.unlink(original)
+    return output
+
+
+async def measure(client, file_id: str, mode: str, preset: str) -> Dict[str, float]:
+    from tools.image_utils import download_and_process_image
+    with LoopMonitor() as monitor:
+        # Let the monitor start ticking before the work begins
+        await asyncio.sleep(0.005)
+        start = time.perf_counter()
+        if mode == "inline":
+            output = await _inline(client, file_id, preset)
+        else:
+            output = await download_and_process_image(client, file_id, (500, 500), preset=preset)
+        elapsed = time.perf_counter() - start
+        await asyncio.sleep(0.005)
+    size = os.path.getsize(output) if output and os.path.exists(output) else 0
+    if output and os.path.exists(output):
+        os.unlink(output)
+    return {"seconds": elapsed, "max_block": monitor.max_block, "blocked": monitor.blocked, "output_kb": size / 1024}
+
+
+async def run_bench(sizes: List[Tuple[int, int]], presets: List[str], modes: List[str], repeat: int = 3,
+                    verbose: bool = True) -> Dict[str, Dict]:
+    from benchmarks.fake_client import FakeClient
+    client = FakeClient()
+    results = {}
+    try:
+        for width, height in sizes:
+            file_id = client.add_media(make_photo(width, height))
+            for preset in presets:
+                for mode in modes:
+                    runs = [await measure(client, file_id, mode, preset) for _ in range(repeat)]
+                    runs.sort(key=lambda run: run["seconds"])
+                    key = f"{width}x{height}/{preset}/{mode}"
+                    results[key] = dict(runs[len(runs) // 2])
+                    results[key]["max_block"] = max(run["max_block"] for run in runs)
+                    if verbose:
+                        print_row(key, results[key])
+    finally:
+        client.close()
+    return results
+
+
+def print_row(key: str, result: Dict[str, float]) -> None:
+    print(f"{key:<30} time {result['seconds'] * 1000:>8.1f}ms  loop blocked {result['blocked'] * 1000:>8.1f}ms  "
+          f"max block {result['max_block'] * 1000:>7.1f}ms  output {result['output_kb']:>6.1f}KB")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Measure cover-art processing time and event loop blocking")
+    parser.add_argument("--sizes", default=",".join(f"{w}x{h}" for w, h in DEFAULT_SIZES),
+                        help="Comma separated source photo sizes, e.g. 1280x1280,4000x3000")
+    parser.add_argument("--presets", default="fast,balanced,quality", help="Comma separated IMAGE_PRESETS")
+    parser.add_argument("--modes", default=",".join(MODES), help="Comma separated modes: inline,thread")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per case; the median time is kept")
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    from tools.image_utils import IMAGE_PRESETS
+    sizes = [tuple(int(part) for part in size.lower().split("x")) for size in args.sizes.split(",") if size.strip()]
+    presets = [preset.strip() for preset in args.presets.split(",") if preset.strip()]
+    modes = [mode.strip() for mode in args.modes.split(",") if mode.strip()]
+    if set(presets) - set(IMAGE_PRESETS) or set(modes) - set(MODES):
+        parser.error("Unknown preset or mode")
+
+    results = asyncio.run(run_bench(sizes, presets, modes, max(1, args.repeat)))
+    if args.output:
+        write_results("image", {"results": results}, args.output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,153 @@
+"""
+Large-file stress test: peak memory of renders must not follow the file size.
+
+Renders inputs far past ``MAX_AUDIO_SIZE`` (WAV by default, so an hour is
+over 600 MB) in fresh worker processes and fails when a render's peak RSS
+exceeds ``RENDER_MEMORY_BUDGET``, which the workers size their blocks to,
+or when it grows with the input length by more than ``--growth-mb``
+between the shortest and longest input of a scenario. Scenarios:
+
+    export   re-export with tags, a single ffmpeg process
+    effects  speed, gain, normalize, loudness and the longest fades, streamed through Python
+    reverse  reverse (spooled to disk) over three ranges spliced with the longest crossfade
+
+Usage:
+    python -m benchmarks.large_file_stress
+    python -m benchmarks.large_file_stress --durations 600,3600,10800 --scenarios effects --budget-mb 192
+    python -m benchmarks.large_file_stress --backend pydub   # large files still take the streaming path
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from benchmarks.audio_bench import ROOT_DIR, input_path, print_row, run_worker
+from benchmarks.common import write_results
+
+
+SCENARIOS = ("export", "effects", "reverse")
+DEFAULT_DURATIONS = (600, 3600, 7200)
+DEFAULT_GROWTH_MB = 16.0
+
+
+def scenario_arguments(scenario: str, duration: float) -> Dict:
+    """``run_worker`` arguments for a scenario: the audio_bench scenario plus ``process_audio`` kwargs."""
+    from tools.effects import EFFECT_RANGES
+
+    if scenario == "export":
+        return {"scenario": "metadata"}
+    if scenario == "effects":
+        return {"scenario": "long_cut",
+                "effects": [{"type": "speed", "value": 1.25}, {"type": "gain", "value": -3.0},
+                            {"type": "normalize"}, {"type": "loudness"},
+                            {"type": "fade_in", "value": EFFECT_RANGES["fade_in"][1]},
+                            {"type": "fade_out", "value": EFFECT_RANGES["fade_out"][1]}]}
+    if scenario == "reverse":
+        third = duration / 3
+        return {"scenario": "metadata",
+                "segments": [[0.0, third * 0.9], [third, third * 1.9], [third * 2, duration]],
+                "effects": [{"type": "crossfade", "value": EFFECT_RANGES["crossfade"][1]}, {"type": "reverse"}]}
+    raise ValueError(f"Unknown scenario {scenario}")
+
+
+def measure(source: Path, scenario: str, duration: float, backend: Optional[str] = None,
+            budget_mb: Optional[float] = None) -> Dict:
+    """Render one case in a fresh interpreter and return the audio_bench measurements."""
+    command = [sys.executable, "-m", "benchmarks.large_file_stress", "--worker",
+               json.dumps({"source": str(source), "scenario": scenario, "duration": duration})]
+    env = dict(os.environ, LOG_LEVEL=os.environ.get("LOG_LEVEL", "WARNING"))
+    if backend:
+        env["AUDIO_BACKEND"] = backend
+    if budget_mb:
+        env["RENDER_MEMORY_BUDGET"] = str(int(budget_mb))
+    result = subprocess.run(command, cwd=ROOT_DIR, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    if result.returncode != 0:
+        return {"success": False, "message": result.stderr.strip().splitlines()[-1:] or "worker failed"}
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def check(results: Dict[str, Dict], scenarios: List[str], durations: List[float], budget_mb: float,
+          growth_mb: float) -> List[str]:
+    """Return the budget and growth violations, empty when memory stayed bounded."""
+    failures = []
+    for key, result in results.items():
+        if not result.get("success"):
+            failures.append(f"{key}: render failed ({result.get('message')})")
+        elif result["peak_rss_mb"] > budget_mb:
+            failures.append(f"{key}: peak RSS {result['peak_rss_mb']:.1f}MB over the {budget_mb:g}MB budget")
+    shortest, longest = min(durations), max(durations)
+    for scenario in scenarios:
+        first = results.get(f"{int(shortest)}s/{scenario}", {})
+        last = results.get(f"{int(longest)}s/{scenario}", {})
+        if first.get("success") and last.get("success"):
+            growth = last["peak_rss_mb"] - first["peak_rss_mb"]
+            if growth > growth_mb:
+                failures.append(f"{scenario}: peak RSS grew {growth:.1f}MB from {int(shortest)}s to {int(longest)}s")
+    return failures
+
+
+def _csv(value: str) -> List[str]:
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Check that render memory stays bounded on large files")
+    parser.add_argument("--durations", default=",".join(map(str, DEFAULT_DURATIONS)),
+                        help="Comma separated input durations in seconds")
+    parser.add_argument("--format", default="wav", help="Input format (WAV gives the largest files)")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Comma separated scenarios")
+    parser.add_argument("--backend", help="AUDIO_BACKEND of the workers (default: inherited)")
+    parser.add_argument("--budget-mb", type=float, help="Peak RSS limit per render (default: RENDER_MEMORY_BUDGET)")
+    parser.add_argument("--growth-mb", type=float, default=DEFAULT_GROWTH_MB,
+                        help="Allowed peak RSS growth from the shortest to the longest input")
+    parser.add_argument("--cache-dir", help="Where generated inputs are kept between runs")
+    parser.add_argument("--output", help="Results JSON path (default: benchmarks/baselines/large_files.json)")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        params = json.loads(args.worker)
+        kwargs = scenario_arguments(params["scenario"], params["duration"])
+        print(json.dumps(run_worker(params["source"], duration=params["duration"], **kwargs)))
+        return 0
+
+    from tools.audio_utils import RENDER_MEMORY_BUDGET
+
+    scenarios = _csv(args.scenarios)
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+    durations = [float(value) for value in _csv(args.durations)]
+    budget_mb = args.budget_mb or RENDER_MEMORY_BUDGET / (1024 * 1024)
+    cache_dir = Path(args.cache_dir) if args.cache_dir else Path(tempfile.gettempdir()) / "audio_bench_inputs"
+    cache_dir.mkdir(parents=True, exist_ok=True)
+
+    results = {}
+    for duration in durations:
+        source = input_path(cache_dir, args.format, duration)
+        print(f"{int(duration)}s input: {source.stat().st_size / (1024 * 1024):.0f}MB")
+        for scenario in scenarios:
+            key = f"{int(duration)}s/{scenario}"
+            results[key] = measure(source, scenario, duration, args.backend, args.budget_mb)
+            print_row(key, results[key])
+
+    failures = check(results, scenarios, durations, budget_mb, args.growth_mb)
+    path = write_results("large_files", {"params": {"durations": durations, "format": args.format,
+                                                     "scenarios": scenarios, "backend": args.backend,
+                                                     "budget_mb": budget_mb, "growth_mb": args.growth_mb},
+                                          "results": results, "failures": failures}, args.output)
+    print(f"\nResults written to {path}")
+    for failure in failures:
+        print(f"FAIL {failure}")
+    if not failures:
+        print(f"Peak RSS stayed under {budget_mb:g}MB at every size")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
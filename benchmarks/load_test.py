@@ -0,0 +1,226 @@
+"""
+End-to-end load test of the real handler lists through ``FakeClient``.
+
+Each virtual user uploads a synthetic track and then runs the selected
+operations against it: a metadata text edit, a cut, and a "done" render.
+Latency is measured per operation from the first update sent until the
+handlers return, and throughput is reported in updates per second.
+
+Usage:
+    python -m benchmarks.load_test --users 50 --concurrency 10 --iterations 3
+    python -m benchmarks.load_test --ops text_edit,cut --latency-ms 50 --output results.json
+"""
+
+import argparse
+import asyncio
+import os
+import re
+import sys
+import time
+from typing import Dict, List, Optional
+
+from benchmarks.common import encode_media, format_table, summarize, use_temp_database, write_results
+
+
+OPERATIONS = ("upload", "text_edit", "cut", "done")
+_AUDIO_ID_PATTERN = re.compile(r"^done:(\d+)$")
+
+
+def build_client(latency: float = 0.0, upload_bandwidth: float = 0, download_bandwidth: float = 0):
+    """Create a FakeClient with the same handler lists ``index.py`` registers."""
+    from benchmarks.fake_client import FakeClient
+    from bot import settings_callback_handlers, settings_handlers
+    from handlers import callback_query_handlers, commands_handlers, message_handlers
+    from tools.tools import register_handlers
+
+    client = FakeClient(latency=latency, upload_bandwidth=upload_bandwidth, download_bandwidth=download_bandwidth)
+    register_handlers(
+        client,
+        commands_handlers,
+        callback_query_handlers,
+        settings_handlers,
+        settings_callback_handlers,
+        message_handlers
+    )
+    return client
+
+
+def find_audio_id(message) -> Optional[int]:
+    """Extract the audio id from the edit menu attached to ``message``."""
+    if message is None or not message.reply_markup:
+        return None
+    for row in message.reply_markup.inline_keyboard:
+        for button in row:
+            match = _AUDIO_ID_PATTERN.match(button.callback_data or "")
+            if match:
+                return int(match.group(1))
+    return None
+
+
+class LoadTest:
+    """Drive virtual users through the handlers and collect latencies."""
+
+    def __init__(self, client, media: bytes, file_name: str, mime_type: str, duration: int, operations: List[str]):
+        self.client = client
+        self.media = media
+        self.file_name = file_name
+        self.mime_type = mime_type
+        self.duration = duration
+        self.operations = operations
+        self.latencies: Dict[str, List[float]] = {name: [] for name in OPERATIONS}
+        self.errors: Dict[str, int] = {name: 0 for name in OPERATIONS}
+        self.updates = 0
+
+    async def _send(self, update) -> None:
+        self.updates += 1
+        await self.client.dispatch(update)
+
+    async def _timed(self, operation: str, *updates) -> None:
+        start = time.perf_counter()
+        for update in updates:
+            await self._send(update)
+        self.latencies[operation].append(time.perf_counter() - start)
+
+    async def prepare_user(self, user_id: int) -> None:
+        from database import Users
+        await Users.create(user_id=user_id, full_name=f"User{user_id}", username=f"user{user_id}", language="en")
+
+    async def run_user(self, user_id: int, iterations: int) -> None:
+        client = self.client
+        for iteration in range(iterations):
+            upload = client.audio_message(user_id, self.media, file_name=self.file_name,
+                                          mime_type=self.mime_type, duration=self.duration)
+            await self._timed("upload", upload)
+            menu = client.last_sent(user_id)
+            audio_id = find_audio_id(menu)
+            if audio_id is None:
+                self.errors["upload"] += 1
+                continue
+
+            if "text_edit" in self.operations:
+                await self._timed(
+                    "text_edit",
+                    client.callback_query(user_id, f"title:{audio_id}", menu),
+                    client.message(user_id, text=f"Bench title {iteration}")
+                )
+                if find_audio_id(client.last_sent(user_id)) != audio_id:
+                    self.errors["text_edit"] += 1
+
+            if "cut" in self.operations:
+                end = max(2, min(self.duration, 10))
+                await self._timed(
+                    "cut",
+                    client.callback_query(user_id, f"cut:{audio_id}", menu),
+                    client.message(user_id, text=f"0:01-0:{end:02d}")
+                )
+                if find_audio_id(client.last_sent(user_id)) != audio_id:
+                    self.errors["cut"] += 1
+
+            if "done" in self.operations:
+                uploads_before = client.uploads.get(user_id, 0)
+                await self._timed("done", client.callback_query(user_id, f"done:{audio_id}", menu))
+                if client.uploads.get(user_id, 0) == uploads_before:
+                    self.errors["done"] += 1
+
+    async def run(self, users: int, concurrency: int, iterations: int, first_user_id: int = 100000) -> Dict:
+        user_ids = list(range(first_user_id, first_user_id + users))
+        for user_id in user_ids:
+            await self.prepare_user(user_id)
+
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def limited(user_id: int) -> None:
+            async with semaphore:
+                await self.run_user(user_id, iterations)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(limited(user_id) for user_id in user_ids))
+        elapsed = time.perf_counter() - start
+
+        operations = {name: summarize(values) for name, values in self.latencies.items() if values}
+        for name, stats in operations.items():
+            stats["errors"] = self.errors[name]
+            stats["throughput"] = stats["count"] / elapsed if elapsed else 0.0
+        return {
+            "elapsed": elapsed,
+            "updates": self.updates,
+            "updates_per_second": self.updates / elapsed if elapsed else 0.0,
+            "operations": operations,
+        }
+
+
+async def run_load_test(users: int = 10, concurrency: int = 5, iterations: int = 1, media_seconds: float = 30,
+                        media_format: str = "mp3", operations: Optional[List[str]] = None,
+                        latency: float = 0.0, upload_bandwidth: float = 0, download_bandwidth: float = 0) -> Dict:
+    """Run one load test and return its results (requires ``use_temp_database()`` first)."""
+    from database import create_tables
+
+    operations = operations or ["text_edit", "cut", "done"]
+    await create_tables()
+    client = build_client(latency, upload_bandwidth, download_bandwidth)
+    media = encode_media(media_seconds, media_format)
+    mime_types = {"mp3": "audio/mpeg", "wav": "audio/wav", "ogg": "audio/ogg", "wma": "audio/x-ms-wma"}
+    test = LoadTest(client, media, f"bench.{media_format}", mime_types.get(media_format, "audio/mpeg"),
+                    int(media_seconds), operations)
+    try:
+        results = await test.run(users, concurrency, iterations)
+    finally:
+        client.close()
+    results["params"] = {
+        "users": users, "concurrency": concurrency, "iterations": iterations, "media_seconds": media_seconds,
+        "media_format": media_format, "operations": operations, "latency": latency,
+        "upload_bandwidth": upload_bandwidth, "download_bandwidth": download_bandwidth,
+    }
+    return results
+
+
+def print_results(results: Dict) -> None:
+    print(format_table(results["operations"], ("count", "mean", "p50", "p95", "p99", "max")))
+    print()
+    for name, stats in results["operations"].items():
+        if stats["errors"]:
+            print(f"{name}: {stats['errors']} failed")
+    print(f"{results['updates']} updates in {results['elapsed']:.2f}s "
+          f"({results['updates_per_second']:.1f} updates/s)")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Load test the bot handlers with a fake Telegram client")
+    parser.add_argument("--users", type=int, default=10, help="Number of virtual users")
+    parser.add_argument("--concurrency", type=int, default=5, help="Virtual users running at the same time")
+    parser.add_argument("--iterations", type=int, default=1, help="Edit sessions per user")
+    parser.add_argument("--media-seconds", type=float, default=30, help="Duration of the synthetic track")
+    parser.add_argument("--media-format", default="mp3", choices=("mp3", "wav", "ogg", "wma"))
+    parser.add_argument("--ops", default="text_edit,cut,done", help="Comma separated operations: text_edit,cut,done")
+    parser.add_argument("--latency-ms", type=float, default=0, help="Emulated latency of every Telegram API call")
+    parser.add_argument("--upload-mbps", type=float, default=0, help="Emulated upload bandwidth (0 for instant)")
+    parser.add_argument("--download-mbps", type=float, default=0, help="Emulated download bandwidth (0 for instant)")
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    use_temp_database("load_test_")
+    operations = [op.strip() for op in args.ops.split(",") if op.strip()]
+    unknown = set(operations) - set(OPERATIONS)
+    if unknown:
+        parser.error(f"Unknown operations: {', '.join(sorted(unknown))}")
+
+    results = asyncio.run(run_load_test(
+        users=args.users,
+        concurrency=args.concurrency,
+        iterations=args.iterations,
+        media_seconds=args.media_seconds,
+        media_format=args.media_format,
+        operations=operations,
+        latency=args.latency_ms / 1000,
+        upload_bandwidth=args.upload_mbps * 125000,
+        download_bandwidth=args.download_mbps * 125000,
+    ))
+    print_results(results)
+    if args.output:
+        write_results("load_test", results, args.output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
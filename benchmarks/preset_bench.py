@@ -0,0 +1,143 @@
+"""
+Output preset benchmark: encode time against upload time saved.
+
+Each preset renders the same synthetic track through ``process_audio``.
+Upload time is estimated from the output size and an uplink speed, so a
+preset pays off when the upload time it saves, compared to keeping the
+input's format (the "original" row), is more than its extra encode time.
+
+Usage:
+    python -m benchmarks.preset_bench
+    python -m benchmarks.preset_bench --durations 60,600 --uplink-mbps 5 --presets mp3_128,opus_64,fit_10
+"""
+
+import argparse
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from benchmarks.common import encode_media, write_results
+
+
+DEFAULT_DURATIONS = (60, 600)
+DEFAULT_UPLINK_MBPS = 20.0
+INPUT_FORMAT = "mp3"
+
+
+def _cpu_seconds() -> float:
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+def measure(source: str, preset: Optional[str], uplink_mbps: float, repeat: int = 1) -> Dict:
+    """Render ``source`` with ``preset`` and return the median encode time, size and estimated upload time."""
+    from tools.audio_utils import process_audio
+    from tools.presets import preset_extension
+
+    output_dir = tempfile.mkdtemp(prefix="preset_bench_")
+    output = os.path.join(output_dir, f"output.{preset_extension(preset, INPUT_FORMAT)}")
+    runs = []
+    try:
+        for _ in range(repeat):
+            cpu_before = _cpu_seconds()
+            wall_start = time.perf_counter()
+            success, message = process_audio(input_path=source, output_path=output, language="en",
+                                             title="Benchmark", artist="Bench", preset=preset)
+            wall = time.perf_counter() - wall_start
+            if not success:
+                return {"success": False, "message": message}
+            runs.append((wall, _cpu_seconds() - cpu_before))
+        output_size = os.path.getsize(output)
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+    runs.sort()
+    wall, cpu = runs[len(runs) // 2]
+    upload = output_size * 8 / (uplink_mbps * 1_000_000)
+    return {
+        "success": True,
+        "encode_seconds": wall,
+        "cpu_seconds": cpu,
+        "output_mb": output_size / (1024 * 1024),
+        "upload_seconds": upload,
+        "total_seconds": wall + upload,
+    }
+
+
+def run_suite(presets: List[Optional[str]], durations: List[float], uplink_mbps: float, repeat: int = 1,
+              cache_dir: Optional[Path] = None, verbose: bool = True) -> Dict[str, Dict]:
+    cache_dir = cache_dir or Path(tempfile.gettempdir()) / "audio_bench_inputs"
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    results = {}
+    for duration in durations:
+        source = cache_dir / f"tone_{int(duration)}s.{INPUT_FORMAT}"
+        if not source.exists():
+            encode_media(duration, INPUT_FORMAT, output_path=str(source))
+        baseline = None
+        for preset in presets:
+            key = f"{int(duration)}s/{preset or 'original'}"
+            result = measure(str(source), preset, uplink_mbps, repeat)
+            if result.get("success"):
+                if preset is None:
+                    baseline = result
+                if baseline:
+                    result["upload_saved_seconds"] = baseline["upload_seconds"] - result["upload_seconds"]
+                    result["encode_extra_seconds"] = result["encode_seconds"] - baseline["encode_seconds"]
+                    result["net_saved_seconds"] = baseline["total_seconds"] - result["total_seconds"]
+            results[key] = result
+            if verbose:
+                print_row(key, result)
+    return results
+
+
+def print_row(key: str, result: Dict) -> None:
+    if not result.get("success"):
+        print(f"{key:<20} FAILED {result.get('message')}")
+        return
+    print(f"{key:<20} encode {result['encode_seconds']:>7.2f}s  cpu {result['cpu_seconds']:>7.2f}s  "
+          f"size {result['output_mb']:>7.2f}MB  upload {result['upload_seconds']:>7.2f}s  "
+          f"net saved {result.get('net_saved_seconds', 0.0):>+7.2f}s")
+
+
+def _csv(value: str) -> List[str]:
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    from tools.presets import FIT_PREFIX, FIT_SIZES, OUTPUT_PRESETS, is_preset
+
+    parser = argparse.ArgumentParser(description="Benchmark output presets: encode time against upload time saved")
+    parser.add_argument("--presets", help="Comma separated presets (default: all, plus the fit sizes)")
+    parser.add_argument("--durations", default=",".join(map(str, DEFAULT_DURATIONS)),
+                        help="Comma separated input durations in seconds")
+    parser.add_argument("--uplink-mbps", type=float, default=DEFAULT_UPLINK_MBPS,
+                        help="Upload speed used to estimate upload time, in Mbit/s")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per case; the median encode time is kept")
+    parser.add_argument("--cache-dir", help="Where generated inputs are kept between runs")
+    parser.add_argument("--output", help="Results JSON path (default: benchmarks/baselines/presets.json)")
+    args = parser.parse_args(argv)
+
+    presets = _csv(args.presets) if args.presets else [*OUTPUT_PRESETS, *(f"{FIT_PREFIX}{size}" for size in FIT_SIZES)]
+    unknown = [preset for preset in presets if not is_preset(preset)]
+    if unknown:
+        parser.error(f"Unknown presets: {', '.join(unknown)}")
+    # The original format comes first, as the baseline for the savings
+    presets = [None, *presets]
+    durations = [float(value) for value in _csv(args.durations)]
+
+    results = run_suite(presets, durations, args.uplink_mbps, args.repeat,
+                        Path(args.cache_dir) if args.cache_dir else None)
+    path = write_results("presets", {"params": {"presets": presets, "durations": durations,
+                                                 "uplink_mbps": args.uplink_mbps, "repeat": args.repeat},
+                                      "results": results}, args.output)
+    print(f"\nResults written to {path}")
+    return 0 if all(result.get("success") for result in results.values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
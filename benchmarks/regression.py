@@ -0,0 +1,252 @@
+"""
+Performance regression gate.
+
+Runs quick profiles of the handler load test, the database stress test and
+the ``process_audio`` benchmark, takes the median of a few repeats and
+compares every metric against ``benchmarks/baselines/regression.json``.
+
+A metric only counts as a regression when it moves in the bad direction
+by more than its tolerance, which is the largest of:
+
+    * a relative tolerance for its kind (latency, throughput, memory, ...)
+    * an absolute floor, so sub-millisecond jitter never fails the gate
+    * a multiple of the spread seen across repeats when the baseline was taken
+
+Suites that look regressed are run again and judged on the combined
+samples, so one noisy batch does not fail the gate.
+
+Usage:
+    python -m benchmarks.regression                    # compare, exit 1 on regression
+    python -m benchmarks.regression --update-baseline  # record a new baseline
+    python -m benchmarks.regression --suites handlers,db --repeat 5
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from benchmarks.common import BASELINES_DIR, environment_info, load_results, write_results
+
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+BASELINE_NAME = "regression"
+SUITES = ("handlers", "db", "audio")
+
+# kind: (relative tolerance, absolute floor, higher is better)
+THRESHOLDS = {
+    "latency": (0.30, 0.002, False),
+    "tail_latency": (0.50, 0.005, False),
+    "seconds": (0.35, 0.05, False),
+    "throughput": (0.25, 0.0, True),
+    "memory": (0.20, 8.0, False),
+    "errors": (0.0, 0.0, False),
+    "success": (0.0, 0.0, True),
+}
+SPREAD_FACTOR = 2.0
+
+PROFILES = {
+    "handlers": ["benchmarks.load_test", "--users", "10", "--concurrency", "5", "--iterations", "1",
+                 "--media-seconds", "10", "--ops", "text_edit,cut,done"],
+    "db": ["benchmarks.db_stress", "--concurrency", "8", "--duration", "2"],
+    "audio": ["benchmarks.audio_bench", "--formats", "mp3,wav", "--durations", "30",
+              "--scenarios", "metadata,short_cut"],
+}
+
+Metrics = Dict[str, Tuple[float, str]]
+
+
+def _handler_metrics(results: Dict) -> Metrics:
+    metrics = {"handlers/updates_per_second": (results["updates_per_second"], "throughput")}
+    for name, stats in results["operations"].items():
+        metrics[f"handlers/{name}/p50"] = (stats["p50"], "latency")
+        metrics[f"handlers/{name}/p95"] = (stats["p95"], "tail_latency")
+        metrics[f"handlers/{name}/errors"] = (stats["errors"], "errors")
+    return metrics
+
+
+def _db_metrics(results: Dict) -> Metrics:
+    level = results["levels"][0]
+    metrics = {
+        "db/operations_per_second": (level["operations_per_second"], "throughput"),
+        "db/lock_errors": (level["lock_errors"], "errors"),
+    }
+    for name, stats in level["operations"].items():
+        metrics[f"db/{name}/p50"] = (stats["p50"], "latency")
+        metrics[f"db/{name}/p95"] = (stats["p95"], "tail_latency")
+        metrics[f"db/{name}/errors"] = (stats["errors"], "errors")
+    return metrics
+
+
+def _audio_metrics(results: Dict) -> Metrics:
+    metrics = {}
+    for key, result in results["results"].items():
+        metrics[f"audio/{key}/success"] = (1.0 if result.get("success") else 0.0, "success")
+        if not result.get("success"):
+            continue
+        metrics[f"audio/{key}/wall"] = (result["wall_seconds"], "seconds")
+        metrics[f"audio/{key}/cpu"] = (result["cpu_seconds"], "seconds")
+        metrics[f"audio/{key}/peak_rss_mb"] = (result["peak_rss_mb"], "memory")
+        metrics[f"audio/{key}/peak_temp_mb"] = (result["peak_temp_mb"], "memory")
+    return metrics
+
+
+EXTRACTORS = {"handlers": _handler_metrics, "db": _db_metrics, "audio": _audio_metrics}
+
+
+def run_suite(suite: str) -> Metrics:
+    """Run one benchmark profile in a fresh interpreter and flatten its results."""
+    fd, output = tempfile.mkstemp(prefix=f"regression_{suite}_", suffix=".json")
+    os.close(fd)
+    try:
+        command = [sys.executable, "-m", *PROFILES[suite], "--output", output]
+        env = dict(os.environ, LOG_LEVEL="CRITICAL")
+        result = subprocess.run(command, cwd=ROOT_DIR, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        if result.returncode not in (0, 1) or not os.path.getsize(output):
+            raise RuntimeError(f"{suite} benchmark failed:\n{result.stderr.strip()}")
+        with open(output, "r", encoding="utf-8") as f:
+            return EXTRACTORS[suite](json.load(f))
+    finally:
+        os.remove(output)
+
+
+def collect(suites: List[str], repeat: int, samples: Optional[Dict[str, Dict]] = None,
+            verbose: bool = True) -> Dict[str, Dict]:
+    """Run every suite ``repeat`` times, appending each metric's value to ``samples``."""
+    samples = samples if samples is not None else {}
+    for suite in suites:
+        for run in range(repeat):
+            if verbose:
+                print(f"running {suite} ({run + 1}/{repeat})...", flush=True)
+            for name, (value, kind) in run_suite(suite).items():
+                samples.setdefault(name, {"kind": kind, "values": []})["values"].append(float(value))
+    return samples
+
+
+def summarize_samples(samples: Dict[str, Dict]) -> Dict[str, Dict]:
+    """Reduce raw samples to the median and spread of each metric."""
+    return {
+        name: {"value": statistics.median(sample["values"]),
+               "spread": max(sample["values"]) - min(sample["values"]),
+               "kind": sample["kind"],
+               "values": sample["values"]}
+        for name, sample in samples.items()
+    }
+
+
+def compare(baseline: Dict[str, Dict], current: Dict[str, Dict]) -> List[Dict]:
+    """Return one row per metric with its status: ok, regressed, improved, new or missing."""
+    rows = []
+    for name in sorted(set(baseline) | set(current)):
+        base = baseline.get(name)
+        now = current.get(name)
+        row = {"metric": name, "baseline": base and base["value"], "current": now and now["value"],
+               "tolerance": None, "change": None}
+        if base is None:
+            row["status"] = "new"
+        elif now is None:
+            row["status"] = "missing"
+        else:
+            relative, floor, higher_is_better = THRESHOLDS[base["kind"]]
+            tolerance = max(relative * abs(base["value"]), floor, SPREAD_FACTOR * base.get("spread", 0.0))
+            worse_by = base["value"] - now["value"] if higher_is_better else now["value"] - base["value"]
+            row["tolerance"] = tolerance
+            row["change"] = (now["value"] - base["value"]) / base["value"] if base["value"] else None
+            if worse_by > tolerance:
+                row["status"] = "regressed"
+            elif -worse_by > tolerance:
+                row["status"] = "improved"
+            else:
+                row["status"] = "ok"
+        rows.append(row)
+    return rows
+
+
+def _format_value(name: str, value: Optional[float]) -> str:
+    if value is None:
+        return "-"
+    if name.endswith(("/p50", "/p95")):
+        return f"{value * 1000:.1f}ms"
+    if name.endswith(("/wall", "/cpu")):
+        return f"{value:.2f}s"
+    if name.endswith("_mb"):
+        return f"{value:.1f}MB"
+    if name.endswith("per_second"):
+        return f"{value:.1f}/s"
+    return f"{value:g}"
+
+
+def format_report(rows: List[Dict], show_all: bool = False) -> str:
+    header = f"{'metric':<42}{'baseline':>12}{'current':>12}{'change':>10}{'tolerance':>12}  status"
+    lines = [header, "-" * len(header)]
+    for row in rows:
+        if not show_all and row["status"] == "ok":
+            continue
+        change = f"{row['change'] * 100:+.1f}%" if row["change"] is not None else "-"
+        lines.append(f"{row['metric']:<42}{_format_value(row['metric'], row['baseline']):>12}"
+                     f"{_format_value(row['metric'], row['current']):>12}{change:>10}"
+                     f"{_format_value(row['metric'], row['tolerance']):>12}  {row['status'].upper()}")
+    counts = {}
+    for row in rows:
+        counts[row["status"]] = counts.get(row["status"], 0) + 1
+    lines.append("")
+    lines.append(", ".join(f"{count} {status}" for status, count in sorted(counts.items())))
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Compare benchmark results against the committed baseline")
+    parser.add_argument("--suites", default=",".join(SUITES), help="Comma separated suites: handlers,db,audio")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per suite; the median of each metric is used")
+    parser.add_argument("--baseline", help=f"Baseline JSON path (default: {BASELINES_DIR / (BASELINE_NAME + '.json')})")
+    parser.add_argument("--update-baseline", action="store_true", help="Record the current results as the baseline")
+    parser.add_argument("--no-confirm", dest="confirm", action="store_false",
+                        help="Fail on the first batch instead of re-running suspect suites")
+    parser.add_argument("--all", action="store_true", help="Show unchanged metrics in the report too")
+    args = parser.parse_args(argv)
+
+    suites = [suite.strip() for suite in args.suites.split(",") if suite.strip()]
+    unknown = set(suites) - set(SUITES)
+    if unknown:
+        parser.error(f"Unknown suites: {', '.join(sorted(unknown))}")
+
+    samples = collect(suites, max(1, args.repeat))
+    if args.update_baseline:
+        path = write_results(BASELINE_NAME, {"repeat": args.repeat, "metrics": summarize_samples(samples)},
+                             args.baseline)
+        print(f"Baseline written to {path}")
+        return 0
+
+    stored = load_results(BASELINE_NAME, args.baseline)
+    if stored is None:
+        print("No baseline found, run with --update-baseline first", file=sys.stderr)
+        return 2
+    baseline = {name: metric for name, metric in stored["metrics"].items()
+                if name.split("/", 1)[0] in suites}
+
+    rows = compare(baseline, summarize_samples(samples))
+    suspects = sorted({row["metric"].split("/", 1)[0] for row in rows if row["status"] == "regressed"})
+    if suspects and args.confirm:
+        # A single noisy batch is common on shared machines; only fail when
+        # the regression survives a second batch of runs
+        print(f"possible regression in {', '.join(suspects)}, re-running to confirm...", flush=True)
+        collect(suspects, max(1, args.repeat), samples)
+        rows = compare(baseline, summarize_samples(samples))
+
+    environment = environment_info()
+    recorded = stored.get("environment", {})
+    if (recorded.get("cpus"), recorded.get("platform")) != (environment["cpus"], environment["platform"]):
+        print(f"warning: baseline was recorded on {recorded.get('platform')} with {recorded.get('cpus')} CPUs, "
+              f"this machine is {environment['platform']} with {environment['cpus']} CPUs\n")
+
+    print(format_report(rows, args.all))
+    return 1 if any(row["status"] == "regressed" for row in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,315 @@
+"""
+Replay recorded update traffic through the handlers at a chosen speed.
+
+Reads a file written by ``tools/traffic_recorder.py`` (``TRAFFIC_RECORD_FILE``)
+and feeds the same sequence of updates through ``FakeClient``, keeping the
+recorded gaps divided by ``--speed``. Each recorded user becomes a virtual
+user whose updates are dispatched in order; different users overlap as
+they did in production. Audio and photos are synthesized to the recorded
+duration and dimensions, and their reported file size is the recorded one.
+
+The report shows handler latency per update kind next to the latency seen
+when the traffic was recorded, and the dispatch lag, which is how late
+updates start compared to their schedule. A growing lag means the bot
+can't keep up with that rate.
+
+Usage:
+    python -m benchmarks.replay traffic.jsonl --speed 1,10,100
+    python -m benchmarks.replay traffic.jsonl --speed 10 --max-gap 5 --latency-ms 40 --output replay.json
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from benchmarks.common import encode_media, format_table, summarize, use_temp_database, write_results
+from benchmarks.load_test import build_client, find_audio_id
+
+
+MEDIA_FORMATS = ("mp3", "ogg", "wav", "wma", "flac", "m4a", "opus")
+OWNER_ID = 99999
+
+
+def load_events(path: str) -> List[Dict[str, Any]]:
+    """Read a recording, skipping malformed lines, ordered by timestamp."""
+    events = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                event = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(event, dict) and "ts" in event and "type" in event:
+                events.append(event)
+    events.sort(key=lambda event: event["ts"])
+    return events
+
+
+def schedule(events: List[Dict[str, Any]], speed: float, max_gap: Optional[float]) -> List[Tuple[float, Dict]]:
+    """Return ``(offset, event)`` pairs; idle gaps longer than ``max_gap`` are shortened to it."""
+    offsets = []
+    offset = 0.0
+    previous = events[0]["ts"] if events else 0.0
+    for event in events:
+        gap = event["ts"] - previous
+        if max_gap is not None:
+            gap = min(gap, max_gap)
+        offset += gap / speed
+        previous = event["ts"]
+        offsets.append((offset, event))
+    return offsets
+
+
+def event_kind(event: Dict[str, Any]) -> str:
+    """Group events for the report: ``audio``, ``photo``, ``command:start``, ``callback:title``..."""
+    if event["type"] == "callback_query":
+        return "callback:" + (event.get("data") or "").split(":")[0]
+    if event.get("media"):
+        return event["media"]
+    if event.get("text_kind") == "command":
+        return f"command:{event.get('command')}"
+    return f"text:{event.get('text_kind', 'other')}"
+
+
+def cut_text(segments: int, seconds: float) -> str:
+    """A cut of ``segments`` ranges keeping ``seconds`` in total, one second apart, as a user would type it."""
+    count = max(1, segments)
+    length = max(1.0, seconds / count)
+    ranges = []
+    for index in range(count):
+        start = index * (length + 1)
+        ranges.append(f"{start:g}-{start + length:g}")
+    return ", ".join(ranges)
+
+
+class Replayer:
+    """Turn recorded events back into updates for one FakeClient."""
+
+    def __init__(self, client, max_media_seconds: float = 120, first_user_id: int = 200000):
+        self.client = client
+        self.max_media_seconds = max_media_seconds
+        self.next_user_id = first_user_id
+        self.users: Dict[str, int] = {}
+        self.created = {OWNER_ID}
+        self.menus: Dict[int, Any] = {}
+        self.locks: Dict[int, asyncio.Lock] = {}
+        self.latencies: Dict[str, List[float]] = {}
+        self.recorded: Dict[str, List[float]] = {}
+        self.lag: List[float] = []
+        self.errors: Dict[str, int] = {}
+        self.skipped: Dict[str, int] = {}
+        self._media: Dict[Tuple[str, int], bytes] = {}
+        self._photos: Dict[Tuple[int, int], bytes] = {}
+
+    def virtual_user(self, event: Dict[str, Any]) -> int:
+        if event.get("owner"):
+            return OWNER_ID
+        key = event.get("user") or "anonymous"
+        if key not in self.users:
+            self.users[key] = self.next_user_id
+            self.next_user_id += 1
+        return self.users[key]
+
+    def _audio_bytes(self, event: Dict[str, Any]) -> bytes:
+        fmt = event.get("extension") if event.get("extension") in MEDIA_FORMATS else "mp3"
+        if event.get("media") == "voice":
+            fmt = "opus"
+        duration = event.get("duration") or (event.get("file_size") or 0) / 24000
+        # Round so tracks of similar length share one synthesized file
+        seconds = int(min(max(5, round(duration / 5) * 5), self.max_media_seconds))
+        if (fmt, seconds) not in self._media:
+            self._media[(fmt, seconds)] = encode_media(seconds, fmt)
+        return self._media[(fmt, seconds)]
+
+    def _photo_bytes(self, width: int, height: int) -> bytes:
+        if (width, height) not in self._photos:
+            from PIL import Image
+            image = Image.effect_noise((width, height), 64).convert("RGB")
+            buffer = io.BytesIO()
+            image.save(buffer, "JPEG", quality=90)
+            self._photos[(width, height)] = buffer.getvalue()
+        return self._photos[(width, height)]
+
+    def build_update(self, user_id: int, event: Dict[str, Any]):
+        """Build the update for ``event``, or return a reason string when it can't be replayed."""
+        client = self.client
+        if event["type"] == "callback_query":
+            data = event.get("data") or ""
+            menu = self.menus.get(user_id)
+            if "{n}" in data:
+                audio_id = find_audio_id(menu)
+                if audio_id is None:
+                    return "no_audio"
+                data = data.replace("{n}", str(audio_id))
+            return client.callback_query(user_id, data, menu)
+
+        if event.get("chat_type") not in (None, "private"):
+            return "group_chat"
+        media = event.get("media")
+        if media == "photo":
+            width = min(event.get("width") or 1280, 2560)
+            height = min(event.get("height") or 1280, 2560)
+            return client.photo_message(user_id, self._photo_bytes(width, height), width, height,
+                                        file_size=event.get("file_size"))
+        if media in ("audio", "document", "voice"):
+            data = self._audio_bytes(event)
+            duration = int(event.get("duration") or 0)
+            if media == "voice":
+                return client.voice_message(user_id, data, duration=duration, file_size=event.get("file_size"))
+            extension = event.get("extension") or "mp3"
+            return client.audio_message(user_id, data, file_name=f"replay.{extension}",
+                                        mime_type=event.get("mime_type") or "audio/mpeg", duration=duration,
+                                        as_document=media == "document", file_size=event.get("file_size"))
+
+        text_kind = event.get("text_kind")
+        if text_kind == "command":
+            return client.message(user_id, text=f"/{event.get('command')}")
+        if text_kind == "time_range":
+            return client.message(user_id, text=cut_text(event.get("segments", 1), event.get("seconds", 60)))
+        if text_kind == "number":
+            return client.message(user_id, text="7" * max(1, event.get("text_length", 1)))
+        if text_kind == "text":
+            return client.message(user_id, text="x" * max(1, event.get("text_length", 1)))
+        return "unknown"
+
+    async def play(self, event: Dict[str, Any], due: float) -> None:
+        kind = event_kind(event)
+        user_id = self.virtual_user(event)
+        lock = self.locks.setdefault(user_id, asyncio.Lock())
+        async with lock:
+            self.lag.append(max(0.0, time.perf_counter() - due))
+            if user_id not in self.created:
+                from database import Users
+                await Users.create(user_id=user_id, full_name=f"Replay {user_id}", language="en")
+                self.created.add(user_id)
+            update = self.build_update(user_id, event)
+            if isinstance(update, str):
+                self.skipped[update] = self.skipped.get(update, 0) + 1
+                return
+            start = time.perf_counter()
+            try:
+                handled = await self.client.dispatch(update)
+            except Exception:
+                handled = False
+            self.latencies.setdefault(kind, []).append(time.perf_counter() - start)
+            if event.get("elapsed") is not None:
+                self.recorded.setdefault(kind, []).append(event["elapsed"])
+            if not handled:
+                self.errors[kind] = self.errors.get(kind, 0) + 1
+            menu = self.client.last_sent(user_id)
+            if find_audio_id(menu) is not None:
+                self.menus[user_id] = menu
+
+    async def run(self, events: List[Dict[str, Any]], speed: float, max_gap: Optional[float]) -> Dict[str, Any]:
+        tasks = []
+        start = time.perf_counter()
+        for offset, event in schedule(events, speed, max_gap):
+            delay = start + offset - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(self.play(event, start + offset)))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+
+        kinds = {}
+        for kind, values in sorted(self.latencies.items()):
+            stats = summarize(values)
+            stats["errors"] = self.errors.get(kind, 0)
+            stats["recorded_p50"] = summarize(self.recorded.get(kind, []))["p50"]
+            kinds[kind] = stats
+        played = sum(len(values) for values in self.latencies.values())
+        return {
+            "speed": speed,
+            "events": len(events),
+            "played": played,
+            "skipped": self.skipped,
+            "elapsed": elapsed,
+            "updates_per_second": played / elapsed if elapsed else 0.0,
+            "lag": summarize(self.lag),
+            "kinds": kinds,
+        }
+
+
+async def run_replay(events: List[Dict[str, Any]], speeds: List[float], max_gap: Optional[float] = 60,
+                     max_media_seconds: float = 120, latency: float = 0.0, upload_bandwidth: float = 0,
+                     download_bandwidth: float = 0) -> List[Dict[str, Any]]:
+    """Replay ``events`` once per speed (requires ``use_temp_database()`` first)."""
+    from database import BotSettings, Users, create_tables
+
+    await create_tables()
+    await Users.create(user_id=OWNER_ID, full_name="Replay owner", language="en")
+    await BotSettings.update_settings(owner_id=OWNER_ID)
+    runs = []
+    for index, speed in enumerate(speeds):
+        client = build_client(latency, upload_bandwidth, download_bandwidth)
+        # Disjoint user ids per run so earlier sessions don't leak into later ones
+        replayer = Replayer(client, max_media_seconds, first_user_id=200000 + index * 100000)
+        try:
+            runs.append(await replayer.run(events, speed, max_gap))
+        finally:
+            client.close()
+    return runs
+
+
+def print_run(run: Dict[str, Any]) -> None:
+    lag = run["lag"]
+    print(f"\nspeed {run['speed']:g}x: {run['played']}/{run['events']} updates in {run['elapsed']:.2f}s "
+          f"({run['updates_per_second']:.1f} updates/s), dispatch lag p50 {lag['p50'] * 1000:.1f}ms "
+          f"p99 {lag['p99'] * 1000:.1f}ms max {lag['max'] * 1000:.1f}ms")
+    print(format_table(run["kinds"], ("count", "recorded_p50", "p50", "p95", "p99", "max")))
+    if run["skipped"]:
+        print("skipped: " + ", ".join(f"{reason}={count}" for reason, count in run["skipped"].items()))
+    failed = {kind: stats["errors"] for kind, stats in run["kinds"].items() if stats["errors"]}
+    if failed:
+        print("not handled: " + ", ".join(f"{kind}={count}" for kind, count in failed.items()))
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Replay recorded update traffic through the handlers")
+    parser.add_argument("recording", help="JSON lines file written with TRAFFIC_RECORD_FILE")
+    parser.add_argument("--speed", default="1", help="Comma separated replay speeds, e.g. 1,10,100")
+    parser.add_argument("--max-gap", type=float, default=60,
+                        help="Shorten recorded idle gaps to this many seconds (0 to keep them)")
+    parser.add_argument("--max-media-seconds", type=float, default=120,
+                        help="Cap on the duration of synthesized media")
+    parser.add_argument("--latency-ms", type=float, default=0, help="Emulated latency of every Telegram API call")
+    parser.add_argument("--upload-mbps", type=float, default=0, help="Emulated upload bandwidth (0 for instant)")
+    parser.add_argument("--download-mbps", type=float, default=0, help="Emulated download bandwidth (0 for instant)")
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    args = parser.parse_args(argv)
+
+    events = load_events(args.recording)
+    if not events:
+        parser.error(f"No events in {args.recording}")
+    speeds = [float(value) for value in args.speed.split(",") if value.strip()]
+    if any(speed <= 0 for speed in speeds):
+        parser.error("Speeds must be positive")
+
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    os.environ.pop("TRAFFIC_RECORD_FILE", None)
+    use_temp_database("replay_")
+    runs = asyncio.run(run_replay(
+        events,
+        speeds,
+        max_gap=args.max_gap or None,
+        max_media_seconds=args.max_media_seconds,
+        latency=args.latency_ms / 1000,
+        upload_bandwidth=args.upload_mbps * 125000,
+        download_bandwidth=args.download_mbps * 125000,
+    ))
+    recorded_span = events[-1]["ts"] - events[0]["ts"]
+    print(f"{len(events)} recorded updates over {recorded_span:.1f}s")
+    for run in runs:
+        print_run(run)
+    if args.output:
+        write_results("replay", {"recording": args.recording, "runs": runs}, args.output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
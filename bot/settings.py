@@ -1,15 +1,20 @@
+import html
+import json
+import tempfile
+from datetime import datetime, timedelta
 from pyrogram import filters
 from pyrogram.types import Message
 from database.database import Chats
 from tools.inline_keyboards import bot_settings_buttons
 from tools.enums import Messages
 from pyrogram.handlers import MessageHandler
-from database import BotSettings, Users
+from database import BotSettings, RenderUsage, Users
 from tools.tools import (is_valid_chat_id, 
                          is_valid_user_id,
                          with_language,
                          owner_only,
                          wait_input_filter)
+from tools.tracing import slow_traces
 
 
 @owner_only
@@ -93,6 +98,65 @@ async def unban_user_or_chat(_, message: Message, language: str):
         await message.reply(messages.unbanid_invalid)
 
 
+@owner_only
+@with_language
+async def slow_traces_dump(_, message: Message, language: str):
+    """Send the slowest recorded traces as span trees, plus the raw spans as JSON.
+
+    Usage: /slowtraces [count]
+    """
+    messages = Messages(language=language)
+    parts = message.text.split()
+    limit = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else 5
+    traces = slow_traces.slowest(limit)
+    if not traces:
+        await message.reply(messages.slow_traces_empty)
+        return
+
+    sections = [messages.slow_traces_title]
+    for index, trace in enumerate(traces, start=1):
+        sections.append(f"{index}. <code>{trace.trace_id[:8]}</code> {trace.duration:.2f}s\n"
+                        f"<pre>{html.escape(trace.format_tree())}</pre>")
+    text = "\n\n".join(sections)
+    if len(text) > 4000:
+        text = text[:4000].rsplit("\n\n", 1)[0]
+    await message.reply(text)
+
+    filename = f"slow_traces_{datetime.now():%Y%m%d_%H%M%S}.json"
+    with tempfile.NamedTemporaryFile("w+", encoding="utf-8", suffix=".json", delete=True) as tmp:
+        json.dump([trace.to_dict() for trace in traces], tmp, ensure_ascii=False, indent=2, default=str)
+        tmp.seek(0)
+        await message.reply_document(document=tmp.name, file_name=filename)
+
+
+@owner_only
+@with_language
+async def render_usage_report(_, message: Message, language: str):
+    """Send the users with the most render CPU time, from the render usage log.
+
+    Usage: /usage [days]
+    """
+    messages = Messages(language=language)
+    parts = message.text.split()
+    days = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else 7
+    # created_at is stored by the database in UTC
+    users = await RenderUsage.top_users(since=datetime.utcnow() - timedelta(days=days))
+    if not users:
+        await message.reply(messages.render_usage_empty)
+        return
+    lines = [messages.render_usage_title.format(days)]
+    for index, user in enumerate(users, start=1):
+        lines.append(messages.render_usage_row.format(index=index,
+                                                      user_id=user["user_id"],
+                                                      jobs=user["jobs"],
+                                                      cpu=round(user["cpu_seconds"] or 0),
+                                                      rss=round((user["peak_rss_bytes"] or 0) / (1024 * 1024)),
+                                                      temp=round((user["temp_bytes"] or 0) / (1024 * 1024))))
+    await message.reply("\n".join(lines))
+
+
 settings_handlers = [MessageHandler(bot_settings, filters.command("admin")),
+                     MessageHandler(slow_traces_dump, filters.command("slowtraces")),
+                     MessageHandler(render_usage_report, filters.command("usage")),
                      MessageHandler(ban_user_or_chat, filters.private & (filters.text | filters.command("cancel")) & wait_input_filter("banid")),
                      MessageHandler(unban_user_or_chat, filters.private & (filters.text | filters.command("cancel")) & wait_input_filter("unbanid"))]
@@ -1,13 +1,15 @@
 import os
 from datetime import datetime, timedelta
 from tools.logger import logger
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, func, ForeignKey, select, update, delete, JSON
+from sqlalchemy import Column, Integer, Float, String, Boolean, DateTime, func, ForeignKey, select, update, delete, JSON, inspect, text
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 from typing import Any, List, Dict, Optional
 import time
 from tools.enums import AccessPermission
+from tools.metrics import instrument_model
+from tools.tracing import trace_model
 from pyrogram.errors import ChatAdminRequired, ChannelPrivate, PeerIdInvalid, RPCError, ChatInvalid
 from pyrogram import Client
 from pyrogram.types import ChatPrivileges
@@ -585,22 +587,106 @@ class BotSettings(Base):
             return settings
 
 
+class AudioBatches(Base):
+    """Album sessions: a metadata template shared by the ``AudioFiles`` rows with this ``batch_id``."""
+    __tablename__ = 'audio_batches'
+    batch_id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+    user_id = Column(Integer, ForeignKey('users.user_id', ondelete="CASCADE"), nullable=False)
+    album = Column(String, nullable=True)
+    artist = Column(String, nullable=True)
+    genre = Column(String, nullable=True)
+    file_date = Column(DateTime, nullable=True)
+    image_id = Column(String, nullable=True)
+    image_unique_id = Column(String, nullable=True)
+    # Output: a preset for every track (None keeps each track's own format, see tools.presets) and ZIP delivery
+    output_preset = Column(String, nullable=True)
+    as_archive = Column(Boolean, nullable=True)
+    created_at = Column(DateTime, default=func.now())
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+
+    @classmethod
+    async def create(cls, user_id: int, **kwargs) -> dict:
+        async with async_session() as session:
+            batch = cls(user_id=user_id, **kwargs)
+            session.add(batch)
+            await session.commit()
+            await session.refresh(batch)
+            return batch.__dict__
+
+    @classmethod
+    async def get(cls, user_id: int, batch_id: int) -> dict | None:
+        async with async_session() as session:
+            batch = await session.execute(select(cls).filter_by(user_id=user_id, batch_id=batch_id))
+            batch = batch.scalars().first()
+            if batch is None:
+                return None
+            return batch.__dict__
+
+    @classmethod
+    async def update(cls, user_id: int, batch_id: int, **kwargs) -> dict | None:
+        async with async_session() as session:
+            batch = await session.execute(select(cls).filter_by(user_id=user_id, batch_id=batch_id))
+            batch = batch.scalars().first()
+            if batch is None:
+                return None
+            for key, value in kwargs.items():
+                setattr(batch, key, value)
+            await session.commit()
+            await session.refresh(batch)
+            return batch.__dict__
+
+    @classmethod
+    async def delete(cls, user_id: int, batch_id: int) -> bool:
+        """Delete the session together with its tracks."""
+        async with async_session() as session:
+            await session.execute(delete(AudioFiles).where(AudioFiles.user_id == user_id,
+                                                           AudioFiles.batch_id == batch_id))
+            result = await session.execute(delete(cls).where(cls.user_id == user_id, cls.batch_id == batch_id))
+            await session.commit()
+            return result.rowcount > 0
+
+
 class AudioFiles(Base):
     __tablename__ = 'audio_files'
     audio_id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     user_id = Column(Integer, ForeignKey('users.user_id', ondelete="CASCADE"), nullable=False)
     file_id = Column(String, nullable=False)
+    file_unique_id = Column(String, nullable=True)
     file_name = Column(String, nullable=False)
     file_size = Column(Integer, nullable=False)
     title = Column(String, nullable=True)
     mime_type = Column(String, nullable=True)
     file_date = Column(DateTime, default=func.now())
     image_id = Column(String, nullable=True)
+    image_unique_id = Column(String, nullable=True)
     genre = Column(String, nullable=True)
     album = Column(String, nullable=True)
     artist = Column(String, nullable=True)
-    cut_start = Column(Integer, nullable=True)
-    cut_end = Column(Integer, nullable=True)
+    # Seconds; Integer before fractional cuts, see _retype_columns
+    cut_start = Column(Float, nullable=True)
+    cut_end = Column(Float, nullable=True)
+    # Multi-range cuts as [[start, end], ...]; cut_start/cut_end hold the outer bounds
+    cut_segments = Column(JSON, nullable=True)
+    # Pending split as [{"start": 0.0, "title": ...}, ...], see tools.split
+    split_points = Column(JSON, nullable=True)
+    effects = Column(JSON, nullable=True)
+    # Output format and encoder settings, see tools.presets
+    output_preset = Column(String, nullable=True)
+    # Pre-flight probe of the upload, see handlers.callback_handlers.probe_upload
+    duration = Column(Float, nullable=True)
+    codec = Column(String, nullable=True)
+    bit_rate = Column(Integer, nullable=True)
+    sample_rate = Column(Integer, nullable=True)
+    channels = Column(Integer, nullable=True)
+    # Last loudness analysis (LUFS, dBTP) and the cut/effects it was measured with
+    loudness_i = Column(Float, nullable=True)
+    loudness_tp = Column(Float, nullable=True)
+    loudness_key = Column(String, nullable=True)
+    # Album session the file belongs to, see AudioBatches
+    batch_id = Column(Integer, ForeignKey('audio_batches.batch_id', ondelete="CASCADE"), nullable=True, index=True)
+    track_number = Column(Integer, nullable=True)
+    # Path of the track inside the uploaded ZIP that file_id points at, see tools.archive
+    archive_member = Column(String, nullable=True)
     created_at = Column(DateTime, default=func.now())
     updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
 
@@ -611,19 +697,70 @@ class AudioFiles(Base):
                file_size: int,
                title: str | None = None,
                mime_type: str | None = None,
-               file_date: int | None = None) -> dict:
+               file_date: int | None = None,
+               file_unique_id: str | None = None,
+               duration: float | None = None,
+               codec: str | None = None,
+               bit_rate: int | None = None,
+               sample_rate: int | None = None,
+               channels: int | None = None) -> dict:
         async with async_session() as session:
             audio_file = AudioFiles(user_id=user_id,
                                     file_id=file_id,
+                                    file_unique_id=file_unique_id,
                                     file_name=file_name,
                                     file_size=file_size,
                                     title=title,
                                     mime_type=mime_type,
-                                    file_date=file_date)
+                                    file_date=file_date,
+                                    duration=duration,
+                                    codec=codec,
+                                    bit_rate=bit_rate,
+                                    sample_rate=sample_rate,
+                                    channels=channels)
             session.add(audio_file)
             await session.commit()
             await session.refresh(audio_file)
             return audio_file.__dict__
+
+    @classmethod
+    async def create_many(cls, user_id: int, files: List[dict], batch_id: int | None = None) -> list:
+        """Insert several audio files in a single transaction.
+
+        Each dict in ``files`` holds ``create`` keyword arguments, plus
+        optionally ``track_number``. Rows are returned in the given order.
+        """
+        async with async_session() as session:
+            audio_files = [cls(user_id=user_id, batch_id=batch_id, **file) for file in files]
+            session.add_all(audio_files)
+            await session.commit()
+            return [{k: v for k, v in audio_file.__dict__.items() if not k.startswith('_')}
+                    for audio_file in audio_files]
+
+    @classmethod
+    async def update_many(cls, user_id: int, updates: Dict[int, dict]) -> int:
+        """Apply ``{audio_id: {column: value}}`` updates in a single transaction."""
+        if not updates:
+            return 0
+        async with async_session() as session:
+            audio_files = await session.execute(select(cls).filter(cls.user_id == user_id,
+                                                                   cls.audio_id.in_(list(updates))))
+            count = 0
+            for audio_file in audio_files.scalars().all():
+                for key, value in updates[audio_file.audio_id].items():
+                    setattr(audio_file, key, value)
+                count += 1
+            await session.commit()
+            return count
+
+    @classmethod
+    async def get_batch(cls, user_id: int, batch_id: int) -> list:
+        """The files of an album session, in track order."""
+        async with async_session() as session:
+            audio_files = await session.execute(select(cls)
+                                                .filter_by(user_id=user_id, batch_id=batch_id)
+                                                .order_by(cls.track_number, cls.audio_id))
+            return [audio_file.__dict__ for audio_file in audio_files.scalars().all()]
     
     @classmethod
     async def get(cls, user_id: int, audio_id: int) -> dict | None:
@@ -673,7 +810,112 @@ class AudioFiles(Base):
             return audio_files
 
 
+class RenderUsage(Base):
+    """One row per render job a user started: what it was estimated to need and what it used (see tools.render_pool)."""
+    __tablename__ = 'render_usage'
+    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+    user_id = Column(Integer, index=True, nullable=False)
+    operation = Column(String, nullable=False)
+    wall_seconds = Column(Float, nullable=True)
+    cpu_seconds = Column(Float, nullable=True)
+    peak_rss_bytes = Column(Integer, nullable=True)
+    temp_bytes = Column(Integer, nullable=True)
+    estimated_memory = Column(Integer, nullable=True)
+    estimated_temp = Column(Integer, nullable=True)
+    # Time spent waiting for admission
+    waited_seconds = Column(Float, nullable=True)
+    created_at = Column(DateTime, default=func.now(), index=True)
+
+    @classmethod
+    async def record(cls, user_id: int, operation: str, **usage) -> None:
+        async with async_session() as session:
+            session.add(cls(user_id=user_id, operation=operation, **usage))
+            await session.commit()
+
+    @classmethod
+    async def top_users(cls, since: datetime, limit: int = 10) -> List[Dict[str, Any]]:
+        """Users by render CPU time since ``since``, heaviest first."""
+        async with async_session() as session:
+            rows = await session.execute(
+                select(cls.user_id,
+                       func.count(cls.id).label("jobs"),
+                       func.sum(cls.cpu_seconds).label("cpu_seconds"),
+                       func.sum(cls.wall_seconds).label("wall_seconds"),
+                       func.max(cls.peak_rss_bytes).label("peak_rss_bytes"),
+                       func.sum(cls.temp_bytes).label("temp_bytes"))
+                .where(cls.created_at >= since)
+                .group_by(cls.user_id)
+                .order_by(func.sum(cls.cpu_seconds).desc())
+                .limit(limit))
+            return [dict(row._mapping) for row in rows]
+
+
+for _model in (Chats, AdminsPermissions, Users, BotSettings, AudioBatches, AudioFiles, RenderUsage):
+    instrument_model(_model)
+    trace_model(_model)
+
+
+def _add_missing_columns(connection) -> None:
+    """Add nullable columns that were introduced after a table was created.
+
+    ``create_all`` only creates missing tables, so databases from older
+    versions would otherwise lack new optional columns.
+    """
+    inspector = inspect(connection)
+    preparer = connection.dialect.identifier_preparer
+    for table in Base.metadata.tables.values():
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing or column.primary_key or not column.nullable:
+                continue
+            column_type = column.type.compile(dialect=connection.dialect)
+            connection.execute(text(
+                f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN {preparer.format_column(column)} {column_type}"
+            ))
+            logger.info(f"Added column {table.name}.{column.name}")
+
+
+# Columns declared with a different type since their table was first created, as (table, column)
+_RETYPED_COLUMNS = (("audio_files", "cut_start"), ("audio_files", "cut_end"))
+
+
+def _retype_columns(connection) -> None:
+    """Change columns listed in ``_RETYPED_COLUMNS`` to their declared type.
+
+    SQLite stores each value with its own type whatever the column says,
+    so only databases that enforce column types need the change.
+    """
+    dialect = connection.dialect.name
+    if dialect == "sqlite":
+        return
+    inspector = inspect(connection)
+    preparer = connection.dialect.identifier_preparer
+    for table_name, column_name in _RETYPED_COLUMNS:
+        if not inspector.has_table(table_name):
+            continue
+        table = Base.metadata.tables[table_name]
+        column = table.columns[column_name]
+        current = next((info for info in inspector.get_columns(table_name) if info["name"] == column_name), None)
+        if current is None or isinstance(current["type"], type(column.type)):
+            continue
+        column_type = column.type.compile(dialect=connection.dialect)
+        quoted_table, quoted_column = preparer.format_table(table), preparer.format_column(column)
+        if dialect == "postgresql":
+            statement = f"ALTER TABLE {quoted_table} ALTER COLUMN {quoted_column} TYPE {column_type}"
+        elif dialect in ("mysql", "mariadb"):
+            statement = f"ALTER TABLE {quoted_table} MODIFY {quoted_column} {column_type} NULL"
+        else:
+            logger.warning(f"Can't change {table_name}.{column_name} to {column_type} on {dialect}, change it by hand")
+            continue
+        connection.execute(text(statement))
+        logger.info(f"Changed column {table_name}.{column_name} to {column_type}")
+
+
 async def create_tables():
     async with engine.begin() as conn:
         logger.info("Database tables initialized successfully")
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_add_missing_columns)
+        await conn.run_sync(_retype_columns)
@@ -1,10 +1,12 @@
 from .command_handlers import commands_handlers
 from .callback_handlers import callback_query_handlers
 from .message_handlers import message_handlers
+from .batch_handlers import batch_callback_handlers
 
 __all__ = [
     'commands_handlers',
     'callback_query_handlers',
+    'batch_callback_handlers',
     'join_handlers',
     'message_handlers'
 ]
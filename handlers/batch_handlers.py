@@ -0,0 +1,541 @@
+import asyncio
+import mimetypes
+import os
+import shutil
+import tempfile
+import zipfile
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional
+from pyrogram import Client, filters
+from pyrogram.errors import MessageDeleteForbidden, MessageIdInvalid, MessageNotModified
+from pyrogram.handlers import CallbackQueryHandler
+from pyrogram.types import CallbackQuery, InputMediaAudio, Message
+from database import AudioBatches, AudioFiles, Users
+from handlers.callback_handlers import download_audio, probe_upload, render_budget, send_audio_group
+from tools.archive import MAX_ARCHIVE_SIZE, list_audio_members, render_archive_member
+from tools.audio_utils import process_audio, rendered_duration
+from tools.batch import (BATCH_GROUP_DELAY, BATCH_WINDOW, MAX_BATCH_FILES, next_output_preset, number_tracks,
+                         output_file_name, parse_titles, track_metadata)
+from tools.enums import Messages, create_message_batch
+from tools.image_utils import cleanup_temp_file, download_and_process_image
+from tools.inline_keyboards import batch_buttons, buttons_builder
+from tools.logger import logger
+from tools.metrics import TRANSFER_BYTES, TRANSFER_DURATION
+from tools.render_pool import render_pool
+from tools.tools import parse_date, with_language
+from tools.tracing import span
+
+
+# AudioFiles columns filled from an upload
+TRACK_FIELDS = ("file_id", "file_unique_id", "file_name", "file_size", "title", "mime_type", "file_date",
+                "track_number", "archive_member", "duration", "codec", "bit_rate", "sample_rate", "channels")
+# Menu actions that wait for the user's input
+BATCH_INPUTS = ("album", "artist", "genre", "date", "image", "titles")
+# Seconds between edits of the render progress message
+PROGRESS_INTERVAL = 2.0
+# Uploaded archives kept on disk between listing and rendering, by file_unique_id
+ARCHIVE_CACHE_FILES = int(os.getenv("ARCHIVE_CACHE_FILES", 4))
+
+
+class UploadCollector:
+    """
+    Holds back audio uploads that arrive together and hands them over as one list.
+
+    Items of a media group are collected until none has arrived for
+    ``group_delay`` seconds. With a ``window``, separate uploads of a user
+    are collected the same way; without one they are not held back at all.
+    """
+
+    def __init__(self, group_delay: float = BATCH_GROUP_DELAY, window: float = BATCH_WINDOW):
+        self.group_delay = group_delay
+        self.window = window
+        self._pending: Dict[tuple, List[dict]] = {}
+        self._timers: Dict[tuple, asyncio.TimerHandle] = {}
+        self._tasks: set = set()
+
+    def add(self, user_id: int, media_group_id: Optional[str], upload: dict,
+            on_flush: Callable[[List[dict]], Awaitable[None]]) -> bool:
+        """Queue ``upload``; returns False when it isn't grouped and should be handled right away."""
+        if media_group_id is None and self.window <= 0:
+            return False
+        key = (user_id, media_group_id)
+        self._pending.setdefault(key, []).append(upload)
+        if timer := self._timers.pop(key, None):
+            timer.cancel()
+        delay = self.group_delay if media_group_id is not None else self.window
+        self._timers[key] = asyncio.get_running_loop().call_later(delay, self._flush, key, on_flush)
+        return True
+
+    def _flush(self, key: tuple, on_flush: Callable[[List[dict]], Awaitable[None]]) -> None:
+        self._timers.pop(key, None)
+        uploads = self._pending.pop(key, [])
+        if uploads:
+            task = asyncio.ensure_future(self._run(on_flush, uploads))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    @staticmethod
+    async def _run(on_flush: Callable[[List[dict]], Awaitable[None]], uploads: List[dict]) -> None:
+        try:
+            await on_flush(uploads)
+        except Exception as e:
+            logger.error(f"Error handling {len(uploads)} grouped uploads: {e}", exc_info=True)
+
+
+upload_collector = UploadCollector()
+
+
+class ArchiveCache:
+    """
+    Uploaded archives on disk, so a session's ZIP is downloaded once for listing and rendering.
+
+    Only the ``size`` most recent are kept; an evicted or missing archive
+    (e.g. after a restart) is simply downloaded again. Archives taken with
+    ``acquire`` are pinned until ``release`` and never evicted or deleted
+    meanwhile, since renders reopen them by path for every track.
+    """
+
+    def __init__(self, size: int = ARCHIVE_CACHE_FILES):
+        self.size = size
+        self._paths: OrderedDict[str, str] = OrderedDict()
+        self._pins: Dict[str, int] = {}
+        # Discarded while pinned: deleted on the last release
+        self._discarded: set = set()
+        self._downloads: Dict[str, asyncio.Future] = {}
+
+    def _evict(self) -> None:
+        unpinned = [file_unique_id for file_unique_id in self._paths if not self._pins.get(file_unique_id)]
+        while len(self._paths) > max(self.size, 1) and unpinned:
+            cleanup_temp_file(self._paths.pop(unpinned.pop(0)))
+
+    def put(self, file_unique_id: str, path: str) -> None:
+        old_path = self._paths.pop(file_unique_id, None)
+        if old_path and old_path != path:
+            cleanup_temp_file(old_path)
+        self._paths[file_unique_id] = path
+        self._evict()
+
+    async def get(self, client: Client, file_id: str, file_unique_id: str) -> str | None:
+        path = self._paths.get(file_unique_id)
+        if path and os.path.exists(path):
+            self._paths.move_to_end(file_unique_id)
+            return path
+        # Sessions of the same archive share one download, which is kept even if a waiter is cancelled
+        if file_unique_id not in self._downloads:
+            self._downloads[file_unique_id] = asyncio.ensure_future(self._download(client, file_id, file_unique_id))
+        return await asyncio.shield(self._downloads[file_unique_id])
+
+    async def _download(self, client: Client, file_id: str, file_unique_id: str) -> str | None:
+        try:
+            path = await download_audio(client, file_id, media="archive")
+            if path:
+                self.put(file_unique_id, path)
+            return path
+        finally:
+            self._downloads.pop(file_unique_id, None)
+
+    async def acquire(self, client: Client, file_id: str, file_unique_id: str) -> str | None:
+        """``get`` that keeps the archive on disk until ``release``; None (and nothing to release) if it can't be downloaded."""
+        self._pins[file_unique_id] = self._pins.get(file_unique_id, 0) + 1
+        try:
+            path = await self.get(client, file_id, file_unique_id)
+        except BaseException:
+            self.release(file_unique_id)
+            raise
+        if path is None:
+            self.release(file_unique_id)
+        return path
+
+    def release(self, file_unique_id: str) -> None:
+        pins = self._pins.pop(file_unique_id, 0) - 1
+        if pins > 0:
+            self._pins[file_unique_id] = pins
+        elif file_unique_id in self._discarded:
+            self._discarded.discard(file_unique_id)
+            self.discard(file_unique_id)
+        else:
+            self._evict()
+
+    def discard(self, file_unique_id: str) -> None:
+        """Delete the archive, or once its last user releases it."""
+        if self._pins.get(file_unique_id):
+            self._discarded.add(file_unique_id)
+            return
+        cleanup_temp_file(self._paths.pop(file_unique_id, None))
+
+
+archive_cache = ArchiveCache()
+
+
+def batch_keyboard(language: str, batch: dict):
+    return batch_buttons(language=language, batch_id=batch.get("batch_id"), output_preset=batch.get("output_preset"),
+                         as_archive=bool(batch.get("as_archive")))
+
+
+async def create_session(user_id: int, uploads: List[dict], **template) -> tuple[dict, list]:
+    """Store ``uploads`` as an album session in one transaction."""
+    batch = await AudioBatches.create(user_id=user_id, **template)
+    tracks = await AudioFiles.create_many(user_id=user_id,
+                                          files=[{field: track.get(field) for field in TRACK_FIELDS}
+                                                 for track in number_tracks(uploads)],
+                                          batch_id=batch.get("batch_id"))
+    return batch, tracks
+
+
+async def start_batch(client: Client, uploads: List[dict], language: str) -> None:
+    """Probe ``uploads``, store the readable ones as an album session and reply with its menu."""
+    messages = Messages(language=language)
+    uploads = sorted(uploads, key=lambda upload: upload["message"].id)
+    last_message = uploads[-1]["message"]
+    if len(uploads) > MAX_BATCH_FILES:
+        await last_message.reply(messages.error_batch_too_large.format(MAX_BATCH_FILES))
+        return
+    probes = await asyncio.gather(*(probe_upload(client, upload["message"]) for upload in uploads),
+                                  return_exceptions=True)
+    readable = []
+    for upload, probe in zip(uploads, probes):
+        if isinstance(probe, ValueError):
+            await upload["message"].reply(messages.error_audio_unreadable)
+        elif isinstance(probe, BaseException):
+            raise probe
+        else:
+            readable.append({**upload, **probe, "duration": probe.get("duration") or upload.get("duration")})
+    if not readable:
+        return
+    uploads = readable
+    batch, tracks = await create_session(last_message.from_user.id, uploads)
+    await last_message.reply(create_message_batch(batch, tracks, language), reply_markup=batch_keyboard(language, batch))
+
+
+async def start_archive_batch(client: Client, message: Message, language: str) -> None:
+    """
+    Open an album session on the audio files of an uploaded ZIP.
+
+    Only the archive's directory is read here; tracks stay packed until
+    each one is rendered. The ZIP's name is the default album.
+    """
+    messages = Messages(language=language)
+    document = message.document
+    if (document.file_size or 0) > MAX_ARCHIVE_SIZE:
+        await message.reply(messages.error_archive_too_large.format(MAX_ARCHIVE_SIZE // (1024 * 1024)))
+        return
+    status = await message.reply(messages.archive_reading)
+    try:
+        archive_path = await archive_cache.acquire(client, document.file_id, document.file_unique_id)
+    except Exception as e:
+        logger.error(f"Error downloading archive from {message.from_user.id}: {e}", exc_info=True)
+        archive_path = None
+    if archive_path is None:
+        await status.edit_text(messages.error_occurred)
+        return
+    try:
+        members = await asyncio.to_thread(list_audio_members, archive_path)
+    except ValueError as e:
+        logger.warning(f"Rejected archive from {message.from_user.id}: {e}")
+        archive_cache.discard(document.file_unique_id)
+        await status.edit_text(messages.error_archive_invalid)
+        return
+    finally:
+        archive_cache.release(document.file_unique_id)
+    error = None
+    if not members:
+        error = messages.error_archive_empty
+    elif len(members) > MAX_BATCH_FILES:
+        error = messages.error_batch_too_large.format(MAX_BATCH_FILES)
+    if error:
+        archive_cache.discard(document.file_unique_id)
+        await status.edit_text(error)
+        return
+    uploads = [{**member,
+                "file_id": document.file_id,
+                "file_unique_id": document.file_unique_id,
+                "mime_type": mimetypes.guess_type(member["file_name"])[0],
+                "file_date": document.date}
+               for member in members]
+    album = os.path.splitext(document.file_name or "")[0].replace("_", " ").strip()[:64] or None
+    batch, tracks = await create_session(message.from_user.id, uploads, album=album)
+    await status.edit_text(create_message_batch(batch, tracks, language), reply_markup=batch_keyboard(language, batch))
+
+
+async def batch_input_handler(client: Client, message: Message, user: dict, language: str) -> None:
+    """Apply a template value sent for the album session the user is editing."""
+    messages = Messages(language=language)
+    user_id = message.from_user.id
+    field = user.get("wait_input")[len("batch_"):]
+    max_length = 64
+    # Users.audio_id points at the session's first track, see batch_callback_handler
+    track = await AudioFiles.get(user_id=user_id, audio_id=user.get("audio_id"))
+    batch = await AudioBatches.get(user_id=user_id, batch_id=track.get("batch_id")) if track else None
+    if not batch:
+        await message.reply(messages.audio_not_found)
+        return
+    batch_id = batch.get("batch_id")
+    if field == "image":
+        if not message.photo or not message.photo.sizes:
+            await message.reply(messages.waiting_for_image)
+            await message.delete()
+            return
+        elif message.photo.sizes[-1].file_size > 5 * 1024 * 1024:
+            await message.reply(messages.error_image_too_large)
+            await message.delete()
+            return
+        batch = await AudioBatches.update(user_id=user_id, batch_id=batch_id,
+                                          image_id=message.photo.sizes[-1].file_id,
+                                          image_unique_id=message.photo.sizes[-1].file_unique_id)
+    elif not message.text:
+        await message.reply(messages.waiting_for_batch_titles if field == "titles"
+                            else getattr(messages, f"waiting_for_{field}"))
+        await message.delete()
+        return
+    elif field == "date":
+        date = parse_date(message.text.strip())
+        if not date:
+            await message.reply(messages.error_date_invalid)
+            await message.delete()
+            return
+        batch = await AudioBatches.update(user_id=user_id, batch_id=batch_id, file_date=date)
+    elif field == "titles":
+        tracks = await AudioFiles.get_batch(user_id=user_id, batch_id=batch_id)
+        titles = parse_titles(message.text, max_length)
+        await AudioFiles.update_many(user_id=user_id,
+                                     updates={track.get("audio_id"): {"title": title}
+                                              for track, title in zip(tracks, titles) if title})
+    else:
+        value = message.text.strip()
+        if len(value) > max_length:
+            await message.reply(getattr(messages, f"error_{field}_too_long"))
+            await message.delete()
+            return
+        batch = await AudioBatches.update(user_id=user_id, batch_id=batch_id, **{field: value})
+    tracks = await AudioFiles.get_batch(user_id=user_id, batch_id=batch_id)
+    text = create_message_batch(batch, tracks, language)
+    keyboard = batch_keyboard(language, batch)
+    try:
+        await client.edit_message_text(chat_id=user_id,
+                                       message_id=user.get("waiting_for_message_id"),
+                                       text=text,
+                                       reply_markup=keyboard)
+        await message.delete()
+    except MessageIdInvalid:
+        await message.reply(text, reply_markup=keyboard)
+        await message.delete()
+    except MessageNotModified:
+        await message.delete()
+
+
+async def render_batch(client: Client, callback_query: CallbackQuery, batch: dict, tracks: list, language: str) -> None:
+    """
+    Render every track of a session on the render pool and send them back.
+
+    Tracks are delivered as albums, or added one by one to a ZIP as they
+    finish so rendered files don't pile up on disk. The menu message shows
+    the progress meanwhile; tracks that fail are reported and left out.
+    """
+    messages = Messages(language=language)
+    user_id = callback_query.from_user.id
+    image_file = None
+    downloads = []
+    archives = []
+    temp_dir = tempfile.mkdtemp(prefix=f"audio_batch_{batch.get('batch_id')}_")
+    output_archive = None
+    try:
+        if batch.get("image_id"):
+            image_file = await download_and_process_image(
+                client=client,
+                file_id=batch.get("image_id"),
+                max_size=(500, 500),
+                file_unique_id=batch.get("image_unique_id")
+            )
+        # Tracks of one archive share its single copy
+        sources = {}
+        for track in tracks:
+            if track.get("file_id") not in sources:
+                sources[track.get("file_id")] = track
+
+        async def fetch(track: dict) -> str | None:
+            # Paths are collected as each source arrives, so the cleanup sees them even if another one fails
+            if track.get("archive_member"):
+                path = await archive_cache.acquire(client, track.get("file_id"), track.get("file_unique_id"))
+                if path:
+                    archives.append(track.get("file_unique_id"))
+            else:
+                path = await download_audio(client, track.get("file_id"))
+                downloads.append(path)
+            return path
+
+        source_paths = await asyncio.gather(*(fetch(track) for track in sources.values()), return_exceptions=True)
+        for path in source_paths:
+            if isinstance(path, BaseException):
+                raise path
+        if None in source_paths:
+            raise RuntimeError(f"Couldn't download the sources of album session {batch.get('batch_id')}")
+        source_paths = dict(zip(sources, source_paths))
+
+        async def render(position: int, track: dict) -> tuple[int, bool, str]:
+            # The position prefix keeps files of the same name apart
+            output_file = os.path.join(temp_dir, f"{position + 1:02d} {output_names[position]}")
+            kwargs = dict(output_path=output_file,
+                          start_time=track.get("cut_start"),
+                          end_time=track.get("cut_end"),
+                          language=language,
+                          cover_path=image_file,
+                          effects=track.get("effects"),
+                          preset=batch.get("output_preset"),
+                          **track_metadata(track, batch, len(tracks)))
+            budget = render_budget(track, batch.get("user_id"), "batch")
+            if track.get("archive_member"):
+                success, result = await render_pool.run(render_archive_member, source_paths[track.get("file_id")],
+                                                        track.get("archive_member"), temp_dir, budget=budget, **kwargs)
+            else:
+                success, result = await render_pool.run(process_audio, input_path=source_paths[track.get("file_id")],
+                                                        budget=budget, **kwargs)
+            return position, success, output_file if success else result
+
+        output_names = [output_file_name(track, batch.get("output_preset")) for track in tracks]
+        archive_names = [name if output_names.count(name) == 1 else f"{position + 1:02d} {name}"
+                         for position, name in enumerate(output_names)]
+        if batch.get("as_archive"):
+            archive_name = f"{batch.get('album') or 'tracks'}.zip".replace("/", "_")
+            # Audio is compressed already, so members are stored as is
+            output_archive = zipfile.ZipFile(os.path.join(temp_dir, archive_name), "w", zipfile.ZIP_STORED)
+        rendered = [None] * len(tracks)
+        failed = []
+        last_report = 0.0
+        loop = asyncio.get_running_loop()
+        for done, next_result in enumerate(asyncio.as_completed([render(position, track)
+                                                                 for position, track in enumerate(tracks)]), start=1):
+            position, success, result = await next_result
+            name = tracks[position].get("title") or tracks[position].get("file_name")
+            if not success:
+                logger.warning(f"Album session {batch.get('batch_id')}: track {name} failed: {result}")
+                failed.append(name)
+            elif output_archive:
+                await asyncio.to_thread(output_archive.write, result, archive_names[position])
+                os.remove(result)
+            else:
+                rendered[position] = result
+            if done == len(tracks) or loop.time() - last_report >= PROGRESS_INTERVAL:
+                last_report = loop.time()
+                try:
+                    await callback_query.edit_message_text(messages.batch_progress.format(done=done, total=len(tracks),
+                                                                                          name=name))
+                except MessageNotModified:
+                    pass
+        if failed:
+            await callback_query.message.reply(messages.batch_failed.format("\n".join(failed)))
+        if len(failed) == len(tracks):
+            await callback_query.edit_message_text(create_message_batch(batch, tracks, language),
+                                                   reply_markup=batch_keyboard(language, batch))
+            return
+        if output_archive:
+            output_archive.close()
+            with TRANSFER_DURATION.time(direction="upload", media="archive"), span("send_document", parts=len(tracks)):
+                await client.send_document(chat_id=user_id, document=output_archive.filename, file_name=archive_name,
+                                           thumb=image_file)
+            TRANSFER_BYTES.inc(os.path.getsize(output_archive.filename), direction="upload", media="archive")
+        else:
+            media = []
+            for track, output_file, output_name in zip(tracks, rendered, output_names):
+                if output_file:
+                    metadata = track_metadata(track, batch, len(tracks))
+                    duration = rendered_duration(track.get("duration"), track.get("cut_start"), track.get("cut_end"),
+                                                 track.get("cut_segments"), track.get("effects"))
+                    media.append(InputMediaAudio(output_file,
+                                                 thumb=image_file,
+                                                 duration=round(duration or 0),
+                                                 title=metadata["title"] or "",
+                                                 performer=metadata["artist"] or "",
+                                                 file_name=output_name))
+            await send_audio_group(client, user_id, media)
+        await AudioBatches.delete(user_id=user_id, batch_id=batch.get("batch_id"))
+        for track in sources.values():
+            if track.get("archive_member"):
+                archive_cache.discard(track.get("file_unique_id"))
+        await callback_query.message.delete()
+    except MessageDeleteForbidden:
+        pass
+    except Exception as e:
+        logger.error(f"Error rendering album session: {e}", exc_info=True)
+        await callback_query.message.reply(messages.error_processing_audio)
+        try:
+            await callback_query.edit_message_text(create_message_batch(batch, tracks, language),
+                                                   reply_markup=batch_keyboard(language, batch))
+        except (MessageIdInvalid, MessageNotModified):
+            pass
+    finally:
+        if output_archive:
+            output_archive.close()
+        for file_path in downloads:
+            if file_path and os.path.exists(file_path):
+                cleanup_temp_file(file_path)
+        for file_unique_id in archives:
+            archive_cache.release(file_unique_id)
+        if image_file:
+            cleanup_temp_file(image_file)
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+@with_language
+async def batch_callback_handler(client: Client, callback_query: CallbackQuery, language: str):
+    user_id = callback_query.from_user.id
+    messages = Messages(language=language)
+    action, batch_id = callback_query.data.split(":")
+    action = action[len("batch_"):]
+    batch_id = int(batch_id)
+    batch = await AudioBatches.get(user_id=user_id, batch_id=batch_id)
+    tracks = await AudioFiles.get_batch(user_id=user_id, batch_id=batch_id) if batch else []
+    if not tracks:
+        try:
+            await callback_query.message.delete()
+        except MessageDeleteForbidden:
+            pass
+        await callback_query.answer(messages.audio_not_found)
+        return
+    if action in BATCH_INPUTS:
+        # Users.audio_id references audio_files, so the session is found again through its first track
+        await Users.set_waiting_for(user_id=user_id, wait_input=f"batch_{action}", audio_id=tracks[0].get("audio_id"),
+                                    waiting_for_message_id=callback_query.message.id)
+        action_messages = {
+            "album": messages.waiting_for_album,
+            "artist": messages.waiting_for_artist,
+            "genre": messages.waiting_for_genre,
+            "date": messages.waiting_for_date,
+            "image": messages.waiting_for_image,
+            "titles": messages.waiting_for_batch_titles,
+        }
+        cancel_button = buttons_builder(name=messages.cancel, data=f"batch_menu:{batch_id}")
+        await callback_query.edit_message_text(action_messages[action], reply_markup=cancel_button)
+    elif action in ("format", "delivery"):
+        if action == "format":
+            batch = await AudioBatches.update(user_id=user_id, batch_id=batch_id,
+                                              output_preset=next_output_preset(batch.get("output_preset")))
+        else:
+            batch = await AudioBatches.update(user_id=user_id, batch_id=batch_id,
+                                              as_archive=not batch.get("as_archive"))
+        await callback_query.edit_message_reply_markup(reply_markup=batch_keyboard(language, batch))
+    elif action == "menu":
+        await Users.clear_waiting_for(user_id=user_id)
+        await callback_query.edit_message_text(create_message_batch(batch, tracks, language),
+                                               reply_markup=batch_keyboard(language, batch))
+    elif action == "cancel":
+        await Users.clear_waiting_for(user_id=user_id)
+        await AudioBatches.delete(user_id=user_id, batch_id=batch_id)
+        for track in tracks:
+            if track.get("archive_member"):
+                archive_cache.discard(track.get("file_unique_id"))
+        await callback_query.answer(messages.batch_cancelled)
+        try:
+            await callback_query.message.delete()
+        except MessageDeleteForbidden:
+            pass
+    elif action == "done":
+        await Users.clear_waiting_for(user_id=user_id)
+        await callback_query.answer(messages.batch_running.format(len(tracks)))
+        await render_batch(client, callback_query, batch, tracks, language)
+    else:
+        await callback_query.answer(messages.invalid_action)
+
+
+batch_callback_handlers = [
+    CallbackQueryHandler(batch_callback_handler, filters.regex(r"^batch_\w+:(\d+)$"))
+]
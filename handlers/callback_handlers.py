@@ -1,14 +1,25 @@
+import asyncio
+import math
 import os
-from pyrogram.errors import MessageDeleteForbidden
-from pyrogram.types import CallbackQuery
-from tools.audio_utils import process_audio
-from tools.enums import Messages, create_message_audio
+from pyrogram.errors import MessageDeleteForbidden, MessageNotModified
+from pyrogram.types import CallbackQuery, InputMediaAudio, Message
+from tools.audio_utils import (PREFLIGHT_CHUNKS, PREFLIGHT_MAX_CHUNKS, PREFLIGHT_PROBE, STREAM_CHUNK_SIZE,
+                               compute_waveform, detect_trim, estimate_render, id3_tag_size, probe_file, probe_partial, process_audio,
+                               render_preview, rendered_duration)
+from tools.enums import Messages, create_message_audio, format_cut, format_timestamp
 from pyrogram.handlers import CallbackQueryHandler
 from pyrogram import filters, Client
 from database import Users, AudioFiles
-from tools.inline_keyboards import audio_edit_buttons, buttons_builder
+from tools.inline_keyboards import audio_edit_buttons, buttons_builder, effects_buttons, presets_buttons
+from tools.effects import EFFECT_RANGES, EFFECT_TOGGLES, analysis_key, effect_value, has_effect, set_effect
+from tools.presets import is_preset, preset_extension
+from tools.render_pool import RenderBudget, render_pool
+from tools.split import MEDIA_GROUP_SIZE, plan_parts
+from tools.waveform import pack_peaks, render_waveform, unpack_peaks, waveform_cache, waveform_cache_key
 from tools.tools import with_language
 from tools.logger import logger
+from tools.metrics import TRANSFER_BYTES, TRANSFER_DURATION
+from tools.tracing import span
 import tempfile
 from tools.image_utils import download_and_process_image, cleanup_temp_file
 import shutil
@@ -34,6 +45,82 @@ async def select_language_handler(_, callback_query: CallbackQuery):
     await callback_query.edit_message_text(messages.language_set.format(language_name))
 
 
+async def download_audio(client: Client, file_id: str, media: str = "audio") -> str | None:
+    """Download an audio file (or an archive of them) to a temporary path, recording transfer metrics."""
+    with TRANSFER_DURATION.time(direction="download", media=media), span("download_media", media=media):
+        input_file = await client.download_media(file_id)
+    if input_file and os.path.exists(input_file):
+        TRANSFER_BYTES.inc(os.path.getsize(input_file), direction="download", media=media)
+    return input_file
+
+
+def render_budget(audio: dict, user_id: int, operation: str, writes_output: bool = True,
+                  prefer_streaming: bool = False) -> RenderBudget:
+    """Admission budget for a render pool job on ``audio`` (an ``AudioFiles`` row), see ``estimate_render``."""
+    memory, temp = estimate_render(audio.get("file_size"), audio.get("duration"), audio.get("sample_rate"),
+                                   audio.get("channels"), audio.get("effects"), prefer_streaming)
+    if not writes_output:
+        return RenderBudget(memory, 0, user_id, operation)
+    if audio.get("archive_member"):
+        # The track is copied out of its archive for the render
+        temp += audio.get("file_size") or 0
+    return RenderBudget(memory, temp, user_id, operation)
+
+
+async def probe_upload(client: Client, message: Message) -> dict:
+    """
+    Probe an upload from its first and last chunks, before anything is downloaded in full.
+
+    Returns the ``AudioFiles`` probe columns (duration, codec, bit_rate,
+    sample_rate, channels), or an empty dict when the probe is disabled,
+    inconclusive or can't be fetched.
+
+    Raises:
+        ValueError: If the upload isn't audio that can be decoded
+    """
+    media = message.audio or message.document or message.voice
+    if not PREFLIGHT_PROBE or not media:
+        return {}
+    file_size = media.file_size or 0
+    try:
+        with TRANSFER_DURATION.time(direction="download", media="probe"), span("stream_media", media="probe"):
+            head = b"".join([chunk async for chunk in client.stream_media(message, limit=PREFLIGHT_CHUNKS)])
+            # A large cover in an ID3 tag can push the first audio frame past the first chunks
+            needed = min(math.ceil((id3_tag_size(head) + STREAM_CHUNK_SIZE // 16) / STREAM_CHUNK_SIZE),
+                         PREFLIGHT_MAX_CHUNKS)
+            if len(head) < file_size and needed > PREFLIGHT_CHUNKS:
+                head += b"".join([chunk async for chunk in client.stream_media(message, limit=needed - PREFLIGHT_CHUNKS,
+                                                                                offset=PREFLIGHT_CHUNKS)])
+            tail = b""
+            if len(head) < file_size:
+                tail = b"".join([chunk async for chunk in client.stream_media(message, offset=-1)])
+        TRANSFER_BYTES.inc(len(head) + len(tail), direction="download", media="probe")
+    except Exception as e:
+        logger.warning(f"Pre-flight fetch failed for {media.file_unique_id}: {e}")
+        return {}
+    suffix = os.path.splitext(getattr(media, "file_name", None) or "")[1].lower()
+    info = await render_pool.run_priority(probe_partial, head, tail, file_size or None, suffix)
+    if not info:
+        return {}
+    return {"duration": info.duration, "codec": info.codec, "bit_rate": info.bit_rate,
+            "sample_rate": info.sample_rate, "channels": info.channels}
+
+
+async def send_audio_group(client: Client, chat_id: int, media: list) -> None:
+    """Send rendered audios as media groups of up to ``MEDIA_GROUP_SIZE``, recording upload metrics."""
+    for offset in range(0, len(media), MEDIA_GROUP_SIZE):
+        group = media[offset:offset + MEDIA_GROUP_SIZE]
+        with TRANSFER_DURATION.time(direction="upload", media="audio"), span("send_media_group", parts=len(group)):
+            if len(group) == 1:
+                # A media group needs at least two items
+                await client.send_audio(chat_id=chat_id, audio=group[0].media, thumb=group[0].thumb,
+                                        title=group[0].title, performer=group[0].performer,
+                                        duration=group[0].duration, file_name=group[0].file_name)
+            else:
+                await client.send_media_group(chat_id=chat_id, media=group)
+    TRANSFER_BYTES.inc(sum(os.path.getsize(item.media) for item in media), direction="upload", media="audio")
+
+
 @with_language
 async def audio_edit_handler(client: Client, callback_query: CallbackQuery, language: str):
     user_id = callback_query.from_user.id
@@ -53,7 +140,7 @@ async def audio_edit_handler(client: Client, callback_query: CallbackQuery, lang
             pass
         await callback_query.answer(messages.audio_not_found)
         return
-    actions = ("image", "name", "cut", "genre", "album", "artist", "title", "date")
+    actions = ("image", "name", "cut", "split", "genre", "album", "artist", "title", "date", *EFFECT_RANGES)
     if action in actions:
         await Users.set_waiting_for(user_id=user_id, wait_input=action, audio_id=audio_id, waiting_for_message_id=callback_query.message.id)
         cancel_button = buttons_builder(name=messages.cancel, data=f"cancel:{audio_id}")
@@ -62,12 +149,41 @@ async def audio_edit_handler(client: Client, callback_query: CallbackQuery, lang
             "name": messages.waiting_for_name,
             "title": messages.waiting_for_title,
             "cut": messages.waiting_for_cut,
+            "split": messages.waiting_for_split,
             "genre": messages.waiting_for_genre,
             "album": messages.waiting_for_album,
             "artist": messages.waiting_for_artist,
             "date": messages.waiting_for_date,
+            "fade_in": messages.waiting_for_fade_in,
+            "fade_out": messages.waiting_for_fade_out,
+            "gain": messages.waiting_for_gain,
+            "speed": messages.waiting_for_speed,
+            "crossfade": messages.waiting_for_crossfade,
         }
         await callback_query.edit_message_text(action_messages[action], reply_markup=cancel_button)
+    elif action in ("effects", "clear_effects", *EFFECT_TOGGLES):
+        if action == "clear_effects":
+            audio = await AudioFiles.update(user_id=user_id, audio_id=audio_id, effects=None)
+        elif action in EFFECT_TOGGLES:
+            audio = await AudioFiles.update(user_id=user_id, audio_id=audio_id,
+                                            effects=set_effect(audio.get("effects"), action))
+        keyboard = effects_buttons(language=language, audio_id=audio_id, effects=audio.get("effects"))
+        message_audio = create_message_audio(audio_file=audio, language=language)
+        await callback_query.edit_message_text(message_audio, reply_markup=keyboard)
+    elif action == "presets" or action.startswith("preset_"):
+        if action != "presets":
+            preset = action[len("preset_"):]
+            if preset != "original" and not is_preset(preset):
+                await callback_query.answer(messages.invalid_action)
+                return
+            audio = await AudioFiles.update(user_id=user_id, audio_id=audio_id,
+                                            output_preset=None if preset == "original" else preset)
+        keyboard = presets_buttons(language=language, audio_id=audio_id, output_preset=audio.get("output_preset"))
+        message_audio = create_message_audio(audio_file=audio, language=language)
+        try:
+            await callback_query.edit_message_text(message_audio, reply_markup=keyboard)
+        except MessageNotModified:
+            pass
     elif action == "cancel":
         await Users.clear_waiting_for(user_id=user_id)
         audio = await AudioFiles.get(user_id=user_id, audio_id=audio_id)
@@ -77,6 +193,176 @@ async def audio_edit_handler(client: Client, callback_query: CallbackQuery, lang
             await callback_query.edit_message_text(message_audio, reply_markup=keyboard)
         else:
             await callback_query.answer(messages.audio_not_found)
+    elif action == "auto_trim":
+        await Users.clear_waiting_for(user_id=user_id)
+        await callback_query.answer(messages.auto_trim_running)
+        input_file = None
+        try:
+            input_file = await download_audio(client, audio.get("file_id"))
+            cut_start, cut_end = await render_pool.run(detect_trim, input_file,
+                                                       budget=render_budget(audio, user_id, "auto_trim", False))
+        except ValueError:
+            await callback_query.message.reply(messages.auto_trim_silent)
+            return
+        except Exception as e:
+            logger.error(f"Error detecting silence: {e}", exc_info=True)
+            await callback_query.message.reply(messages.error_processing_audio)
+            return
+        finally:
+            if input_file and os.path.exists(input_file):
+                cleanup_temp_file(input_file)
+        if cut_start is None and cut_end is None:
+            await callback_query.message.reply(messages.auto_trim_nothing)
+            return
+        audio = await AudioFiles.update(user_id=user_id, audio_id=audio_id, cut_start=cut_start, cut_end=cut_end,
+                                        cut_segments=None)
+        keyboard = audio_edit_buttons(language=language, audio_id=audio_id)
+        message_audio = create_message_audio(audio_file=audio, language=language)
+        try:
+            await callback_query.edit_message_text(message_audio, reply_markup=keyboard)
+        except MessageNotModified:
+            pass
+    elif action == "preview":
+        await callback_query.answer(messages.preview_running)
+        cut_start = audio.get("cut_start")
+        cut_end = audio.get("cut_end")
+        input_file = None
+        preview_file = None
+        try:
+            input_file = await download_audio(client, audio.get("file_id"))
+            with tempfile.NamedTemporaryFile(suffix=".mp3", delete=False) as temp_file:
+                preview_file = temp_file.name
+            # The draft is left as is, so the cut can be adjusted and previewed again
+            duration = await render_pool.run_priority(render_preview, input_file, preview_file, cut_start, cut_end,
+                                                      segments=audio.get("cut_segments"),
+                                                      crossfade=effect_value(audio.get("effects"), "crossfade") or 0,
+                                                      budget=RenderBudget(user_id=user_id, operation="preview"))
+            caption = messages.preview_caption.format(cut=format_cut(audio))
+            with TRANSFER_DURATION.time(direction="upload", media="preview"), span("send_audio", preview=True):
+                await callback_query.message.reply_audio(preview_file,
+                                                         caption=caption,
+                                                         duration=int(duration),
+                                                         title=audio.get("title"),
+                                                         file_name=f"preview_{os.path.splitext(audio.get('file_name'))[0]}.mp3")
+        except Exception as e:
+            logger.error(f"Error rendering preview: {e}", exc_info=True)
+            await callback_query.message.reply(messages.error_processing_audio)
+        finally:
+            for file_path in (input_file, preview_file):
+                if file_path and os.path.exists(file_path):
+                    cleanup_temp_file(file_path)
+    elif action == "split_run":
+        split_points = audio.get("split_points")
+        if not split_points:
+            await callback_query.answer(messages.invalid_action)
+            return
+        await Users.clear_waiting_for(user_id=user_id)
+        await callback_query.answer(messages.split_running)
+        file_name = audio.get("file_name")
+        title = audio.get("title")
+        artist = audio.get("artist")
+        image_id = audio.get("image_id")
+        input_file = None
+        image_file = None
+        temp_dir = tempfile.mkdtemp(prefix=f"audio_split_{audio_id}_")
+        try:
+            input_file = await download_audio(client, audio.get("file_id"))
+            if image_id:
+                image_file = await download_and_process_image(
+                    client=client,
+                    file_id=image_id,
+                    max_size=(500, 500),
+                    file_unique_id=audio.get("image_unique_id")
+                )
+            info = await render_pool.run(probe_file, input_file, prefer_streaming=True)
+            parts = plan_parts(split_points, info.duration, audio.get("cut_start"), audio.get("cut_end"),
+                               audio.get("cut_segments"))
+            base_name, file_ext = os.path.splitext(file_name)
+            file_ext = "." + preset_extension(audio.get("output_preset"), file_ext.lower().lstrip(".") or "mp3")
+            # The file was downloaded once and the parts render in parallel. On the streaming
+            # backend each part seeks to its own range, so the track is decoded once in total;
+            # without ffmpeg, pydub decodes the whole file for every part
+            jobs = []
+            for number, part in enumerate(parts, start=1):
+                part["title"] = part.get("title") or f"{title or base_name} ({number}/{len(parts)})"
+                part["path"] = os.path.join(temp_dir, f"{base_name} - {number:02d}{file_ext}")
+                jobs.append(render_pool.run(
+                    process_audio,
+                    input_path=input_file,
+                    output_path=part["path"],
+                    start_time=part["start"],
+                    end_time=part["end"],
+                    segments=part["segments"],
+                    language=language,
+                    title=part["title"],
+                    artist=part.get("performer") or artist,
+                    album=audio.get("album") or title,
+                    genre=audio.get("genre"),
+                    file_date=audio.get("file_date"),
+                    cover_path=image_file,
+                    effects=audio.get("effects"),
+                    track=f"{number}/{len(parts)}",
+                    preset=audio.get("output_preset"),
+                    prefer_streaming=len(parts) > 1,
+                    budget=render_budget(audio, user_id, "split", prefer_streaming=len(parts) > 1)
+                ))
+            results = await asyncio.gather(*jobs)
+            failed = next((result for success, result in results if not success), None)
+            if failed:
+                await callback_query.message.reply(failed)
+                return
+            media = [InputMediaAudio(part["path"],
+                                     thumb=image_file,
+                                     title=part["title"],
+                                     performer=part.get("performer") or artist or "",
+                                     duration=round(rendered_duration(info.duration, part["start"], part["end"],
+                                                                      part["segments"], audio.get("effects")) or 0),
+                                     file_name=os.path.basename(part["path"]))
+                     for part in parts]
+            await send_audio_group(client, user_id, media)
+            await AudioFiles.delete(user_id=user_id, audio_id=audio_id)
+            await callback_query.message.delete()
+        except MessageDeleteForbidden:
+            pass
+        except Exception as e:
+            logger.error(f"Error splitting audio: {e}", exc_info=True)
+            await callback_query.message.reply(messages.error_processing_audio)
+        finally:
+            if input_file and os.path.exists(input_file):
+                cleanup_temp_file(input_file)
+            if image_file:
+                cleanup_temp_file(image_file)
+            shutil.rmtree(temp_dir, ignore_errors=True)
+    elif action == "waveform":
+        await callback_query.answer(messages.waveform_running)
+        file_unique_id = audio.get("file_unique_id")
+        cache_key = waveform_cache_key(file_unique_id) if file_unique_id else None
+        input_file = None
+        image_file = None
+        try:
+            cached = waveform_cache.get(cache_key) if cache_key else None
+            if cached is not None:
+                peaks, duration = unpack_peaks(cached)
+            else:
+                input_file = await download_audio(client, audio.get("file_id"))
+                peaks, duration = await render_pool.run(compute_waveform, input_file,
+                                                        budget=render_budget(audio, user_id, "waveform", False))
+                if cache_key:
+                    waveform_cache.put(cache_key, pack_peaks(peaks, duration))
+            with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as temp_file:
+                image_file = temp_file.name
+            await render_pool.run(render_waveform, peaks, duration, image_file,
+                                  audio.get("cut_start"), audio.get("cut_end"), segments=audio.get("cut_segments"))
+            caption = messages.waveform_caption.format(duration=format_timestamp(duration),
+                                                       cut=format_cut(audio, messages.not_set))
+            await callback_query.message.reply_photo(image_file, caption=caption)
+        except Exception as e:
+            logger.error(f"Error creating waveform: {e}", exc_info=True)
+            await callback_query.message.reply(messages.error_processing_audio)
+        finally:
+            for file_path in (input_file, image_file):
+                if file_path and os.path.exists(file_path):
+                    cleanup_temp_file(file_path)
     elif action == "done":
         await Users.clear_waiting_for(user_id=user_id)
         await callback_query.answer(messages.audio_processing)
@@ -91,23 +377,33 @@ async def audio_edit_handler(client: Client, callback_query: CallbackQuery, lang
             artist = audio.get("artist")
             cut_start = audio.get("cut_start")
             cut_end = audio.get("cut_end")
+            cut_segments = audio.get("cut_segments")
             file_date = audio.get("file_date")
-            input_file = await client.download_media(file_id)
+            effects = audio.get("effects")
+            measurements = {}
+            loudness_key = None
+            if has_effect(effects, "loudness"):
+                loudness_key = analysis_key(cut_start, cut_end, effects, "loudness", cut_segments)
+                if audio.get("loudness_key") == loudness_key:
+                    measurements["loudness"] = (audio.get("loudness_i"), audio.get("loudness_tp"))
+            input_file = await download_audio(client, file_id)
             image_file = None
             if image_id:
                 image_file = await download_and_process_image(
                     client=client,
                     file_id=image_id,
                     max_size=(500, 500),
-                    quality=85
+                    file_unique_id=audio.get("image_unique_id")
                 )
                 if not image_file:
                     logger.warning(f"Failed to process image {image_id}, continuing without thumbnail")
             temp_dir = tempfile.mkdtemp(prefix=f"audio_edit_{audio_id}_")
             try:
-                file_ext = os.path.splitext(file_name)[1].lower() or ".mp3"
+                base_name, file_ext = os.path.splitext(file_name)
+                file_ext = "." + preset_extension(audio.get("output_preset"), file_ext.lower().lstrip(".") or "mp3")
                 output_file = os.path.join(temp_dir, f"edited_{audio_id}{file_ext}")
-                success, result = process_audio(
+                success, result = await render_pool.run(
+                    process_audio,
                     input_path=input_file,
                     output_path=output_file,
                     start_time=cut_start,
@@ -117,23 +413,40 @@ async def audio_edit_handler(client: Client, callback_query: CallbackQuery, lang
                     file_date=file_date,
                     genre=genre,
                     album=album,
-                    artist=artist
+                    artist=artist,
+                    cover_path=image_file,
+                    effects=effects,
+                    measurements=measurements,
+                    segments=cut_segments,
+                    preset=audio.get("output_preset"),
+                    budget=render_budget(audio, user_id, "render")
                 )
+                if loudness_key and audio.get("loudness_key") != loudness_key and "loudness" in measurements:
+                    loudness_i, loudness_tp = measurements["loudness"]
+                    await AudioFiles.update(user_id=user_id, audio_id=audio_id, loudness_i=loudness_i,
+                                            loudness_tp=loudness_tp, loudness_key=loudness_key)
                 
                 if not success:
                     await callback_query.message.reply(result)
                     return
                 
-                with open(output_file, 'rb') as audio_file:
+                duration = rendered_duration(audio.get("duration"), cut_start, cut_end, cut_segments, effects)
+                if duration is None:
+                    # Nothing was known at upload: read it from the result rather than send 0
+                    duration = (await render_pool.run_priority(probe_file, output_file)).duration
+                with open(output_file, 'rb') as audio_file, \
+                        TRANSFER_DURATION.time(direction="upload", media="audio"), \
+                        span("send_audio"):
                     await client.send_audio(
                         chat_id=user_id,
                         audio=audio_file,
                         thumb=image_file,
-                        file_name=file_name,
+                        file_name=f"{base_name}{file_ext}",
                         title=title,
                         performer=artist,
-                        duration=int((cut_end or 0) - (cut_start or 0))
+                        duration=round(duration or 0)
                     )
+                TRANSFER_BYTES.inc(os.path.getsize(output_file), direction="upload", media="audio")
                 await AudioFiles.delete(user_id=user_id, audio_id=audio_id)
                 await callback_query.message.delete()
             except MessageDeleteForbidden:
@@ -3,11 +3,40 @@ from pyrogram.errors import MessageDeleteForbidden, MessageIdInvalid, MessageNot
 from pyrogram.handlers import MessageHandler
 from pyrogram.types import Message
 from database import AudioFiles, Users
-from tools.inline_keyboards import audio_edit_buttons
+from tools.inline_keyboards import audio_edit_buttons, split_buttons
 from tools.tools import parse_date, with_language
 from tools.enums import Messages, create_message_audio
-from tools.audio_utils import parse_cut_range, validate_audio_filename
-import os
+from tools.audio_utils import (clamp_segments, duration_tolerance, max_audio_size, parse_cut_segments,
+                               validate_audio_filename)
+from tools.effects import EFFECT_RANGES, parse_effect_value, set_effect
+from tools.split import describe_parts, parse_split_points, plan_parts
+from tools.archive import is_archive
+from handlers.batch_handlers import batch_input_handler, start_archive_batch, start_batch, upload_collector
+from handlers.callback_handlers import probe_upload
+from tools.logger import logger
+
+
+# CUE sheets and chapter lists sent as a file
+TEXT_DOCUMENT_EXTENSIONS = (".cue", ".txt")
+MAX_TEXT_DOCUMENT_SIZE = 256 * 1024
+
+
+def is_text_document(document) -> bool:
+    file_name = (document.file_name or "").lower()
+    return file_name.endswith(TEXT_DOCUMENT_EXTENSIONS) or (document.mime_type or "").startswith("text/")
+
+
+async def read_text_document(client: Client, message: Message) -> str | None:
+    """Download a small text document into memory and decode it."""
+    if not message.document or (message.document.file_size or 0) > MAX_TEXT_DOCUMENT_SIZE:
+        return None
+    data = (await client.download_media(message, in_memory=True)).getvalue()
+    for encoding in ("utf-8-sig", "cp1252"):
+        try:
+            return data.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    return data.decode("latin-1")
 
 
 @with_language
@@ -20,6 +49,10 @@ async def private_message_handler(client: Client, message: Message, language: st
         return
     audio_id = user.get("audio_id")
     max_length = 64
+    keyboard = None
+    if (user.get("wait_input") or "").startswith("batch_") and audio_id:
+        await batch_input_handler(client, message, user, language)
+        return
     if (wait_for := user.get("wait_input")) and audio_id:
         if wait_for == "cut":
             if not message.text:
@@ -28,15 +61,28 @@ async def private_message_handler(client: Client, message: Message, language: st
                 return
             cat = message.text.strip()
             try:
-                start_time, end_time = parse_cut_range(cat, language)
+                segments = parse_cut_segments(cat, language)
             except ValueError as e:
                 await message.reply(str(e))
                 await message.delete()
                 return
+            audio_file = await AudioFiles.get(user_id=user_id, audio_id=audio_id)
+            if not audio_file:
+                await message.reply(messages.audio_not_found)
+                return
+            # Known from the upload or its pre-flight probe, so a bad cut is caught before any download
+            duration = audio_file.get("duration")
+            segments = clamp_segments(segments, duration, duration_tolerance(duration))
+            if not segments:
+                await message.reply(messages.error_start_beyond_length)
+                await message.delete()
+                return
             audio_file = await AudioFiles.update(user_id=user_id,
                                                audio_id=audio_id,
-                                               cut_start=start_time,
-                                               cut_end=end_time)
+                                               cut_start=segments[0][0],
+                                               cut_end=segments[-1][1],
+                                               cut_segments=[list(segment) for segment in segments]
+                                               if len(segments) > 1 else None)
         elif wait_for == "name":
             if not message.text:
                 await message.reply(messages.waiting_for_name)
@@ -63,7 +109,8 @@ async def private_message_handler(client: Client, message: Message, language: st
             image_id = message.photo.sizes[-1].file_id
             audio_file = await AudioFiles.update(user_id=user_id,
                                                audio_id=audio_id,
-                                               image_id=image_id)
+                                               image_id=image_id,
+                                               image_unique_id=message.photo.sizes[-1].file_unique_id)
         elif wait_for == "genre":
             if not message.text:
                 await message.reply(messages.waiting_for_genre)
@@ -127,12 +174,61 @@ async def private_message_handler(client: Client, message: Message, language: st
             audio_file = await AudioFiles.update(user_id=user_id,
                                                audio_id=audio_id,
                                                file_date=date)
+        elif wait_for in EFFECT_RANGES:
+            if not message.text:
+                await message.reply(getattr(messages, f"waiting_for_{wait_for}"))
+                await message.delete()
+                return
+            try:
+                value = parse_effect_value(wait_for, message.text, language)
+            except ValueError as e:
+                await message.reply(str(e))
+                await message.delete()
+                return
+            audio_file = await AudioFiles.get(user_id=user_id, audio_id=audio_id)
+            if not audio_file:
+                await message.reply(messages.audio_not_found)
+                return
+            audio_file = await AudioFiles.update(user_id=user_id,
+                                               audio_id=audio_id,
+                                               effects=set_effect(audio_file.get("effects"), wait_for, value))
+        elif wait_for == "split":
+            text = message.text
+            if not text and message.document:
+                text = await read_text_document(client, message)
+            if not text:
+                await message.reply(messages.waiting_for_split)
+                await message.delete()
+                return
+            try:
+                points = parse_split_points(text, language)
+            except ValueError as e:
+                await message.reply(str(e))
+                await message.delete()
+                return
+            audio_file = await AudioFiles.get(user_id=user_id, audio_id=audio_id)
+            if not audio_file:
+                await message.reply(messages.audio_not_found)
+                return
+            duration = audio_file.get("duration")
+            if duration and points[-1]["start"] >= duration + duration_tolerance(duration):
+                await message.reply(messages.error_start_beyond_length)
+                await message.delete()
+                return
+            audio_file = await AudioFiles.update(user_id=user_id,
+                                               audio_id=audio_id,
+                                               split_points=points)
+            parts = plan_parts(points, duration, audio_file.get("cut_start"), audio_file.get("cut_end"),
+                               audio_file.get("cut_segments"))
+            message_audio = messages.split_confirm.format(count=len(parts), parts=describe_parts(parts))
+            keyboard = split_buttons(language=language, audio_id=audio_id, parts_count=len(parts))
         else:
             await message.reply(messages.invalid_action)
             await message.delete()
             return
-        message_audio = create_message_audio(audio_file=audio_file, language=language)
-        keyboard = audio_edit_buttons(language=language, audio_id=audio_id)
+        if keyboard is None:
+            message_audio = create_message_audio(audio_file=audio_file, language=language)
+            keyboard = audio_edit_buttons(language=language, audio_id=audio_id)
         try:
             await client.edit_message_text(chat_id=user_id,
                                            message_id=user.get("waiting_for_message_id"),
@@ -153,43 +249,94 @@ async def private_message_handler(client: Client, message: Message, language: st
 
 
 @with_language
-async def audio_message_handler(_, message: Message, language: str):
+async def audio_message_handler(client: Client, message: Message, language: str):
     messages = Messages(language=language)
     user_id = message.from_user.id
+    if message.document and is_text_document(message.document):
+        # A CUE sheet for a pending split rather than a new audio file
+        user = await Users.get_waiting_for(user_id)
+        if user and user.get("wait_input") == "split":
+            await private_message_handler(client, message)
+            return
+    if message.document and is_archive(message.document.file_name, message.document.mime_type):
+        # A ZIP of tracks becomes an album session of its own
+        await start_archive_batch(client, message, language)
+        return
     if message.audio:
         file_id = message.audio.file_id
+        file_unique_id = message.audio.file_unique_id
         file_name = message.audio.file_name
         file_size = message.audio.file_size
         file_title = message.audio.title
         file_date = message.audio.date
         mime_type = message.audio.mime_type
+        file_duration = message.audio.duration
     elif message.document and (message.document.mime_type == "audio/mpeg" or message.document.mime_type == "audio/mp3"):
         file_id = message.document.file_id
+        file_unique_id = message.document.file_unique_id
         file_name = message.document.file_name
         file_size = message.document.file_size
         file_title = None
         file_date = message.document.date
         mime_type = message.document.mime_type
+        file_duration = None
     elif message.voice:
         file_id = message.voice.file_id
+        file_unique_id = message.voice.file_unique_id
         file_name = f"voice_{message.voice.file_id}.mp3"
         file_size = message.voice.file_size
         file_title = None
         file_date = message.voice.date
         mime_type = message.voice.mime_type
+        file_duration = message.voice.duration
     else:
         await message.reply(messages.send_audio)
         return
-    if file_size > int(os.getenv("MAX_AUDIO_SIZE", 40)) * 1024 * 1024:
-        await message.reply(messages.error_audio_too_large.format(os.getenv("MAX_AUDIO_SIZE")))
+    # Past MAX_AUDIO_SIZE only in large-file mode, where renders stream instead of loading the file
+    max_size = max_audio_size()
+    if file_size > max_size:
+        await message.reply(messages.error_audio_too_large.format(max_size // (1024 * 1024)))
+        return
+    upload = {"file_id": file_id,
+              "file_unique_id": file_unique_id,
+              "file_name": file_name,
+              "file_size": file_size,
+              "title": file_title,
+              "mime_type": mime_type,
+              "file_date": file_date,
+              "duration": file_duration or None,
+              "message": message}
+
+    async def start_uploads(uploads: list) -> None:
+        if len(uploads) == 1:
+            await create_audio_draft(client, uploads[0], language)
+        else:
+            await start_batch(client, uploads, language)
+
+    # Uploads of one media group (or time window) become an album session
+    if upload_collector.add(user_id, message.media_group_id, upload, start_uploads):
+        return
+    await create_audio_draft(client, upload, language)
+
+
+async def create_audio_draft(client: Client, upload: dict, language: str) -> None:
+    """Probe a single upload, store it and reply with its edit menu."""
+    message = upload["message"]
+    try:
+        probe = await probe_upload(client, message)
+    except ValueError as e:
+        logger.info(f"Rejected upload {upload['file_unique_id']} from {message.from_user.id}: {e}")
+        await message.reply(Messages(language=language).error_audio_unreadable)
         return
-    audio_file = await AudioFiles.create(user_id=user_id,
-                                         file_id=file_id,
-                                         file_name=file_name,
-                                         file_size=file_size,
-                                         title=file_title,
-                                         mime_type=mime_type,
-                                         file_date=file_date)
+    audio_file = await AudioFiles.create(user_id=message.from_user.id,
+                                         file_id=upload["file_id"],
+                                         file_name=upload["file_name"],
+                                         file_size=upload["file_size"],
+                                         title=upload["title"],
+                                         mime_type=upload["mime_type"],
+                                         file_date=upload["file_date"],
+                                         file_unique_id=upload["file_unique_id"],
+                                         **{**probe, "duration": probe.get("duration") or upload.get("duration")})
     keyboard = audio_edit_buttons(language=language, audio_id=audio_file.get("audio_id"))
     message_audio = create_message_audio(audio_file=audio_file, language=language)
     await message.reply(message_audio, reply_markup=keyboard)
@@ -3,11 +3,14 @@ import asyncio
 from dotenv import load_dotenv
 from pyrogram import Client, idle
 from tools.logger import logger
-from database import create_tables, BotSettings
+from database import create_tables, BotSettings, RenderUsage
 from tools.tools import register_handlers
+from tools.metrics import UPDATES_QUEUE_SIZE, start_metrics_server
+from tools.render_pool import render_pool
 from handlers import (
     commands_handlers,
     callback_query_handlers,
+    batch_callback_handlers,
     message_handlers
 )
 from bot import settings_handlers, settings_callback_handlers
@@ -22,6 +25,8 @@ token = os.getenv("BOT_TOKEN")
 bot_client_name = os.getenv("BOT_CLIENT_NAME", "bot")
 bot_owner_id = os.getenv("BOT_OWNER_ID")
 skip_updates = os.getenv("SKIP_UPDATES", False)
+metrics_port = os.getenv("METRICS_PORT")
+metrics_host = os.getenv("METRICS_HOST", "127.0.0.1")
 
 
 if not api_id or not api_hash or not token or not bot_client_name:
@@ -34,6 +39,8 @@ app = Client(bot_client_name, api_id=api_id, api_hash=api_hash, bot_token=token,
 register_handlers(
     app,
     commands_handlers,
+    # Before callback_query_handlers, whose pattern also matches "batch_<action>:<id>"
+    batch_callback_handlers,
     callback_query_handlers,
     settings_handlers,
     settings_callback_handlers,
@@ -42,9 +49,16 @@ register_handlers(
 
 
 async def main():
+    metrics_server = None
     try:
         # Initialize database first
         await create_tables()
+        # Per-user render usage log, see /usage
+        render_pool.usage_recorder = RenderUsage.record
+
+        if metrics_port:
+            UPDATES_QUEUE_SIZE.set_function(lambda: app.dispatcher.updates_queue.qsize())
+            metrics_server = await start_metrics_server(metrics_host, int(metrics_port))
 
         await app.start()
         me = await app.get_me()
@@ -70,9 +84,12 @@ async def main():
     except Exception as e:
         logger.error(f"An error occurred: {str(e)}", exc_info=True)
     finally:
+        if metrics_server:
+            metrics_server.close()
         if app.is_connected:
             await app.stop()
             logger.success("Bot stopped successfully")
+        render_pool.shutdown(wait=False)
 
 
 if __name__ == "__main__":
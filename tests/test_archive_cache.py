@@ -0,0 +1,84 @@
+import asyncio
+import os
+import pytest
+from handlers import batch_handlers
+from handlers.batch_handlers import ArchiveCache
+
+
+@pytest.fixture
+def downloads(tmp_path, monkeypatch):
+    """Replace the Telegram download with one writing a file per archive; returns the downloaded ids."""
+    calls = []
+
+    async def download_audio(client, file_id, media="audio"):
+        calls.append(file_id)
+        await asyncio.sleep(0)
+        if file_id == "missing":
+            return None
+        if file_id == "broken":
+            raise ConnectionError("network down")
+        path = tmp_path / f"{file_id}-{len(calls)}.zip"
+        path.write_bytes(b"PK")
+        return str(path)
+
+    monkeypatch.setattr(batch_handlers, "download_audio", download_audio)
+    return calls
+
+
+def test_pinned_archive_is_not_evicted(downloads):
+    async def scenario():
+        cache = ArchiveCache(size=1)
+        first = await cache.acquire(None, "a", "a")
+        second = await cache.acquire(None, "b", "b")
+        assert os.path.exists(first) and os.path.exists(second)
+        cache.release("a")
+        # Over the size with "a" no longer pinned: it goes, the pinned "b" stays
+        assert not os.path.exists(first) and os.path.exists(second)
+        cache.release("b")
+        assert os.path.exists(second)
+        assert await cache.acquire(None, "b", "b") == second
+        assert downloads == ["a", "b"]
+
+    asyncio.run(scenario())
+
+
+def test_discard_waits_for_last_release(downloads):
+    async def scenario():
+        cache = ArchiveCache()
+        path = await cache.acquire(None, "a", "a")
+        assert await cache.acquire(None, "a", "a") == path
+        cache.discard("a")
+        assert os.path.exists(path)
+        cache.release("a")
+        assert os.path.exists(path)
+        cache.release("a")
+        assert not os.path.exists(path)
+        # Discarding an archive nobody holds deletes it at once
+        path = await cache.get(None, "b", "b")
+        cache.discard("b")
+        assert not os.path.exists(path)
+
+    asyncio.run(scenario())
+
+
+def test_concurrent_acquires_share_one_download(downloads):
+    async def scenario():
+        cache = ArchiveCache()
+        paths = await asyncio.gather(*(cache.acquire(None, "a", "a") for _ in range(3)))
+        assert len(set(paths)) == 1 and downloads == ["a"]
+        for _ in paths:
+            cache.release("a")
+        assert cache._pins == {}
+
+    asyncio.run(scenario())
+
+
+def test_failed_downloads_leave_nothing_pinned(downloads):
+    async def scenario():
+        cache = ArchiveCache()
+        assert await cache.acquire(None, "missing", "missing") is None
+        with pytest.raises(ConnectionError):
+            await cache.acquire(None, "broken", "broken")
+        assert cache._pins == {} and cache._downloads == {}
+
+    asyncio.run(scenario())
@@ -0,0 +1,74 @@
+import pytest
+from tools.audio_utils import (MAX_CUT_SEGMENTS, METADATA_DURATION_TOLERANCE, clamp_segments, duration_tolerance,
+                               parse_cut_range, parse_cut_segments, rendered_duration, segments_duration)
+
+
+def test_parse_cut_range_formats():
+    assert parse_cut_range("1:15-2:30", "en") == (75.0, 150.0)
+    assert parse_cut_range("75 – 150", "en") == (75.0, 150.0)
+    assert parse_cut_range("1m15s-2m30s", "en") == (75.0, 150.0)
+    assert parse_cut_range("00:01:15-00:02:30", "en") == (75.0, 150.0)
+
+
+@pytest.mark.parametrize("text", ["", "10", "10-20-30", "30-10", "10-10"])
+def test_parse_cut_range_rejects(text):
+    with pytest.raises(ValueError):
+        parse_cut_range(text, "en")
+
+
+def test_parse_cut_segments_separators():
+    assert parse_cut_segments("0:10-0:20, 0:30-0:40; 1:00-1:10\n2:00-2:05", "en") == [
+        (10.0, 20.0), (30.0, 40.0), (60.0, 70.0), (120.0, 125.0)]
+
+
+def test_parse_cut_segments_rejects_overlap_and_order():
+    with pytest.raises(ValueError):
+        parse_cut_segments("10-30, 20-40", "en")
+    with pytest.raises(ValueError):
+        parse_cut_segments("50-60, 10-20", "en")
+
+
+def test_parse_cut_segments_limits_ranges():
+    text = ", ".join(f"{index * 10}-{index * 10 + 5}" for index in range(MAX_CUT_SEGMENTS + 1))
+    with pytest.raises(ValueError):
+        parse_cut_segments(text, "en")
+    assert len(parse_cut_segments(text.rsplit(",", 1)[0], "en")) == MAX_CUT_SEGMENTS
+
+
+@pytest.mark.parametrize("text", ["", "   ", "hello", "10-20, x"])
+def test_parse_cut_segments_rejects_text(text):
+    with pytest.raises(ValueError):
+        parse_cut_segments(text, "en")
+
+
+def test_clamp_segments():
+    segments = [(0, 10), (50, 70), (100, 120)]
+    assert clamp_segments(segments, 60.0) == [(0.0, 10.0), (50.0, 60.0)]
+    assert clamp_segments(segments, None) == [(0.0, 10.0), (50.0, 70.0), (100.0, 120.0)]
+    assert clamp_segments([(60, 70)], 60.0) == []
+
+
+def test_clamp_segments_tolerance():
+    # A whole-second duration may be Telegram's rounding of a slightly longer track
+    assert duration_tolerance(60) == METADATA_DURATION_TOLERANCE
+    assert duration_tolerance(60.0) == METADATA_DURATION_TOLERANCE
+    assert duration_tolerance(60.4) == 0.0
+    assert duration_tolerance(None) == 0.0
+    assert clamp_segments([(0, 10), (60, 70)], 60, duration_tolerance(60)) == [(0.0, 10.0), (60.0, 61.0)]
+    assert clamp_segments([(0, 10), (60.5, 70)], 60.4, duration_tolerance(60.4)) == [(0.0, 10.0)]
+    assert clamp_segments([(0, 10), (60.5, 70)], 60, duration_tolerance(60)) == [(0.0, 10.0), (60.5, 61.0)]
+
+
+def test_segments_duration_with_crossfade():
+    assert segments_duration([(0, 10), (20, 30)]) == 20
+    assert segments_duration([(0, 10), (20, 30)], crossfade=2) == 18
+    # A join never overlaps more than the range it joins
+    assert segments_duration([(0, 10), (20, 21)], crossfade=5) == 10
+
+
+def test_rendered_duration():
+    assert rendered_duration(100.0, 10, 40) == 30
+    assert rendered_duration(100.0, 10, 400) == 90
+    assert rendered_duration(None, 10, None) is None
+    assert rendered_duration(100.0, segments=[(0, 10), (95, 120)]) == 15
+    assert rendered_duration(100.0, 0, 60, effects=[{"type": "speed", "value": 2.0}]) == 30
@@ -0,0 +1,61 @@
+import pytest
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.dialects import postgresql
+from database import database
+
+
+@pytest.fixture
+def connection(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'bot.sqlite'}")
+    with engine.begin() as connection:
+        # audio_files as created by an old release, before the optional columns were added
+        connection.execute(text("CREATE TABLE audio_files (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, "
+                                "file_id VARCHAR NOT NULL, file_name VARCHAR NOT NULL, file_size INTEGER NOT NULL, "
+                                "cut_start INTEGER, cut_end INTEGER)"))
+        yield connection
+    engine.dispose()
+
+
+class PostgresConnection:
+    """Looks like a PostgreSQL connection to the migrations and records their statements."""
+
+    def __init__(self):
+        self.dialect = postgresql.dialect()
+        self.statements = []
+
+    def execute(self, statement):
+        self.statements.append(str(statement))
+
+
+def test_add_missing_columns(connection):
+    database._add_missing_columns(connection)
+    columns = {column["name"]: column for column in inspect(connection).get_columns("audio_files")}
+    for name in ("cut_segments", "split_points", "effects", "duration", "output_preset"):
+        assert name in columns and columns[name]["nullable"]
+    # Tables that don't exist yet are left to create_all
+    assert not inspect(connection).has_table("render_usage")
+    database._add_missing_columns(connection)
+    assert len(inspect(connection).get_columns("audio_files")) == len(columns)
+
+
+def test_retype_columns_skips_sqlite(connection):
+    database._retype_columns(connection)
+    types = {column["name"]: str(column["type"]) for column in inspect(connection).get_columns("audio_files")}
+    assert types["cut_start"] == "INTEGER"
+
+
+def test_retype_columns_on_postgresql(connection, monkeypatch):
+    monkeypatch.setattr(database, "inspect", lambda _: inspect(connection))
+    postgres = PostgresConnection()
+    database._retype_columns(postgres)
+    assert postgres.statements == ["ALTER TABLE audio_files ALTER COLUMN cut_start TYPE FLOAT",
+                                   "ALTER TABLE audio_files ALTER COLUMN cut_end TYPE FLOAT"]
+
+
+def test_retype_columns_leaves_current_types(connection, monkeypatch):
+    connection.execute(text("ALTER TABLE audio_files RENAME TO old_audio_files"))
+    connection.execute(text("CREATE TABLE audio_files (id INTEGER PRIMARY KEY, cut_start FLOAT, cut_end FLOAT)"))
+    monkeypatch.setattr(database, "inspect", lambda _: inspect(connection))
+    postgres = PostgresConnection()
+    database._retype_columns(postgres)
+    assert postgres.statements == []
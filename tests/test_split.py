@@ -0,0 +1,73 @@
+import pytest
+from tools.split import MAX_SPLIT_PARTS, is_cue_sheet, parse_cue_sheet, parse_split_points, plan_parts
+
+
+CUE_SHEET = '''PERFORMER "Album Artist"
+TITLE "Album"
+FILE "album.flac" WAVE
+  TRACK 01 AUDIO
+    TITLE "Intro"
+    PERFORMER "First"
+    INDEX 01 00:00:00
+  TRACK 02 AUDIO
+    TITLE "Second Song"
+    INDEX 00 03:58:00
+    INDEX 01 04:00:37
+  TRACK 03 AUDIO
+    TITLE "Untimed"
+'''
+
+
+def test_parse_cue_sheet():
+    assert is_cue_sheet(CUE_SHEET)
+    points = parse_cue_sheet(CUE_SHEET)
+    assert points == [{"start": 0.0, "title": "Intro", "performer": "First"},
+                      {"start": pytest.approx(240 + 37 / 75), "title": "Second Song"}]
+    assert parse_split_points(CUE_SHEET, "en") == points
+
+
+def test_parse_split_points_list():
+    assert parse_split_points("10:00, 25:30", "en") == [{"start": 0.0}, {"start": 600.0}, {"start": 1530.0}]
+
+
+def test_parse_split_points_chapters():
+    text = "0:00 Intro\n3:15 - Verse, chorus\n7:40 | Outro"
+    assert parse_split_points(text, "en") == [{"start": 0.0, "title": "Intro"},
+                                              {"start": 195.0, "title": "Verse, chorus"},
+                                              {"start": 460.0, "title": "Outro"}]
+
+
+@pytest.mark.parametrize("text", ["", "0", "soon", "10:00, 5:00", "1:00, 1:00"])
+def test_parse_split_points_rejects(text):
+    with pytest.raises(ValueError):
+        parse_split_points(text, "en")
+
+
+def test_parse_split_points_limits_parts():
+    with pytest.raises(ValueError):
+        parse_split_points(", ".join(str(second) for second in range(1, MAX_SPLIT_PARTS + 1)), "en")
+
+
+def test_plan_parts_clips_to_cut():
+    points = [{"start": 0.0, "title": "A"}, {"start": 60.0, "title": "B"}, {"start": 120.0}]
+    assert plan_parts(points, 180.0) == [{"start": 0.0, "title": "A", "end": 60.0, "segments": None},
+                                         {"start": 60.0, "title": "B", "end": 120.0, "segments": None},
+                                         {"start": 120.0, "end": 180.0, "segments": None}]
+    parts = plan_parts(points, 180.0, cut_start=30, cut_end=150)
+    assert [(part["start"], part["end"]) for part in parts] == [(30, 60.0), (60.0, 120.0), (120.0, 150)]
+    # Parts left shorter than MIN_PART_SECONDS by the cut are dropped
+    parts = plan_parts(points, 180.0, cut_end=60.2)
+    assert [(part["start"], part["end"]) for part in parts] == [(0.0, 60.0)]
+    assert plan_parts(points, None)[-1]["end"] is None
+
+
+def test_plan_parts_keeps_multi_range_cut():
+    points = [{"start": 0.0}, {"start": 60.0}, {"start": 120.0}]
+    parts = plan_parts(points, 180.0, 10, 170, [[10, 50], [70, 100], [110, 170]])
+    assert [(part["start"], part["end"], part["segments"]) for part in parts] == [
+        (10, 50, None),
+        (70, 120.0, [[70, 100], [110, 120.0]]),
+        (120.0, 170, None)]
+    # A part with nothing kept inside it is dropped
+    parts = plan_parts(points, 180.0, 10, 140, [[10, 50], [130, 140]])
+    assert [(part["start"], part["end"]) for part in parts] == [(10, 50), (130, 140)]
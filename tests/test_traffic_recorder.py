@@ -0,0 +1,25 @@
+import pytest
+from tools.traffic_recorder import _describe_text
+
+
+def test_commands():
+    assert _describe_text("/start") == {"text_kind": "command", "command": "start"}
+    assert _describe_text(" /Usage@MusicBot 7 ") == {"text_kind": "command", "command": "usage"}
+
+
+def test_cut_ranges_keep_only_derived_numbers():
+    assert _describe_text("1:15-2:30, 3:00-3:30") == {"text_kind": "time_range", "segments": 2, "seconds": 105}
+
+
+@pytest.mark.parametrize("text", ["054-1234567", "054-123-4567", "4580-1234-5678-9012", "12.05.2024",
+                                  "12/05/2024", "+972 54 123 4567", "Meet at Dizengoff 50, apt 3"])
+def test_personal_data_is_not_recorded(text):
+    event = _describe_text(text)
+    assert "text" not in event
+    digits = "".join(character for character in text if character.isdigit())
+    assert all(digits not in str(value) for value in event.values())
+
+
+def test_other_text_is_reduced_to_length():
+    assert _describe_text("hello there") == {"text_kind": "text", "text_length": 11}
+    assert _describe_text("12345") == {"text_kind": "number", "text_length": 5}
@@ -0,0 +1,84 @@
+"""
+ZIP archives of tracks, in and out.
+
+An uploaded archive is listed from its central directory only. Each render
+job copies just its own member out of the archive, in chunks, and deletes
+it once rendered, so at most one member per render thread is on disk.
+Results can be written into a new archive as they finish, one member at a
+time, instead of being collected first.
+"""
+
+import os
+import shutil
+import tempfile
+import zipfile
+from typing import List
+from tools.audio_utils import process_audio
+from tools.enums import Messages
+from tools.logger import logger
+from tools.usage import add_temp_bytes
+
+
+ARCHIVE_MIME_TYPES = ("application/zip", "application/x-zip-compressed", "application/x-zip")
+AUDIO_EXTENSIONS = (".mp3", ".m4a", ".aac", ".flac", ".ogg", ".opus", ".wav", ".wma")
+MAX_ARCHIVE_SIZE = int(os.getenv("MAX_ARCHIVE_SIZE", 200)) * 1024 * 1024
+# Limit on the uncompressed size of the tracks, against archive bombs
+MAX_ARCHIVE_UNPACKED_SIZE = int(os.getenv("MAX_ARCHIVE_UNPACKED_SIZE", 1024)) * 1024 * 1024
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+def is_archive(file_name: str | None, mime_type: str | None) -> bool:
+    return (mime_type or "") in ARCHIVE_MIME_TYPES or (file_name or "").lower().endswith(".zip")
+
+
+def list_audio_members(archive_path: str) -> List[dict]:
+    """
+    List the audio files of a ZIP archive in name order.
+
+    Folders, hidden files and macOS resource forks are skipped.
+
+    Returns:
+        List of dicts with ``archive_member``, ``file_name`` and ``file_size``
+
+    Raises:
+        ValueError: If the archive can't be read or its tracks are too large uncompressed
+    """
+    try:
+        with zipfile.ZipFile(archive_path) as archive:
+            members = archive.infolist()
+    except (zipfile.BadZipFile, OSError) as e:
+        raise ValueError(f"Unreadable archive {archive_path}: {e}")
+    tracks = []
+    for member in members:
+        file_name = os.path.basename(member.filename)
+        if (member.is_dir() or not file_name or file_name.startswith(".")
+                or member.filename.startswith("__MACOSX/")
+                or not file_name.lower().endswith(AUDIO_EXTENSIONS)):
+            continue
+        tracks.append({"archive_member": member.filename, "file_name": file_name, "file_size": member.file_size})
+    if sum(track["file_size"] for track in tracks) > MAX_ARCHIVE_UNPACKED_SIZE:
+        raise ValueError(f"Archive {archive_path} unpacks to more than {MAX_ARCHIVE_UNPACKED_SIZE} bytes")
+    return sorted(tracks, key=lambda track: track["archive_member"].lower())
+
+
+def extract_member(archive_path: str, member: str, output_dir: str) -> str:
+    """Copy one member out of the archive in chunks and return its path."""
+    suffix = os.path.splitext(member)[1].lower()
+    with zipfile.ZipFile(archive_path) as archive, archive.open(member) as source, \
+            tempfile.NamedTemporaryFile(dir=output_dir, suffix=suffix, delete=False) as target:
+        shutil.copyfileobj(source, target, COPY_CHUNK_SIZE)
+        add_temp_bytes(target.tell())
+        return target.name
+
+
+def render_archive_member(archive_path: str, member: str, work_dir: str, **kwargs) -> tuple[bool, str]:
+    """``process_audio`` for a track inside an archive; only that track is unpacked, and only while it renders."""
+    try:
+        input_path = extract_member(archive_path, member, work_dir)
+    except (KeyError, zipfile.BadZipFile, OSError) as e:
+        logger.error(f"Error extracting {member} from {archive_path}: {e}")
+        return False, Messages(language=kwargs.get("language", "he")).error_processing_audio
+    try:
+        return process_audio(input_path=input_path, **kwargs)
+    finally:
+        os.remove(input_path)
@@ -1,10 +1,594 @@
+import base64
+import json
 import os
 import re
+import shutil
+import struct
+import subprocess
+import tempfile
+import threading
+import numpy as np
 from pydub import AudioSegment
 from tools.logger import logger
 from tools.enums import Messages
+from tools.effects import apply_chain, build_chain, effect_value, splice
+from tools.presets import preset_codec_args
+from tools.silence import SILENCE_THRESHOLD_DB, find_sound_bounds, trim_range
+from tools.waveform import WAVEFORM_WIDTH, compute_peaks
+from tools.metrics import RENDER_DURATION
+from tools.tracing import span, traced
+from tools.usage import TrackedPopen, add_temp_bytes, run_process
 from pathlib import Path
-from typing import Optional, Tuple
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+
+AUDIO_BACKEND = os.getenv("AUDIO_BACKEND", "auto").lower()
+FFMPEG_BINARY = os.getenv("FFMPEG_BINARY", "ffmpeg")
+FFPROBE_BINARY = os.getenv("FFPROBE_BINARY", "ffprobe")
+# Frames per decoded block; 64k stereo float frames are 512 KB
+DECODE_CHUNK_FRAMES = 65536
+# Length of the excerpts at each end of a cut preview
+PREVIEW_SECONDS = float(os.getenv("PREVIEW_SECONDS", 4))
+PREVIEW_GAP_SECONDS = 0.5
+# Previews are listened to once: a low constant bitrate and LAME's fastest setting
+PREVIEW_CODEC_ARGS = ["-c:a", "libmp3lame", "-b:a", os.getenv("PREVIEW_BITRATE", "64k"), "-compression_level", "9"]
+# Upper bound on ranges in one cut; each is decoded by its own ffmpeg process
+MAX_CUT_SEGMENTS = 20
+# Telegram's upload metadata gives whole seconds, so a stored whole-second duration may be this much short
+METADATA_DURATION_TOLERANCE = 1.0
+# Uploads are probed from their first PREFLIGHT_CHUNKS and last chunk of 1 MB before any full download;
+# up to PREFLIGHT_MAX_CHUNKS are read from the start to get past a large ID3 tag
+PREFLIGHT_PROBE = os.getenv("PREFLIGHT_PROBE", "1") != "0"
+PREFLIGHT_CHUNKS = int(os.getenv("PREFLIGHT_CHUNKS", 1))
+PREFLIGHT_MAX_CHUNKS = 4
+STREAM_CHUNK_SIZE = 1024 * 1024
+# Uploads any backend can render. pydub decodes the whole file into memory, so this stays small
+MAX_AUDIO_SIZE = int(os.getenv("MAX_AUDIO_SIZE", 40)) * 1024 * 1024
+# Larger uploads, up to Telegram's own limit, are accepted when they can be streamed (large-file mode)
+MAX_LARGE_AUDIO_SIZE = int(os.getenv("MAX_LARGE_AUDIO_SIZE", 2000)) * 1024 * 1024
+# Peak RSS of one render, whatever the file size: streaming renders size their blocks to fit it, pydub renders
+# that wouldn't are streamed instead, and renders that can't fit are refused (see render_chunk_frames;
+# checked by benchmarks/large_file_stress.py)
+RENDER_MEMORY_BUDGET = int(os.getenv("RENDER_MEMORY_BUDGET", 256)) * 1024 * 1024
+# Resident size of the process before a render starts, taken off the budget
+RENDER_BASE_MEMORY = int(os.getenv("RENDER_BASE_MEMORY", 64)) * 1024 * 1024
+# Decoded blocks a streaming render holds at once: the pipe read and its float32 view, a copy per effect
+# stage and the rebuffered output (slowing down doubles a block); blocks never get smaller than MIN_CHUNK_FRAMES
+BLOCKS_IN_FLIGHT = 8
+MIN_CHUNK_FRAMES = 4096
+# For estimate_render: copies of the decoded track pydub holds at once (int16 samples, float32 blocks,
+# the encoder's input), and decoded float32 bytes per file byte when the duration isn't known (~128k MP3)
+PCM_COPIES = 3
+PCM_PER_FILE_BYTE = 11
+
+# ffmpeg muxer and audio encoder for each output extension. Extensions that
+# aren't listed are passed to ffmpeg as the muxer name with its default encoder.
+OUTPUT_FORMATS = {
+    "mp3": ("mp3", ["-c:a", "libmp3lame"]),
+    "ogg": ("ogg", ["-c:a", "libvorbis"]),
+    "opus": ("opus", ["-c:a", "libopus"]),
+    "wma": ("asf", ["-c:a", "wmav2"]),
+    "flac": ("flac", ["-c:a", "flac"]),
+    "m4a": ("ipod", ["-c:a", "aac"]),
+    "wav": ("wav", []),
+}
+
+# Raw sample format of pydub's PCM data by sample width in bytes
+_RAW_FORMATS = {1: ("u8", "pcm_u8"), 2: ("s16le", "pcm_s16le"), 3: ("s24le", "pcm_s24le"), 4: ("s32le", "pcm_s32le")}
+
+
+def _flac_picture_block(cover_path: str) -> bytes:
+    """Build a FLAC METADATA_BLOCK_PICTURE (front cover), as used in Vorbis comments."""
+    from PIL import Image
+    with Image.open(cover_path) as image:
+        width, height = image.size
+        mime = Image.MIME.get(image.format, "image/jpeg").encode()
+        depth = 8 * len(image.getbands())
+    with open(cover_path, "rb") as f:
+        data = f.read()
+    description = b"Cover (front)"
+    return (struct.pack(">II", 3, len(mime)) + mime + struct.pack(">I", len(description)) + description
+            + struct.pack(">IIIII", width, height, depth, 0, len(data)) + data)
+
+
+def _escape_ffmetadata(value: str) -> str:
+    return re.sub(r"([=;#\\\n])", r"\\\1", value)
+
+
+def _cover_arguments(file_format: str, cover_path: str, work_dir: str) -> Tuple[List[str], List[str]]:
+    """Return (input arguments, output arguments) that embed ``cover_path`` while muxing.
+
+    MP3 gets an ID3v2 APIC frame, FLAC a picture block and M4A a ``covr``
+    atom, all by copying the image as an attached picture stream. Ogg
+    containers get a METADATA_BLOCK_PICTURE comment, passed through an
+    ffmetadata file because it is too large for a command line argument.
+    """
+    if file_format in ("mp3", "flac", "m4a"):
+        output = ["-map", "1:v", "-c:v", "copy", "-disposition:v", "attached_pic",
+                  "-metadata:s:v", "title=Album cover", "-metadata:s:v", "comment=Cover (front)"]
+        return ["-i", cover_path], output
+    if file_format in ("ogg", "opus"):
+        picture = base64.b64encode(_flac_picture_block(cover_path)).decode("ascii")
+        metadata_path = os.path.join(work_dir, "cover.ffmetadata")
+        with open(metadata_path, "w", encoding="utf-8") as f:
+            f.write(f";FFMETADATA1\nMETADATA_BLOCK_PICTURE={_escape_ffmetadata(picture)}\n")
+        return ["-f", "ffmetadata", "-i", metadata_path], ["-map_metadata", "1"]
+    logger.debug(f"Embedded cover art is not supported for .{file_format}, skipping")
+    return [], []
+
+
+def _output_arguments(file_format: str, work_dir: str, tags: Optional[dict] = None, cover_path: Optional[str] = None,
+                      pcm_codec: str = "pcm_s16le", codec_args: Optional[List[str]] = None) -> Tuple[List[str], List[str]]:
+    """Return (extra inputs, output arguments) for writing ``file_format`` with tags and cover.
+
+    Input 0 must be the audio; its first audio stream is the only one kept.
+    ``codec_args`` replaces the format's default encoder arguments. The
+    output arguments end with the muxer, the caller appends the path.
+    """
+    muxer, default_codec_args = OUTPUT_FORMATS.get(file_format, (file_format, []))
+    if codec_args is None:
+        codec_args = ["-c:a", pcm_codec] if file_format == "wav" else default_codec_args
+    cover_inputs, cover_outputs = [], []
+    if cover_path and os.path.exists(cover_path):
+        cover_inputs, cover_outputs = _cover_arguments(file_format, cover_path, work_dir)
+    output = ["-map", "0:a:0", *cover_outputs, *codec_args]
+    if "-map_metadata" not in cover_outputs:
+        # Like a pydub re-export, don't carry the source file's tags over
+        output.extend(["-map_metadata", "-1"])
+    for key, value in (tags or {}).items():
+        output.extend(["-metadata", f"{key}={value}"])
+    if file_format == "mp3":
+        output.extend(["-id3v2_version", "3"])
+    output.extend(["-f", muxer])
+    return cover_inputs, output
+
+
+def _pcm_codec(bits_per_sample: Optional[int]) -> str:
+    """WAV output keeps 24/32-bit sources at their depth, everything else is 16-bit."""
+    if bits_per_sample and bits_per_sample > 16:
+        return "pcm_s24le" if bits_per_sample <= 24 else "pcm_s32le"
+    return "pcm_s16le"
+
+
+def encode_segment(segment: AudioSegment, output_path: str, file_format: str, tags: Optional[dict] = None,
+                   cover_path: Optional[str] = None, codec_args: Optional[List[str]] = None) -> None:
+    """
+    Encode a pydub segment to ``output_path`` with tags and cover art in a single ffmpeg pass.
+
+    The PCM is piped to ffmpeg's stdin and the output file is written once,
+    instead of pydub's temporary WAV, temporary output and copy.
+
+    Raises:
+        RuntimeError: If ffmpeg fails
+    """
+    raw_format, pcm_codec = _RAW_FORMATS[segment.sample_width]
+    with tempfile.TemporaryDirectory(prefix="encode_") as work_dir:
+        extra_inputs, output_args = _output_arguments(file_format, work_dir, tags, cover_path, pcm_codec, codec_args)
+        command = [AudioSegment.converter, "-v", "error", "-y",
+                   "-f", raw_format, "-ar", str(segment.frame_rate), "-ac", str(segment.channels), "-i", "pipe:0",
+                   *extra_inputs, *output_args, output_path]
+        with span("ffmpeg.encode", format=file_format, cover=bool(extra_inputs)):
+            result = run_process(command, input=segment.raw_data, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        if result.returncode != 0:
+            raise RuntimeError(f"ffmpeg failed encoding {file_format}: {result.stderr.decode(errors='ignore').strip()}")
+
+
+class AudioInfo(NamedTuple):
+    """Properties of the first audio stream of a file."""
+    duration: Optional[float]
+    sample_rate: int
+    channels: int
+    codec: Optional[str] = None
+    bit_rate: Optional[int] = None
+    bits_per_sample: Optional[int] = None
+
+
+class AudioBackend:
+    """
+    Decodes, encodes and renders audio files.
+
+    ``decode`` yields float32 numpy blocks shaped (frames, channels) in the
+    source's sample rate and channel layout, and ``encode`` consumes such
+    blocks, so processing stages can sit between the two without ever
+    holding the whole track.
+    """
+    name = "base"
+    # Whether memory stays bounded by the block size rather than the track length
+    streaming = False
+
+    def probe(self, path: str) -> AudioInfo:
+        raise NotImplementedError
+
+    def decode(self, path: str, start: Optional[float] = None, end: Optional[float] = None,
+               chunk_frames: int = DECODE_CHUNK_FRAMES, info: Optional[AudioInfo] = None) -> Iterator[np.ndarray]:
+        raise NotImplementedError
+
+    def encode(self, blocks: Iterable[np.ndarray], output_path: str, file_format: str, sample_rate: int,
+               channels: int, tags: Optional[dict] = None, cover_path: Optional[str] = None,
+               bits_per_sample: Optional[int] = None, codec_args: Optional[List[str]] = None) -> None:
+        raise NotImplementedError
+
+    def render(self, input_path: str, output_path: str, file_format: str, start: Optional[float] = None,
+               end: Optional[float] = None, tags: Optional[dict] = None, cover_path: Optional[str] = None,
+               info: Optional[AudioInfo] = None, codec_args: Optional[List[str]] = None) -> None:
+        """Cut ``input_path`` to [start, end] and write it with tags and cover art."""
+        info = info or self.probe(input_path)
+        self.encode(self.decode(input_path, start, end, info=info), output_path, file_format, info.sample_rate,
+                    info.channels, tags, cover_path, info.bits_per_sample, codec_args)
+
+
+class FFmpegPipeBackend(AudioBackend):
+    """
+    Talks to ffmpeg/ffprobe through pipes, with no intermediate files.
+
+    A plain cut or re-export is a single ffmpeg process reading the source
+    and writing the output; ``decode``/``encode`` stream raw float PCM
+    through stdout/stdin for work done in Python.
+    """
+    name = "ffmpeg"
+    streaming = True
+
+    def probe(self, path: str) -> AudioInfo:
+        command = [FFPROBE_BINARY, "-v", "error", "-select_streams", "a:0",
+                   "-show_entries", "format=duration,bit_rate:stream=codec_name,sample_rate,channels,"
+                                    "bits_per_raw_sample,bits_per_sample,duration,bit_rate",
+                   "-of", "json", path]
+        with span("ffprobe"):
+            result = run_process(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if result.returncode != 0:
+            raise ValueError(f"ffprobe failed for {path}: {result.stderr.decode(errors='ignore').strip()}")
+        data = json.loads(result.stdout or b"{}")
+        if not data.get("streams"):
+            raise ValueError(f"No audio stream in {path}")
+        stream = data["streams"][0]
+        fmt = data.get("format", {})
+
+        def number(*values, cast=float):
+            for value in values:
+                try:
+                    if value not in (None, "N/A") and cast(value):
+                        return cast(value)
+                except (TypeError, ValueError):
+                    continue
+            return None
+
+        return AudioInfo(
+            duration=number(fmt.get("duration"), stream.get("duration")),
+            sample_rate=number(stream.get("sample_rate"), cast=int) or 44100,
+            channels=number(stream.get("channels"), cast=int) or 2,
+            codec=stream.get("codec_name"),
+            bit_rate=number(stream.get("bit_rate"), fmt.get("bit_rate"), cast=int),
+            bits_per_sample=number(stream.get("bits_per_raw_sample"), stream.get("bits_per_sample"), cast=int),
+        )
+
+    @staticmethod
+    def _range_arguments(start: Optional[float], end: Optional[float]) -> List[str]:
+        # Input seeking is sample accurate when decoding and skips demuxing the rest
+        arguments = []
+        if start:
+            arguments.extend(["-ss", f"{start:.6f}"])
+        if end is not None:
+            arguments.extend(["-to", f"{end:.6f}"])
+        return arguments
+
+    def decode(self, path: str, start: Optional[float] = None, end: Optional[float] = None,
+               chunk_frames: int = DECODE_CHUNK_FRAMES, info: Optional[AudioInfo] = None) -> Iterator[np.ndarray]:
+        """Yield float32 blocks of ``chunk_frames`` frames (the last one may be shorter)."""
+        info = info or self.probe(path)
+        channels, sample_rate = info.channels, info.sample_rate
+        command = [FFMPEG_BINARY, "-v", "error", "-nostdin", *self._range_arguments(start, end), "-i", path,
+                   "-map", "0:a:0", "-f", "f32le", "-ac", str(channels), "-ar", str(sample_rate), "pipe:1"]
+        block_bytes = chunk_frames * channels * 4
+        process = TrackedPopen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        try:
+            while True:
+                data = process.stdout.read(block_bytes)
+                if not data:
+                    break
+                usable = len(data) - len(data) % (channels * 4)
+                yield np.frombuffer(data[:usable], dtype="<f4").reshape(-1, channels)
+            stderr = process.stderr.read()
+            if process.wait() != 0:
+                raise RuntimeError(f"ffmpeg failed decoding {path}: {stderr.decode(errors='ignore').strip()}")
+        finally:
+            # The consumer may stop early; don't leave ffmpeg blocked on a full pipe
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+            process.stdout.close()
+            process.stderr.close()
+
+    def encode(self, blocks: Iterable[np.ndarray], output_path: str, file_format: str, sample_rate: int,
+               channels: int, tags: Optional[dict] = None, cover_path: Optional[str] = None,
+               bits_per_sample: Optional[int] = None, codec_args: Optional[List[str]] = None) -> None:
+        with tempfile.TemporaryDirectory(prefix="encode_") as work_dir:
+            extra_inputs, output_args = _output_arguments(file_format, work_dir, tags, cover_path,
+                                                          _pcm_codec(bits_per_sample), codec_args)
+            command = [FFMPEG_BINARY, "-v", "error", "-y", "-f", "f32le", "-ar", str(sample_rate),
+                       "-ac", str(channels), "-i", "pipe:0", *extra_inputs, *output_args, output_path]
+            with span("ffmpeg.encode", format=file_format, cover=bool(extra_inputs)), \
+                    tempfile.TemporaryFile() as stderr:
+                # stderr goes to a file so a chatty ffmpeg can never block on it while we write
+                process = TrackedPopen(command, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=stderr)
+                try:
+                    for block in blocks:
+                        process.stdin.write(np.ascontiguousarray(block, dtype="<f4").tobytes())
+                except BrokenPipeError:
+                    pass
+                finally:
+                    process.stdin.close()
+                    returncode = process.wait()
+                if returncode != 0:
+                    stderr.seek(0)
+                    raise RuntimeError(f"ffmpeg failed encoding {file_format}: "
+                                       f"{stderr.read().decode(errors='ignore').strip()}")
+
+    def render(self, input_path: str, output_path: str, file_format: str, start: Optional[float] = None,
+               end: Optional[float] = None, tags: Optional[dict] = None, cover_path: Optional[str] = None,
+               info: Optional[AudioInfo] = None, codec_args: Optional[List[str]] = None) -> None:
+        with tempfile.TemporaryDirectory(prefix="render_") as work_dir:
+            extra_inputs, output_args = _output_arguments(file_format, work_dir, tags, cover_path,
+                                                          _pcm_codec(info.bits_per_sample if info else None),
+                                                          codec_args)
+            command = [FFMPEG_BINARY, "-v", "error", "-nostdin", "-y", *self._range_arguments(start, end),
+                       "-i", input_path, *extra_inputs, *output_args, output_path]
+            with span("ffmpeg.render", format=file_format, cover=bool(extra_inputs)):
+                result = run_process(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            if result.returncode != 0:
+                raise RuntimeError(f"ffmpeg failed rendering {input_path}: {result.stderr.decode(errors='ignore').strip()}")
+
+
+class PydubBackend(AudioBackend):
+    """
+    The original pydub implementation, used when ffmpeg can't be called directly.
+
+    ``AudioSegment.from_file`` decodes the whole file into memory, so every
+    method here holds the full track; ``backend_for`` keeps files past
+    ``MAX_AUDIO_SIZE`` or ``RENDER_MEMORY_BUDGET`` away from it.
+    """
+    name = "pydub"
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def _load(self, path: str) -> AudioSegment:
+        # probe() followed by render() on the same file decodes once
+        cached = getattr(self._local, "segment", None)
+        if cached and cached[0] == path:
+            return cached[1]
+        segment = AudioSegment.from_file(path)
+        self._local.segment = (path, segment)
+        return segment
+
+    def probe(self, path: str) -> AudioInfo:
+        segment = self._load(path)
+        return AudioInfo(duration=len(segment) / 1000.0, sample_rate=segment.frame_rate, channels=segment.channels,
+                         bits_per_sample=segment.sample_width * 8)
+
+    def _slice(self, path: str, start: Optional[float], end: Optional[float]) -> AudioSegment:
+        segment = self._load(path)
+        self._local.segment = None
+        if start is None and end is None:
+            return segment
+        start_ms = int((start or 0) * 1000)
+        end_ms = int(end * 1000) if end is not None else len(segment)
+        return segment[start_ms:end_ms]
+
+    def decode(self, path: str, start: Optional[float] = None, end: Optional[float] = None,
+               chunk_frames: int = DECODE_CHUNK_FRAMES, info: Optional[AudioInfo] = None) -> Iterator[np.ndarray]:
+        segment = self._slice(path, start, end)
+        scale = float(1 << (8 * segment.sample_width - 1))
+        samples = np.array(segment.get_array_of_samples(), dtype=np.float32).reshape(-1, segment.channels)
+        if segment.sample_width == 1:
+            samples -= 128
+        samples /= scale
+        for offset in range(0, len(samples), chunk_frames):
+            yield samples[offset:offset + chunk_frames]
+
+    def encode(self, blocks: Iterable[np.ndarray], output_path: str, file_format: str, sample_rate: int,
+               channels: int, tags: Optional[dict] = None, cover_path: Optional[str] = None,
+               bits_per_sample: Optional[int] = None, codec_args: Optional[List[str]] = None) -> None:
+        pcm = [np.clip(block, -1.0, 1.0 - 1 / 32768) * 32768 for block in blocks]
+        data = np.concatenate(pcm).astype("<i2").tobytes() if pcm else b""
+        segment = AudioSegment(data=data, sample_width=2, frame_rate=sample_rate, channels=channels)
+        encode_segment(segment, output_path, file_format, tags, cover_path, codec_args)
+
+    def render(self, input_path: str, output_path: str, file_format: str, start: Optional[float] = None,
+               end: Optional[float] = None, tags: Optional[dict] = None, cover_path: Optional[str] = None,
+               info: Optional[AudioInfo] = None, codec_args: Optional[List[str]] = None) -> None:
+        encode_segment(self._slice(input_path, start, end), output_path, file_format, tags, cover_path, codec_args)
+
+
+_BACKENDS = {"ffmpeg": FFmpegPipeBackend, "pydub": PydubBackend}
+_backend_instances: dict = {}
+
+
+def get_backend(name: Optional[str] = None) -> AudioBackend:
+    """
+    Return the audio backend selected by ``name`` or ``AUDIO_BACKEND``.
+
+    "auto" picks the ffmpeg pipe backend when ffmpeg and ffprobe are on the
+    PATH and falls back to pydub otherwise.
+    """
+    name = (name or AUDIO_BACKEND).lower()
+    if name == "auto":
+        name = "ffmpeg" if shutil.which(FFMPEG_BINARY) and shutil.which(FFPROBE_BINARY) else "pydub"
+    if name not in _BACKENDS:
+        raise ValueError(f"Unknown audio backend {name!r}, expected one of: auto, {', '.join(_BACKENDS)}")
+    if name not in _backend_instances:
+        _backend_instances[name] = _BACKENDS[name]()
+    return _backend_instances[name]
+
+
+def streaming_available() -> bool:
+    return bool(shutil.which(FFMPEG_BINARY) and shutil.which(FFPROBE_BINARY))
+
+
+def max_audio_size() -> int:
+    """Largest upload accepted, in bytes: past ``MAX_AUDIO_SIZE`` only when it can be streamed."""
+    return max(MAX_AUDIO_SIZE, MAX_LARGE_AUDIO_SIZE) if streaming_available() else MAX_AUDIO_SIZE
+
+
+def _pcm_bytes(file_size: Optional[int], duration: Optional[float], sample_rate: Optional[int],
+               channels: Optional[int]) -> float:
+    """Decoded float32 size of a track, guessed from the file size when the duration isn't known."""
+    if duration:
+        return duration * (sample_rate or 44100) * (channels or 2) * 4
+    return (file_size or 0) * PCM_PER_FILE_BYTE
+
+
+def _fits_whole(pcm: float) -> bool:
+    """Whether a render holding the decoded track ``PCM_COPIES`` times (pydub) stays within the budget."""
+    return RENDER_BASE_MEMORY + pcm * PCM_COPIES <= RENDER_MEMORY_BUDGET
+
+
+def _streams(file_size: Optional[int], pcm: float) -> bool:
+    if get_backend().streaming:
+        return True
+    return streaming_available() and ((file_size or 0) > MAX_AUDIO_SIZE or not _fits_whole(pcm))
+
+
+def _held_frames(effects: Optional[list], sample_rate: int) -> int:
+    """Frames the fade-out and crossfaded joins hold back on top of the blocks."""
+    # A join holds the tail of one range, the head of the next and their mix
+    seconds = (effect_value(effects, "fade_out") or 0) + 3 * (effect_value(effects, "crossfade") or 0)
+    return int(seconds * sample_rate)
+
+
+def render_chunk_frames(backend: AudioBackend, info: AudioInfo, effects: Optional[list] = None) -> Optional[int]:
+    """
+    Frames per decoded block for a render of ``info`` that stays within ``RENDER_MEMORY_BUDGET``.
+
+    On the streaming backend ``BLOCKS_IN_FLIGHT`` blocks share what the
+    process's base size and the held-back fade-out and crossfade windows
+    leave of the budget, up to ``DECODE_CHUNK_FRAMES``. pydub holds the
+    whole track whatever the block size.
+
+    Returns:
+        The block size, or None when the render can't fit the budget
+    """
+    if not backend.streaming:
+        return DECODE_CHUNK_FRAMES if _fits_whole(_pcm_bytes(None, info.duration, info.sample_rate,
+                                                                info.channels)) else None
+    frame_bytes = info.channels * 4
+    available = RENDER_MEMORY_BUDGET - RENDER_BASE_MEMORY - _held_frames(effects, info.sample_rate) * frame_bytes
+    frames = min(DECODE_CHUNK_FRAMES, available // (BLOCKS_IN_FLIGHT * frame_bytes))
+    return frames if frames >= MIN_CHUNK_FRAMES else None
+
+
+def backend_for(path: str, prefer_streaming: bool = False) -> AudioBackend:
+    """
+    The backend to read ``path`` with.
+
+    pydub holds the decoded track ``PCM_COPIES`` times, so files past
+    ``MAX_AUDIO_SIZE``, and any file whose decoded copies wouldn't fit
+    ``RENDER_MEMORY_BUDGET`` (measured with ffprobe), go through the
+    streaming backend whatever ``AUDIO_BACKEND`` says. So does every file
+    with ``prefer_streaming``, for callers reading several ranges of it:
+    the streaming backend seeks to each one, where pydub decodes the whole
+    file every time.
+    """
+    backend = get_backend()
+    if backend.streaming or not streaming_available():
+        return backend
+    if prefer_streaming:
+        return get_backend("ffmpeg")
+    try:
+        file_size = os.path.getsize(path)
+    except OSError:
+        return backend
+    streaming = get_backend("ffmpeg")
+    if file_size > MAX_AUDIO_SIZE:
+        return streaming
+    try:
+        info = streaming.probe(path)
+    except ValueError:
+        return backend
+    pcm = _pcm_bytes(file_size, info.duration, info.sample_rate, info.channels)
+    return backend if _fits_whole(pcm) else streaming
+
+
+def probe_file(path: str, prefer_streaming: bool = False) -> AudioInfo:
+    """Probe ``path`` with the backend ``backend_for`` picks; blocking, since picking it may run ffprobe."""
+    return backend_for(path, prefer_streaming).probe(path)
+
+
+def estimate_render(file_size: Optional[int], duration: Optional[float] = None, sample_rate: Optional[int] = None,
+                    channels: Optional[int] = None, effects: Optional[list] = None,
+                    prefer_streaming: bool = False) -> Tuple[int, int]:
+    """
+    Estimated peak memory and temp disk of one render, in bytes.
+
+    Both follow the decoded size, duration × sample rate × channels as
+    float32 (guessed from the file size when the duration isn't known).
+    The streaming backend holds ``BLOCKS_IN_FLIGHT`` blocks of the size
+    ``render_chunk_frames`` picks plus the fade-out and crossfade windows;
+    pydub holds the whole track ``PCM_COPIES`` times. Every render writes
+    an output about the size of its input, and reverse spools the decoded
+    track to disk too. ``prefer_streaming`` is as for ``backend_for``.
+    """
+    pcm = _pcm_bytes(file_size, duration, sample_rate, channels)
+    if (prefer_streaming and streaming_available()) or _streams(file_size, pcm):
+        info = AudioInfo(duration=duration, sample_rate=sample_rate or 44100, channels=channels or 2)
+        frames = render_chunk_frames(get_backend("ffmpeg"), info, effects) or MIN_CHUNK_FRAMES
+        memory = min(pcm, (BLOCKS_IN_FLIGHT * frames + _held_frames(effects, info.sample_rate)) * info.channels * 4)
+    else:
+        memory = pcm * PCM_COPIES
+    temp = (file_size or 0) + (pcm if any(effect.get("type") == "reverse" for effect in effects or []) else 0)
+    return int(memory), int(temp)
+
+
+def id3_tag_size(head: bytes) -> int:
+    """Size of a leading ID3v2 tag (often holding a large cover), 0 when there is none."""
+    if len(head) < 10 or head[:3] != b"ID3":
+        return 0
+    size = 0
+    for byte in head[6:10]:
+        size = (size << 7) | (byte & 0x7F)
+    # Header, plus a footer when flagged
+    return size + (20 if head[5] & 0x10 else 10)
+
+
+@traced("probe_partial")
+def probe_partial(head: bytes, tail: bytes = b"", file_size: Optional[int] = None,
+                  suffix: str = "") -> Optional[AudioInfo]:
+    """
+    Probe a file from its first and last bytes only.
+
+    The bytes are laid out in a sparse temporary file of the declared size,
+    so formats that keep their duration or index at the end (MP4, Ogg) are
+    read exactly and CBR durations are estimated from the real size.
+
+    Returns:
+        The stream properties, or None when the partial data doesn't tell
+        (or ffprobe isn't available)
+
+    Raises:
+        ValueError: If the data isn't audio ffmpeg can read
+    """
+    if not shutil.which(FFPROBE_BINARY):
+        return None
+    complete = file_size is None or len(head) >= file_size
+    with tempfile.NamedTemporaryFile(suffix=suffix, prefix="probe_") as partial:
+        partial.write(head)
+        if not complete:
+            if tail:
+                partial.seek(max(file_size - len(tail), len(head)))
+                partial.write(tail[-(file_size - len(head)):])
+            partial.truncate(file_size)
+        partial.flush()
+        try:
+            info = get_backend("ffmpeg").probe(partial.name)
+        except ValueError as e:
+            # A cut off index (e.g. an MP4 moov atom in the middle) isn't proof of a bad file
+            if complete or "Invalid data found" in str(e) or "No audio stream" in str(e):
+                raise
+            logger.debug(f"Inconclusive partial probe: {e}")
+            return None
+    if info.duration is None and info.bit_rate is None:
+        # What random bytes look like to the MP3 demuxer
+        raise ValueError(f"No duration or bit rate for {info.codec} stream")
+    return info
 
 
 def parse_time(time_str: str) -> float:
@@ -88,8 +672,84 @@ def parse_cut_range(cut_str: str, language: str) -> tuple[float, float]:
     return start_sec, end_sec
 
 
+def parse_cut_segments(cut_str: str, language: str) -> list[tuple[float, float]]:
+    """
+    Parse one or more comma separated cut ranges, e.g. "0:10-0:40, 1:20-2:05".
+
+    Each range is parsed by ``parse_cut_range``; ranges must be in order and
+    must not overlap.
+
+    Raises ValueError if invalid.
+    """
+    messages = Messages(language=language)
+    if not cut_str or not cut_str.strip():
+        raise ValueError(messages.empty_cut)
+    ranges = [part for part in re.split(r"\s*[,;\n]\s*", cut_str.strip()) if part]
+    if len(ranges) > MAX_CUT_SEGMENTS:
+        raise ValueError(messages.error_too_many_segments.format(MAX_CUT_SEGMENTS))
+    segments = [parse_cut_range(part, language) for part in ranges]
+    for (_, previous_end), (start, _) in zip(segments, segments[1:]):
+        if start < previous_end:
+            raise ValueError(messages.error_cut_overlap)
+    return segments
+
+
+def segments_duration(segments: list, crossfade: float = 0.0) -> float:
+    """Length of the spliced output of ``segments`` joined with ``crossfade`` second overlaps."""
+    total = sum(end - start for start, end in segments)
+    joins = sum(min(crossfade, end - start) for start, end in segments[1:])
+    return max(0.0, total - joins)
+
+
+def duration_tolerance(duration: Optional[float]) -> float:
+    """
+    Seconds a track may run past its stored ``duration``.
+
+    A probed duration is exact, but a whole number may come from the
+    upload's metadata, which Telegram rounds to the second.
+    """
+    if duration is None or not float(duration).is_integer():
+        return 0.0
+    return METADATA_DURATION_TOLERANCE
+
+
+def clamp_segments(segments: list, duration: Optional[float], tolerance: float = 0.0) -> list[tuple[float, float]]:
+    """
+    Clip cut ranges to a track of ``duration`` seconds; ranges starting at or past the end are dropped.
+
+    ``tolerance`` extends the end, for a duration that isn't exact (see
+    ``duration_tolerance``); the render clamps again to the probed length.
+    """
+    if duration is None:
+        return [(float(start), float(end)) for start, end in segments]
+    limit = duration + tolerance
+    return [(float(start), float(min(end, limit))) for start, end in segments if start < limit]
+
+
+def rendered_duration(duration: Optional[float], start_time: Optional[float] = None, end_time: Optional[float] = None,
+                      segments: Optional[list] = None, effects: Optional[list] = None) -> Optional[float]:
+    """
+    Length in seconds of a render of a ``duration`` second track.
+
+    Takes the cut (clamped to the track), crossfaded joins and the speed
+    effect into account; None when it can't be known without the track's
+    duration.
+    """
+    if segments:
+        segments = clamp_segments(segments, duration)
+        length = segments_duration(segments, effect_value(effects, "crossfade") or 0)
+    else:
+        end = end_time if end_time is not None else duration
+        if end is not None and duration is not None:
+            end = min(end, duration)
+        length = end - (start_time or 0) if end is not None else None
+    if length is None:
+        return None
+    return max(0.0, length) / (effect_value(effects, "speed") or 1)
 
 
+@RENDER_DURATION.time(operation="process_audio")
+@traced("process_audio")
 def process_audio(
     input_path: str,
     output_path: str,
@@ -101,11 +761,18 @@ def process_audio(
     album: str | None = None,
     genre: str | None = None,
     file_date: str | None = None,
+    cover_path: str | None = None,
+    effects: list | None = None,
+    measurements: dict | None = None,
+    segments: list | None = None,
+    track: str | None = None,
+    preset: str | None = None,
+    prefer_streaming: bool = False,
     **kwargs  # Accept additional unused kwargs for backward compatibility
 ) -> tuple[bool, str]:
     """
     Cut or re-export an audio file between optional start and end times,
-    and optionally embed metadata (title, artist, album, genre).
+    and optionally embed metadata (title, artist, album, genre) and cover art.
     If both start_time and end_time are None, skips cutting and processes metadata only.
 
     Args:
@@ -118,6 +785,16 @@ def process_audio(
         artist: Artist metadata
         album: Album metadata
         genre: Genre metadata
+        cover_path: Image to embed as front cover art (JPEG or PNG)
+        effects: Effect list as stored on ``AudioFiles.effects`` (see tools.effects)
+        measurements: Cached effect analysis results by effect type; filled in by the render
+        segments: Ranges to keep as [start, end] pairs, spliced in order (see
+            ``AudioFiles.cut_segments``); replaces start_time/end_time
+        track: Track number metadata, e.g. "2/5"
+        preset: Output preset (see tools.presets); ``output_path`` should
+            carry its ``preset_extension``
+        prefer_streaming: Read with the streaming backend when it is available
+            (see ``backend_for``), for one of several renders of the same file
         **kwargs: Additional unused parameters for backward compatibility
 
     Returns:
@@ -126,29 +803,42 @@ def process_audio(
     msg = Messages(language=language)
 
     try:
-        audio = AudioSegment.from_file(input_path)
-        duration_s = len(audio) / 1000.0
+        backend = backend_for(input_path, prefer_streaming)
+        info = backend.probe(input_path)
+        duration_s = info.duration
+        chunk_frames = render_chunk_frames(backend, info, effects)
+        if chunk_frames is None:
+            return False, msg.error_render_too_large
+
+        if segments and len(segments) == 1:
+            start_time, end_time = segments[0]
+            segments = None
+        if segments:
+            # Each range is decoded with an input seek, so the work follows the kept duration
+            segments = clamp_segments(segments, duration_s)
+            if not segments:
+                return False, msg.error_start_beyond_length
 
         needs_cutting = start_time is not None or end_time is not None
 
-        if needs_cutting:
+        if needs_cutting and not segments:
             start_time = float(start_time) if start_time is not None else 0.0
             end_time = float(end_time) if end_time is not None else duration_s
 
             # Validation
-            if start_time < 0 or end_time < 0:
+            if start_time < 0 or (end_time is not None and end_time < 0):
                 error_msg = msg.error_negative_time
                 return False, error_msg
 
-            if start_time >= end_time:
+            if end_time is not None and start_time >= end_time:
                 error_msg = msg.error_invalid_order
                 return False, error_msg
 
-            if start_time > duration_s:
+            if duration_s is not None and start_time > duration_s:
                 error_msg = msg.error_start_beyond_length
                 return False, error_msg
 
-            if end_time > duration_s:
+            if duration_s is not None and end_time > duration_s:
                 end_time = duration_s
 
         os.makedirs(os.path.dirname(os.path.abspath(output_path)) or ".", exist_ok=True)
@@ -164,6 +854,8 @@ def process_audio(
             tags["genre"] = str(genre)
         if file_date:
             tags["date"] = str(file_date)
+        if track:
+            tags["track"] = str(track)
 
         file_ext = os.path.splitext(output_path)[1].lower()
         if not file_ext:
@@ -172,21 +864,45 @@ def process_audio(
         else:
             file_format = file_ext[1:]
 
-        if needs_cutting:
-            start_ms = int(start_time * 1000)
-            end_ms = int(end_time * 1000)
-            cut_segment = audio[start_ms:end_ms]
+        # Length of the result, for presets that pick a bitrate from it
+        output_duration = rendered_duration(duration_s, start_time, end_time, segments, effects)
+        cover_bytes = os.path.getsize(cover_path) if cover_path and os.path.exists(cover_path) else 0
+        codec_args = preset_codec_args(preset, output_duration, cover_bytes)
 
-            cut_segment.export(output_path, format=file_format, tags=tags or None)
+        if segments:
+            crossfade_frames = int((effect_value(effects, "crossfade") or 0) * info.sample_rate)
+            chain = build_chain(effects, chunk_frames)
+            with span("splice", segments=len(segments), effects=",".join(stage.name for stage in chain)):
+                blocks = apply_chain(
+                    lambda: splice((backend.decode(input_path, segment_start, segment_end, chunk_frames, info)
+                                    for segment_start, segment_end in segments), crossfade_frames),
+                    chain, info.sample_rate, chunk_frames, measurements)
+                backend.encode(blocks, output_path, file_format, info.sample_rate, info.channels, tags,
+                               cover_path, info.bits_per_sample, codec_args)
+            success_msg = msg.audio_cut_success
+        elif effects:
+            # Effects need the PCM in Python: stream it through the chain block by block
+            chain = build_chain(effects, chunk_frames)
+            with span("effects", effects=",".join(stage.name for stage in chain)):
+                blocks = apply_chain(lambda: backend.decode(input_path, start_time, end_time, chunk_frames, info),
+                                     chain, info.sample_rate, chunk_frames, measurements)
+                backend.encode(blocks, output_path, file_format, info.sample_rate, info.channels, tags,
+                               cover_path, info.bits_per_sample, codec_args)
+            success_msg = msg.audio_cut_success if needs_cutting else msg.audio_saved_message
+        elif needs_cutting:
+            backend.render(input_path, output_path, file_format, start_time, end_time, tags, cover_path, info,
+                           codec_args)
 
-            if start_time == 0 and end_time >= duration_s * 0.99:
+            if start_time == 0 and (duration_s is None or end_time >= duration_s * 0.99):
                 success_msg = msg.audio_saved_message
             else:
                 success_msg = msg.audio_cut_success
         else:
-            audio.export(output_path, format=file_format, tags=tags or None)
+            backend.render(input_path, output_path, file_format, tags=tags, cover_path=cover_path, info=info,
+                           codec_args=codec_args)
             success_msg = msg.audio_saved_message
 
+        add_temp_bytes(os.path.getsize(output_path))
         return True, success_msg
 
     except Exception as e:
@@ -194,6 +910,109 @@ def process_audio(
         return False, msg.error_cut_failed
 
 
+@RENDER_DURATION.time(operation="auto_trim")
+@traced("auto_trim")
+def detect_trim(input_path: str) -> Tuple[Optional[float], Optional[float]]:
+    """
+    Find a cut range that drops the leading and trailing silence of a file.
+
+    The file is decoded as a stream of blocks, never held in memory as a whole.
+
+    Returns:
+        Tuple of (cut_start, cut_end); a side is None when there is nothing to trim
+
+    Raises:
+        ValueError: If the whole file is below the silence threshold
+    """
+    backend = backend_for(input_path)
+    info = backend.probe(input_path)
+    chunk_frames = render_chunk_frames(backend, info) or MIN_CHUNK_FRAMES
+    first, last, duration = find_sound_bounds(backend.decode(input_path, chunk_frames=chunk_frames, info=info),
+                                              info.sample_rate)
+    if first is None:
+        raise ValueError(f"No sound above {SILENCE_THRESHOLD_DB} dBFS in {input_path}")
+    return trim_range(first, last, duration)
+
+
+@RENDER_DURATION.time(operation="waveform_peaks")
+@traced("waveform_peaks")
+def compute_waveform(input_path: str, columns: int = WAVEFORM_WIDTH) -> Tuple[np.ndarray, float]:
+    """
+    Decode a file as a stream and reduce it to per-column waveform peaks.
+
+    Returns:
+        Tuple of (peaks shaped (columns, 2), duration in seconds)
+    """
+    backend = backend_for(input_path)
+    info = backend.probe(input_path)
+    chunk_frames = render_chunk_frames(backend, info) or MIN_CHUNK_FRAMES
+    return compute_peaks(backend.decode(input_path, chunk_frames=chunk_frames, info=info), info.sample_rate,
+                         info.duration, columns)
+
+
+@RENDER_DURATION.time(operation="preview")
+@traced("preview")
+def render_preview(input_path: str, output_path: str, start_time: Optional[float] = None,
+                   end_time: Optional[float] = None, segments: Optional[list] = None, crossfade: float = 0.0) -> float:
+    """
+    Render a short low-bitrate MP3 for checking where a cut lands.
+
+    For every kept range the first and last ``PREVIEW_SECONDS`` are joined
+    by a short silence (a range too short for two excerpts is kept whole),
+    and ranges are spliced with ``crossfade`` as in the final render, so
+    every boundary and join can be heard. Only those seconds are decoded,
+    and effects are not applied.
+
+    Returns:
+        Duration of the preview in seconds
+
+    Raises:
+        ValueError: If the range is empty
+    """
+    backend = backend_for(input_path)
+    info = backend.probe(input_path)
+    # Excerpts are spliced like the render, so the crossfade window counts towards the budget
+    chunk_frames = render_chunk_frames(backend, info, [{"type": "crossfade", "value": crossfade}])
+    chunk_frames = chunk_frames or MIN_CHUNK_FRAMES
+    ranges = segments or [(start_time, end_time)]
+    gap = np.zeros((int(info.sample_rate * PREVIEW_GAP_SECONDS), info.channels), dtype=np.float32)
+    excerpts = []
+    for range_start, range_end in ranges:
+        start = max(0.0, float(range_start or 0))
+        end = float(range_end) if range_end is not None else info.duration
+        if end is not None and info.duration is not None:
+            end = min(end, info.duration)
+        if end is not None and start >= end:
+            continue
+        if end is None:
+            excerpts.append([(start, start + PREVIEW_SECONDS)])
+        elif end - start <= 2 * PREVIEW_SECONDS + PREVIEW_GAP_SECONDS:
+            excerpts.append([(start, end)])
+        else:
+            excerpts.append([(start, start + PREVIEW_SECONDS), (end - PREVIEW_SECONDS, end)])
+    if not excerpts:
+        raise ValueError(f"Empty preview range for {input_path}")
+
+    def excerpt_blocks(parts):
+        for index, (part_start, part_end) in enumerate(parts):
+            if index:
+                yield gap
+            yield from backend.decode(input_path, part_start, part_end, chunk_frames, info)
+
+    frames = 0
+
+    def counted(blocks):
+        nonlocal frames
+        for block in blocks:
+            frames += len(block)
+            yield block
+
+    blocks = splice((excerpt_blocks(parts) for parts in excerpts), int(crossfade * info.sample_rate))
+    backend.encode(counted(blocks), output_path, "mp3", info.sample_rate, info.channels,
+                   codec_args=PREVIEW_CODEC_ARGS)
+    return frames / info.sample_rate
+
+
 def validate_audio_filename(filename: str, language: str) -> Tuple[bool, Optional[str], Optional[str]]:
     """
     Validate and sanitize an audio filename.
@@ -240,4 +1059,4 @@ def validate_audio_filename(filename: str, language: str) -> Tuple[bool, Optiona
     if os.path.sep in sanitized_filename or (os.path.altsep and os.path.altsep in sanitized_filename):
         return False, None, messages.error_invalid_filename
     
-    return True, sanitized_filename, None
\ No newline at end of file
+    return True, sanitized_filename, None
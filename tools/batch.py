@@ -0,0 +1,91 @@
+"""
+Album sessions: many uploads edited through one metadata template.
+
+Uploads that arrive together (one media group, or within ``BATCH_WINDOW``
+seconds of each other) become ``AudioFiles`` rows sharing an
+``AudioBatches`` template. Album, artist, genre, date and cover come from
+the template; track number and title are per file, guessed from the file
+name and tags at upload and editable as a list. A ZIP of tracks becomes a
+session too, see ``tools.archive``.
+"""
+
+import os
+import re
+from typing import List, Optional, Tuple
+from tools.presets import preset_extension
+
+
+# Seconds to wait for the rest of a media group after its last item
+BATCH_GROUP_DELAY = float(os.getenv("BATCH_GROUP_DELAY", 1.5))
+# Seconds within which separate uploads are grouped too (0 keeps them apart)
+BATCH_WINDOW = float(os.getenv("BATCH_WINDOW", 0))
+MAX_BATCH_FILES = int(os.getenv("MAX_BATCH_FILES", 50))
+# Template fields, in menu order
+TEMPLATE_FIELDS = ("album", "artist", "genre", "date", "image")
+# Presets the output button cycles through; None keeps each track's own format
+OUTPUT_PRESET_CHOICES = (None, "mp3_192", "mp3_v2", "opus_128", "aac_256", "flac")
+
+# "03 Song", "3. Song", "3 - Song", "CD1-03 Song"; a lone digit and a space ("2 Unlimited") isn't a number
+_TRACK_PREFIX = re.compile(r"^\s*(?:cd\d+\s*[-._]?\s*)?(?:(\d{1,3})\s*[-._)]|(\d{2,3})\s)\s*(.+)$", re.IGNORECASE)
+
+
+def guess_track(file_name: Optional[str]) -> Tuple[Optional[int], Optional[str]]:
+    """
+    Guess (track number, title) from a file name like "03 - Song Name.mp3".
+
+    Either part is None when it can't be told; underscores read as spaces.
+    """
+    if not file_name:
+        return None, None
+    stem = os.path.splitext(file_name)[0].replace("_", " ").strip()
+    match = _TRACK_PREFIX.match(stem)
+    if match:
+        return int(match.group(1) or match.group(2)), match.group(3).strip() or None
+    return None, stem or None
+
+
+def number_tracks(uploads: List[dict]) -> List[dict]:
+    """
+    Give every upload a ``track_number`` and a ``title``.
+
+    Numbers from the file names are used when they are all present and
+    distinct; otherwise tracks are numbered in upload order. A title tag on
+    the upload wins over the one from the file name.
+    """
+    guesses = [guess_track(upload.get("file_name")) for upload in uploads]
+    numbers = [number for number, _ in guesses]
+    if None in numbers or len(set(numbers)) != len(numbers):
+        numbers = list(range(1, len(uploads) + 1))
+    tracks = []
+    for upload, number, (_, title) in zip(uploads, numbers, guesses):
+        tracks.append({**upload, "track_number": number, "title": (upload.get("title") or title or "")[:64] or None})
+    return sorted(tracks, key=lambda track: track["track_number"])
+
+
+def parse_titles(text: str, max_length: int = 64) -> List[Optional[str]]:
+    """One title per line, in track order; a line of "-" keeps that track's title."""
+    return [None if line.strip() in ("", "-") else line.strip()[:max_length] for line in text.splitlines()]
+
+
+def next_output_preset(current: Optional[str]) -> Optional[str]:
+    choices = list(OUTPUT_PRESET_CHOICES)
+    index = choices.index(current) if current in choices else 0
+    return choices[(index + 1) % len(choices)]
+
+
+def output_file_name(track: dict, output_preset: Optional[str] = None) -> str:
+    """Rendered file name: the original stem with the output preset's extension."""
+    stem, extension = os.path.splitext(track.get("file_name") or "audio.mp3")
+    return f"{stem}.{preset_extension(output_preset, extension.lower().lstrip('.') or 'mp3')}"
+
+
+def track_metadata(track: dict, batch: dict, total: int) -> dict:
+    """``process_audio`` metadata for one track: the template filled in with the track's own values."""
+    return {
+        "title": track.get("title"),
+        "artist": track.get("artist") or batch.get("artist"),
+        "album": batch.get("album") or track.get("album"),
+        "genre": batch.get("genre") or track.get("genre"),
+        "file_date": batch.get("file_date") or track.get("file_date"),
+        "track": f"{track.get('track_number')}/{total}" if track.get("track_number") else None,
+    }
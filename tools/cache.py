@@ -0,0 +1,145 @@
+"""
+Size-capped LRU caches for processed media.
+
+``TieredCache`` keeps recently used entries in memory and writes every entry
+through to a directory on disk, so entries outlive memory eviction and
+restarts. Both tiers evict least recently used entries once their byte cap
+is exceeded. Entries are plain bytes under string keys.
+"""
+
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Optional
+from tools.logger import logger
+from tools.metrics import CACHE_LOOKUPS, CACHE_SIZE_BYTES
+
+
+class TieredCache:
+    """An in-memory LRU tier in front of an on-disk LRU tier.
+
+    Args:
+        name: Cache name, used for metrics and log lines
+        memory_limit: Byte cap of the memory tier (0 disables it)
+        disk_dir: Directory of the disk tier (None disables it)
+        disk_limit: Byte cap of the disk tier (0 disables it)
+    """
+
+    def __init__(self, name: str, memory_limit: int, disk_dir: Optional[str] = None, disk_limit: int = 0):
+        self.name = name
+        self.memory_limit = memory_limit
+        self.disk_dir = disk_dir if disk_dir and disk_limit > 0 else None
+        self.disk_limit = disk_limit
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._memory_size = 0
+        self._disk: "OrderedDict[str, int]" = OrderedDict()
+        self._disk_size = 0
+        self._lock = threading.Lock()
+        if self.disk_dir:
+            self._load_disk_index()
+        CACHE_SIZE_BYTES.set_function(lambda: self._memory_size, cache=name, tier="memory")
+        CACHE_SIZE_BYTES.set_function(lambda: self._disk_size, cache=name, tier="disk")
+
+    def _load_disk_index(self) -> None:
+        """Index files left by a previous run, oldest access first."""
+        try:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            entries = []
+            for entry in os.scandir(self.disk_dir):
+                if entry.is_file() and not entry.name.endswith(".tmp"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, entry.name, stat.st_size))
+            for _, file_name, size in sorted(entries):
+                self._disk[file_name] = size
+                self._disk_size += size
+            self._evict_disk()
+        except OSError as e:
+            logger.error(f"Error loading {self.name} cache directory {self.disk_dir}: {e}")
+            self.disk_dir = None
+
+    @staticmethod
+    def _file_name(key: str) -> str:
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def _path(self, file_name: str) -> str:
+        return os.path.join(self.disk_dir, file_name)
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+                CACHE_LOOKUPS.inc(cache=self.name, result="memory")
+                return value
+            file_name = self._file_name(key)
+            if self.disk_dir and file_name in self._disk:
+                try:
+                    with open(self._path(file_name), "rb") as f:
+                        value = f.read()
+                    os.utime(self._path(file_name))
+                    self._disk.move_to_end(file_name)
+                except OSError:
+                    self._disk_size -= self._disk.pop(file_name)
+                    value = None
+            if value is None:
+                CACHE_LOOKUPS.inc(cache=self.name, result="miss")
+                return None
+            CACHE_LOOKUPS.inc(cache=self.name, result="disk")
+            self._put_memory(key, value)
+            return value
+
+    def put(self, key: str, value: bytes) -> None:
+        with self._lock:
+            self._put_memory(key, value)
+            self._put_disk(key, value)
+
+    def _put_memory(self, key: str, value: bytes) -> None:
+        if len(value) > self.memory_limit:
+            return
+        if key in self._memory:
+            self._memory_size -= len(self._memory.pop(key))
+        self._memory[key] = value
+        self._memory_size += len(value)
+        while self._memory_size > self.memory_limit:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_size -= len(evicted)
+
+    def _put_disk(self, key: str, value: bytes) -> None:
+        if not self.disk_dir or len(value) > self.disk_limit:
+            return
+        file_name = self._file_name(key)
+        try:
+            # Write then rename, so a crash never leaves a truncated entry behind
+            fd, temp_path = tempfile.mkstemp(suffix=".tmp", dir=self.disk_dir)
+            with os.fdopen(fd, "wb") as f:
+                f.write(value)
+            os.replace(temp_path, self._path(file_name))
+        except OSError as e:
+            logger.error(f"Error writing {self.name} cache entry: {e}")
+            return
+        self._disk_size += len(value) - self._disk.pop(file_name, 0)
+        self._disk[file_name] = len(value)
+        self._evict_disk()
+
+    def _evict_disk(self) -> None:
+        while self._disk_size > self.disk_limit and self._disk:
+            file_name, size = self._disk.popitem(last=False)
+            self._disk_size -= size
+            try:
+                os.unlink(self._path(file_name))
+            except OSError:
+                pass
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+            self._memory_size = 0
+            for file_name in self._disk:
+                try:
+                    os.unlink(self._path(file_name))
+                except OSError:
+                    pass
+            self._disk.clear()
+            self._disk_size = 0
@@ -0,0 +1,394 @@
+"""
+Streaming audio effects built from vectorized numpy stages.
+
+An effect chain is a list of stages, each wrapping an iterator of float32
+PCM blocks shaped (frames, channels) and yielding processed blocks. Blocks
+come straight from ``AudioBackend.decode`` and go straight to
+``AudioBackend.encode``, so memory stays bounded by the block size (plus
+the fade-out window) whatever the track length. Reverse is the only stage
+that needs the whole signal; it spools it to a temp file on disk.
+
+Effects are stored on ``AudioFiles.effects`` as a list of dicts such as
+``{"type": "gain", "value": 3.0}`` kept in ``EFFECT_ORDER``.
+"""
+
+import itertools
+import json
+import math
+import os
+import tempfile
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+import numpy as np
+from tools.enums import Messages
+from tools.loudness import LOUDNESS_TARGET, TRUE_PEAK_CEILING, TruePeakLimiter, measure_blocks
+from tools.usage import add_temp_bytes
+
+
+Blocks = Iterator[np.ndarray]
+
+# Application order of the effects; a chain always runs in this order
+EFFECT_ORDER = ("crossfade", "speed", "reverse", "gain", "normalize", "loudness", "fade_in", "fade_out")
+# Effects that take a number: (minimum, maximum, value that means "off")
+EFFECT_RANGES: Dict[str, Tuple[float, float, float]] = {
+    "speed": (0.5, 2.0, 1.0),
+    "gain": (-20.0, 20.0, 0.0),
+    "fade_in": (0.0, 30.0, 0.0),
+    "fade_out": (0.0, 30.0, 0.0),
+    # Applied where cut segments are joined (see ``splice``), not as a chain stage
+    "crossfade": (0.0, 5.0, 0.0),
+}
+# Effects without a value, switched on and off from the menu
+EFFECT_TOGGLES = ("reverse", "normalize", "loudness")
+NORMALIZE_PEAK_DB = -1.0
+
+
+def _db_to_gain(db: float) -> float:
+    return 10 ** (db / 20)
+
+
+def _rebuffer(blocks: Iterable[np.ndarray], frames: int) -> Blocks:
+    """Regroup blocks into blocks of exactly ``frames`` frames (the last one may be shorter)."""
+    pending: List[np.ndarray] = []
+    pending_frames = 0
+    for block in blocks:
+        pending.append(block)
+        pending_frames += len(block)
+        if pending_frames < frames:
+            continue
+        data = np.concatenate(pending)
+        offset = 0
+        while len(data) - offset >= frames:
+            yield data[offset:offset + frames]
+            offset += frames
+        pending = [data[offset:]] if offset < len(data) else []
+        pending_frames = len(data) - offset
+    if pending_frames:
+        yield np.concatenate(pending)
+
+
+def splice(sources: Iterable[Iterable[np.ndarray]], crossfade_frames: int = 0) -> Blocks:
+    """
+    Join block streams end to end, overlapping each join by ``crossfade_frames`` with equal-power fades.
+
+    The last ``crossfade_frames`` of every source are held back until the
+    next one starts, so only that much audio is buffered at a time.
+    """
+    if not crossfade_frames:
+        for source in sources:
+            yield from source
+        return
+    tail: Optional[np.ndarray] = None
+    for source in sources:
+        blocks = iter(source)
+        if tail is not None:
+            head: List[np.ndarray] = []
+            head_frames = 0
+            for block in blocks:
+                head.append(block)
+                head_frames += len(block)
+                if head_frames >= crossfade_frames:
+                    break
+            head_data = np.concatenate(head) if head else tail[:0]
+            overlap = min(len(tail), len(head_data))
+            if len(tail) > overlap:
+                yield tail[:len(tail) - overlap]
+            if overlap:
+                curve = ((np.arange(overlap) + 0.5) / overlap * (np.pi / 2)).astype(np.float32)[:, None]
+                yield tail[len(tail) - overlap:] * np.cos(curve) + head_data[:overlap] * np.sin(curve)
+            blocks = itertools.chain([head_data[overlap:]], blocks)
+        held: Optional[np.ndarray] = None
+        for block in blocks:
+            held = block if held is None else np.concatenate([held, block])
+            if len(held) > crossfade_frames:
+                yield held[:len(held) - crossfade_frames]
+                held = held[len(held) - crossfade_frames:]
+        tail = held
+    if tail is not None and len(tail):
+        yield tail
+
+
+class Effect:
+    """A streaming stage. Subclasses implement ``process``."""
+    name = "effect"
+    # Stages that need a measurement of their input before rendering. The
+    # result is kept in ``measurement`` so callers can cache it.
+    needs_analysis = False
+    measurement = None
+
+    def process(self, blocks: Blocks, sample_rate: int) -> Blocks:
+        raise NotImplementedError
+
+    def analyze(self, blocks: Blocks, sample_rate: int) -> None:
+        """Measure the stage's input in a separate pass before ``process``."""
+
+
+class Gain(Effect):
+    name = "gain"
+
+    def __init__(self, db: float):
+        self.factor = np.float32(_db_to_gain(db))
+
+    def process(self, blocks: Blocks, sample_rate: int) -> Blocks:
+        for block in blocks:
+            yield block * self.factor
+
+
+class Normalize(Effect):
+    """Peak normalization to ``NORMALIZE_PEAK_DB``, measured in an analysis pass."""
+    name = "normalize"
+    needs_analysis = True
+
+    def __init__(self, peak_db: float = NORMALIZE_PEAK_DB):
+        self.target = _db_to_gain(peak_db)
+
+    def analyze(self, blocks: Blocks, sample_rate: int) -> None:
+        peak = 0.0
+        for block in blocks:
+            if len(block):
+                peak = max(peak, float(np.max(np.abs(block))))
+        self.measurement = peak
+
+    def process(self, blocks: Blocks, sample_rate: int) -> Blocks:
+        factor = np.float32(self.target / self.measurement if self.measurement else 1.0)
+        for block in blocks:
+            yield block * factor
+
+
+class LoudnessNormalize(Effect):
+    """
+    EBU R128 normalization to ``target`` LUFS with a true-peak ceiling.
+
+    The analysis pass measures integrated loudness and true peak; the
+    render pass applies the gain and only runs the limiter when the gain
+    would push the true peak over the ceiling.
+    """
+    name = "loudness"
+    needs_analysis = True
+
+    def __init__(self, target: Optional[float] = None, ceiling: float = TRUE_PEAK_CEILING):
+        self.target = LOUDNESS_TARGET if target is None else target
+        self.ceiling = ceiling
+
+    def analyze(self, blocks: Blocks, sample_rate: int) -> None:
+        self.measurement = measure_blocks(blocks, sample_rate)
+
+    def process(self, blocks: Blocks, sample_rate: int) -> Blocks:
+        integrated, true_peak = self.measurement or (None, None)
+        if integrated is None:
+            # Silence or too short to gate; leave it alone
+            yield from blocks
+            return
+        gain_db = self.target - integrated
+        factor = np.float32(_db_to_gain(gain_db))
+        blocks = (block * factor for block in blocks)
+        if true_peak is not None and true_peak + gain_db > self.ceiling:
+            blocks = TruePeakLimiter(self.ceiling, sample_rate).process(blocks)
+        yield from blocks
+
+
+class FadeIn(Effect):
+    name = "fade_in"
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+
+    def process(self, blocks: Blocks, sample_rate: int) -> Blocks:
+        length = max(1, int(self.seconds * sample_rate))
+        position = 0
+        for block in blocks:
+            if position < length:
+                ramp = np.minimum((np.arange(position, position + len(block)) + 1) / length, 1.0)
+                block = block * ramp.astype(np.float32)[:, None]
+            position += len(block)
+            yield block
+
+
+class FadeOut(Effect):
+    """Fade the last ``seconds``; holds back that many frames since the length isn't known up front."""
+    name = "fade_out"
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+
+    def process(self, blocks: Blocks, sample_rate: int) -> Blocks:
+        length = max(1, int(self.seconds * sample_rate))
+        held: List[np.ndarray] = []
+        held_frames = 0
+        for block in blocks:
+            held.append(block)
+            held_frames += len(block)
+            while held and held_frames - len(held[0]) >= length:
+                held_frames -= len(held[0])
+                yield held.pop(0)
+        if not held:
+            return
+        tail = np.concatenate(held)
+        fade = min(length, len(tail))
+        ramp = (np.arange(fade, 0, -1) - 1) / length
+        tail[-fade:] *= ramp.astype(np.float32)[:, None]
+        yield tail
+
+
+class Speed(Effect):
+    """Play back ``factor`` times faster (pitch changes too), by linear interpolation."""
+    name = "speed"
+
+    def __init__(self, factor: float):
+        self.factor = factor
+
+    def process(self, blocks: Blocks, sample_rate: int) -> Blocks:
+        carry: Optional[np.ndarray] = None
+        # Read position of the next output frame, relative to the start of ``data``
+        position = 0.0
+        for block in blocks:
+            data = block if carry is None else np.concatenate([carry, block])
+            last = len(data) - 1
+            if last <= position:
+                carry = data
+                continue
+            count = math.ceil((last - position) / self.factor)
+            positions = position + self.factor * np.arange(count)
+            index = positions.astype(np.int64)
+            fraction = (positions - index).astype(np.float32)[:, None]
+            yield data[index] + (data[index + 1] - data[index]) * fraction
+            position = position + count * self.factor - last
+            carry = data[last:]
+
+
+class Reverse(Effect):
+    """Play the track backwards, spooling it through a temp file read back from the end."""
+    name = "reverse"
+
+    def __init__(self, chunk_frames: int = 65536):
+        self.chunk_frames = chunk_frames
+
+    def process(self, blocks: Blocks, sample_rate: int) -> Blocks:
+        fd, path = tempfile.mkstemp(prefix="reverse_", suffix=".f32")
+        try:
+            channels = 0
+            with os.fdopen(fd, "w+b") as f:
+                for block in blocks:
+                    channels = block.shape[1]
+                    f.write(np.ascontiguousarray(block, dtype=np.float32).tobytes())
+                if not channels:
+                    return
+                frame_bytes = channels * 4
+                add_temp_bytes(f.tell())
+                total = f.tell() // frame_bytes
+                # Plain reads rather than a memory map, whose touched pages would count towards RSS
+                for end in range(total, 0, -self.chunk_frames):
+                    start = max(0, end - self.chunk_frames)
+                    f.seek(start * frame_bytes)
+                    chunk = np.fromfile(f, dtype=np.float32, count=(end - start) * channels)
+                    yield chunk.reshape(-1, channels)[::-1]
+        finally:
+            os.unlink(path)
+
+
+class Clip(Effect):
+    """Hard limit to [-1, 1] so encoders never see out of range samples."""
+    name = "clip"
+
+    def process(self, blocks: Blocks, sample_rate: int) -> Blocks:
+        for block in blocks:
+            yield np.clip(block, -1.0, 1.0)
+
+
+_STAGES = {
+    "speed": lambda value, block_frames: Speed(value),
+    "reverse": lambda value, block_frames: Reverse(block_frames),
+    "gain": lambda value, block_frames: Gain(value),
+    "normalize": lambda value, block_frames: Normalize(),
+    "loudness": lambda value, block_frames: LoudnessNormalize(value),
+    "fade_in": lambda value, block_frames: FadeIn(value),
+    "fade_out": lambda value, block_frames: FadeOut(value),
+}
+
+
+def build_chain(effects: Optional[List[dict]], block_frames: int = 65536) -> List[Effect]:
+    """Turn a stored effect list into stages, in ``EFFECT_ORDER``; Reverse reads back ``block_frames`` at a time."""
+    effects = sorted(effects or [], key=lambda effect: EFFECT_ORDER.index(effect["type"]))
+    return [_STAGES[effect["type"]](effect.get("value"), block_frames)
+            for effect in effects if effect.get("type") in _STAGES]
+
+
+def apply_chain(decode: Callable[[], Blocks], chain: List[Effect], sample_rate: int,
+                block_frames: int = 65536, measurements: Optional[dict] = None) -> Blocks:
+    """
+    Run ``chain`` over the blocks returned by ``decode``.
+
+    ``decode`` is called once for the render and once more for every stage
+    that needs an analysis pass, each time returning a fresh block iterator.
+    ``measurements`` maps stage names to earlier analysis results; stages
+    found there skip their pass, and new results are added to it.
+    """
+    for index, stage in enumerate(chain):
+        if not stage.needs_analysis:
+            continue
+        if measurements is not None and measurements.get(stage.name) is not None:
+            stage.measurement = measurements[stage.name]
+            continue
+        blocks = decode()
+        for previous in chain[:index]:
+            blocks = previous.process(blocks, sample_rate)
+        stage.analyze(blocks, sample_rate)
+        if measurements is not None:
+            measurements[stage.name] = stage.measurement
+    blocks = decode()
+    for stage in chain:
+        blocks = stage.process(blocks, sample_rate)
+    blocks = Clip().process(blocks, sample_rate)
+    return _rebuffer(blocks, block_frames)
+
+
+def set_effect(effects: Optional[List[dict]], effect_type: str, value: Optional[float] = None) -> List[dict]:
+    """Return ``effects`` with ``effect_type`` set to ``value``, or removed when ``value`` is neutral.
+
+    Toggles are switched: passing a toggle that is present removes it.
+    """
+    present = has_effect(effects, effect_type)
+    effects = [effect for effect in (effects or []) if effect.get("type") != effect_type]
+    if effect_type in EFFECT_TOGGLES:
+        if not present:
+            effects.append({"type": effect_type})
+    elif value is not None and value != EFFECT_RANGES[effect_type][2]:
+        effects.append({"type": effect_type, "value": value})
+    return sorted(effects, key=lambda effect: EFFECT_ORDER.index(effect["type"]))
+
+
+def analysis_key(start: Optional[float], end: Optional[float], effects: Optional[List[dict]], effect_type: str,
+                 segments: Optional[List[List[float]]] = None) -> str:
+    """Identify the signal an analysing stage sees: the cut range and the effects applied before it."""
+    position = EFFECT_ORDER.index(effect_type)
+    before = [effect for effect in (effects or []) if EFFECT_ORDER.index(effect["type"]) < position]
+    key = [start, end, before] + ([segments] if segments else [])
+    return json.dumps(key, separators=(",", ":"), sort_keys=True)
+
+
+def effect_value(effects: Optional[List[dict]], effect_type: str) -> Optional[float]:
+    """The value stored for ``effect_type``, or None when it is not set."""
+    for effect in effects or []:
+        if effect.get("type") == effect_type:
+            return effect.get("value")
+    return None
+
+
+def has_effect(effects: Optional[List[dict]], effect_type: str) -> bool:
+    return any(effect.get("type") == effect_type for effect in (effects or []))
+
+
+def parse_effect_value(effect_type: str, value: str, language: str) -> float:
+    """
+    Parse and range check a number typed for ``effect_type``.
+
+    Raises ValueError with a localized message if invalid.
+    """
+    messages = Messages(language=language)
+    minimum, maximum, _ = EFFECT_RANGES[effect_type]
+    try:
+        number = float(value.strip().lower().replace(",", ".").removesuffix("db").strip("x×s "))
+    except (AttributeError, ValueError):
+        raise ValueError(messages.error_effect_value.format(f"{minimum:g}", f"{maximum:g}"))
+    if not math.isfinite(number) or not minimum <= number <= maximum:
+        raise ValueError(messages.error_effect_value.format(f"{minimum:g}", f"{maximum:g}"))
+    return round(number, 2)
@@ -1,7 +1,10 @@
 import os
 import json
 from tools.logger import logger
+from tools.loudness import LOUDNESS_TARGET
+from tools.presets import OUTPUT_PRESETS, fit_size
 from enum import Enum
+from typing import List, Optional
 
 
 def format_timestamp(seconds):
@@ -20,6 +23,16 @@ def format_timestamp(seconds):
         return f"{minutes:02}:{seconds:02}"
 
 
+def format_cut(audio_file: dict, not_set: str = "-") -> str:
+    """Describe the cut of an ``AudioFiles`` row: "01:15 - 02:30", one range per segment for multi-range cuts."""
+    segments = audio_file.get("cut_segments")
+    if not segments:
+        if audio_file.get("cut_start") is None and audio_file.get("cut_end") is None:
+            return not_set
+        segments = [(audio_file.get("cut_start") or 0, audio_file.get("cut_end"))]
+    return ", ".join(f"{format_timestamp(start)} - {format_timestamp(end)}" for start, end in segments)
+
+
 def load_json(file_path: str) -> dict:
     try:
         if not os.path.exists(file_path):
@@ -141,6 +154,42 @@ def format_file_size(size_bytes, default="N/A"):
     return f"{value:.1f} {units[magnitude]}"
 
 
+def describe_effects(effects: Optional[List[dict]], language: str) -> Optional[str]:
+    """A short localized summary of the effect list, or None when empty."""
+    if not effects:
+        return None
+    messages = Messages(language=language)
+    labels = {
+        "speed": messages.effect_speed_label,
+        "reverse": messages.effect_reverse_label,
+        "gain": messages.effect_gain_label,
+        "normalize": messages.effect_normalize_label,
+        "loudness": messages.effect_loudness_label,
+        "fade_in": messages.effect_fade_in_label,
+        "fade_out": messages.effect_fade_out_label,
+        "crossfade": messages.effect_crossfade_label,
+    }
+    parts = []
+    for effect in effects:
+        label = labels.get(effect.get("type"))
+        if label:
+            value = effect.get("value")
+            if effect.get("type") == "loudness" and value is None:
+                value = f"{LOUDNESS_TARGET:g}"
+            parts.append(label.format(value))
+    return ", ".join(parts) or None
+
+
+def preset_label(preset: Optional[str], language: str = "he") -> str:
+    messages = Messages(language=language)
+    if preset in OUTPUT_PRESETS:
+        return OUTPUT_PRESETS[preset].label
+    size = fit_size(preset)
+    if size is not None:
+        return messages.preset_fit_label.format(f"{size:g}")
+    return messages.format_original
+
+
 def create_message_audio(audio_file: dict, language: str = "he") -> str:
     messages = Messages(language=language)
     file_name = audio_file.get("file_name")[:35] if audio_file.get("file_name") else messages.not_set
@@ -162,8 +211,9 @@ def create_message_audio(audio_file: dict, language: str = "he") -> str:
     album = audio_file.get("album") or messages.not_set 
     artist = audio_file.get("artist") or messages.not_set
     image = messages.was_set if audio_file.get("image_id") else messages.not_set
-    cut_start = format_timestamp(audio_file.get("cut_start"))
-    cut_end = format_timestamp(audio_file.get("cut_end"))
+    cut = format_cut(audio_file, messages.not_set)
+    effects = describe_effects(audio_file.get("effects"), language) or messages.not_set
+    output = preset_label(audio_file.get("output_preset"), language)
     return messages.audio_saved_message.format(file_name=file_name,
                                                title=title,
                                                mime_type=mime_type,
@@ -172,7 +222,25 @@ def create_message_audio(audio_file: dict, language: str = "he") -> str:
                                                genre=genre,
                                                album=album,
                                                artist=artist,
-                                               cut_start=cut_start,
-                                               cut_end=cut_end,
-                                               image=image)
-    
\ No newline at end of file
+                                               cut=cut,
+                                               image=image,
+                                               effects=effects,
+                                               output=output)
+
+
+def create_message_batch(batch: dict, tracks: list, language: str = "he") -> str:
+    messages = Messages(language=language)
+    file_date = batch.get("file_date")
+    if file_date and hasattr(file_date, 'strftime'):
+        file_date = file_date.strftime("%d/%m/%Y")
+    track_lines = "\n".join(
+        f"{track.get('track_number') or index:02}. {(track.get('title') or track.get('file_name') or '')[:40]}"
+        for index, track in enumerate(tracks, start=1)
+    )
+    return messages.batch_message.format(count=len(tracks),
+                                         album=batch.get("album") or messages.not_set,
+                                         artist=batch.get("artist") or messages.not_set,
+                                         genre=batch.get("genre") or messages.not_set,
+                                         file_date=file_date or messages.not_set,
+                                         image=messages.was_set if batch.get("image_id") else messages.not_set,
+                                         tracks=track_lines)
@@ -1,33 +1,120 @@
+import asyncio
 import os
 import tempfile
-from typing import Tuple, Optional
+from typing import Dict, Tuple, Optional
 from PIL import Image
+from tools.cache import TieredCache
 from tools.logger import logger
+from tools.metrics import IMAGE_DURATION, TRANSFER_BYTES, TRANSFER_DURATION
+from tools.tracing import span, traced
 from pyrogram import Client
 
 
-async def download_and_process_image(client: Client, file_id: str, max_size: Tuple[int, int] = (500, 500), quality: int = 85) -> Optional[str]:
+# Quality/speed trade-offs for cover art processing, selected with IMAGE_PRESET.
+# ``draft`` lets the JPEG decoder downscale by 1/2, 1/4 or 1/8 while decoding
+# and ``reducing_gap`` does a cheap box reduce before the final resample.
+IMAGE_PRESETS: Dict[str, dict] = {
+    "fast": {"draft": True, "resample": Image.BILINEAR, "reducing_gap": 2.0, "optimize": False, "quality": 80},
+    "balanced": {"draft": True, "resample": Image.LANCZOS, "reducing_gap": 3.0, "optimize": True, "quality": 85},
+    "quality": {"draft": False, "resample": Image.LANCZOS, "reducing_gap": None, "optimize": True, "quality": 90},
+}
+IMAGE_PRESET = os.getenv("IMAGE_PRESET", "balanced").lower()
+if IMAGE_PRESET not in IMAGE_PRESETS:
+    logger.warning(f"Unknown IMAGE_PRESET {IMAGE_PRESET!r}, using 'balanced'")
+    IMAGE_PRESET = "balanced"
+
+# Processed covers keyed by the photo's file_unique_id, so an album reusing one
+# cover downloads and processes it once
+thumbnail_cache = TieredCache(
+    "thumbnails",
+    memory_limit=int(float(os.getenv("THUMBNAIL_CACHE_MEMORY_MB", 16)) * 1024 * 1024),
+    disk_dir=os.getenv("THUMBNAIL_CACHE_DIR") or os.path.join(tempfile.gettempdir(), "music_editor_thumbnails"),
+    disk_limit=int(float(os.getenv("THUMBNAIL_CACHE_DISK_MB", 128)) * 1024 * 1024),
+)
+
+
+def thumbnail_cache_key(file_unique_id: str, max_size: Tuple[int, int], quality: Optional[int] = None,
+                        preset: Optional[str] = None) -> str:
+    preset = preset or IMAGE_PRESET
+    quality = quality or IMAGE_PRESETS[preset]["quality"]
+    return f"{file_unique_id}:{max_size[0]}x{max_size[1]}:q{quality}:{preset}"
+
+
+def process_image(source_path: str, output_path: str, max_size: Tuple[int, int] = (500, 500),
+                  quality: Optional[int] = None, preset: Optional[str] = None) -> None:
+    """
+    Resize an image to fit ``max_size`` and save it as JPEG.
+
+    This is CPU bound and blocking; call it through ``asyncio.to_thread``
+    from coroutines.
+
+    Args:
+        source_path: Path of the original image
+        output_path: Path to write the JPEG to
+        max_size: Maximum (width, height) for the output image
+        quality: JPEG quality (1-100), defaults to the preset's quality
+        preset: One of IMAGE_PRESETS, defaults to IMAGE_PRESET
+    """
+    options = IMAGE_PRESETS[preset or IMAGE_PRESET]
+    quality = quality or options["quality"]
+    with span("pil.process", max_size=str(max_size), quality=quality, preset=preset or IMAGE_PRESET), \
+            Image.open(source_path) as img:
+        if options["draft"]:
+            # Only JPEG supports draft mode; other formats ignore it
+            img.draft("RGB", max_size)
+
+        # Convert to a mode JPEG can store
+        if img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+
+        # Resize while maintaining aspect ratio
+        img.thumbnail(max_size, options["resample"], reducing_gap=options["reducing_gap"])
+
+        # Save with specified quality
+        img.save(output_path, format='JPEG', quality=quality, optimize=options["optimize"])
+
+
+@IMAGE_DURATION.time()
+@traced("download_and_process_image")
+async def download_and_process_image(client: Client, file_id: str, max_size: Tuple[int, int] = (500, 500),
+                                     quality: Optional[int] = None, preset: Optional[str] = None,
+                                     file_unique_id: Optional[str] = None) -> Optional[str]:
     """
     Download and process an image from Telegram.
+
+    Image processing runs in a worker thread so large photos don't block the event loop.
+    When ``file_unique_id`` is given, processed images are served from and
+    stored in ``thumbnail_cache``; the caller always gets its own temp file.
     
     Args:
         client: Pyrogram client instance
         file_id: Telegram file ID of the image
         max_size: Maximum (width, height) for the output image
-        quality: JPEG quality (1-100)
+        quality: JPEG quality (1-100), defaults to the preset's quality
+        preset: One of IMAGE_PRESETS, defaults to IMAGE_PRESET
+        file_unique_id: Telegram file_unique_id of the image, enables caching
         
     Returns:
         Path to the processed temporary image file, or None if processing failed
     """
     temp_file = None
     original_path = None
+    cache_key = thumbnail_cache_key(file_unique_id, max_size, quality, preset) if file_unique_id else None
     
     try:
+        if cache_key and (cached := thumbnail_cache.get(cache_key)) is not None:
+            with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as temp_file:
+                temp_file.write(cached)
+            logger.debug(f"Processed image {file_unique_id} served from cache")
+            return temp_file.name
+
         # Download the original image
-        original_path = await client.download_media(file_id)
+        with TRANSFER_DURATION.time(direction="download", media="photo"), span("download_media", media="photo"):
+            original_path = await client.download_media(file_id)
         if not original_path or not os.path.exists(original_path):
             logger.error(f"Failed to download image with file_id: {file_id}")
             return None
+        TRANSFER_BYTES.inc(os.path.getsize(original_path), direction="download", media="photo")
 
         # Create a temporary file for the processed image
         temp_file = tempfile.NamedTemporaryFile(suffix='.jpg', delete=False)
@@ -35,17 +122,11 @@ async def download_and_process_image(client: Client, file_id: str, max_size: Tup
         temp_file.close()  # Close the file so PIL can write to it
         
         # Process the image
-        with Image.open(original_path) as img:
-            # Convert to RGB if needed
-            if img.mode in ('RGBA', 'P'):
-                img = img.convert('RGB')
-            
-            # Resize while maintaining aspect ratio
-            img.thumbnail(max_size, Image.LANCZOS)
-            
-            # Save with specified quality
-            img.save(temp_path, format='JPEG', quality=quality, optimize=True)
-            
+        await asyncio.to_thread(process_image, original_path, temp_path, max_size, quality, preset)
+        if cache_key:
+            with open(temp_path, 'rb') as f:
+                thumbnail_cache.put(cache_key, f.read())
+
         logger.debug(f"Processed image saved to {temp_path}")
         return temp_path
         
@@ -1,5 +1,6 @@
 from pyrogram.types import InlineKeyboardButton, InlineKeyboardMarkup
-from tools.enums import Messages
+from tools.enums import Messages, preset_label
+from tools.presets import FIT_PREFIX, FIT_SIZES, OUTPUT_PRESETS
 from database import BotSettings
 
 
@@ -73,6 +74,14 @@ def audio_edit_buttons(language: str, audio_id: int):
     buttons = [
         [
             InlineKeyboardButton(messages.cut_button, callback_data=f"cut:{audio_id}"),
+            InlineKeyboardButton(messages.auto_trim_button, callback_data=f"auto_trim:{audio_id}")
+        ],
+        [
+            InlineKeyboardButton(messages.split_button, callback_data=f"split:{audio_id}"),
+            InlineKeyboardButton(messages.preview_button, callback_data=f"preview:{audio_id}")
+        ],
+        [
+            InlineKeyboardButton(messages.waveform_button, callback_data=f"waveform:{audio_id}"),
             InlineKeyboardButton(messages.image_button, callback_data=f"image:{audio_id}")
         ],
         [
@@ -87,8 +96,115 @@ def audio_edit_buttons(language: str, audio_id: int):
             InlineKeyboardButton(messages.album_button, callback_data=f"album:{audio_id}"),
             InlineKeyboardButton(messages.artist_button, callback_data=f"artist:{audio_id}")
         ],
+        [
+            InlineKeyboardButton(messages.effects_button, callback_data=f"effects:{audio_id}"),
+            InlineKeyboardButton(messages.presets_button, callback_data=f"presets:{audio_id}")
+        ],
         [
             InlineKeyboardButton(messages.done_button, callback_data=f"done:{audio_id}")
         ]
     ]
-    return InlineKeyboardMarkup(buttons)
\ No newline at end of file
+    return InlineKeyboardMarkup(buttons)
+
+
+def effects_buttons(language: str, audio_id: int, effects: list | None = None):
+    messages = Messages(language=language)
+    effect_types = {effect.get("type") for effect in (effects or [])}
+    buttons = [
+        [
+            InlineKeyboardButton(messages.fade_in_button, callback_data=f"fade_in:{audio_id}"),
+            InlineKeyboardButton(messages.fade_out_button, callback_data=f"fade_out:{audio_id}")
+        ],
+        [
+            InlineKeyboardButton(messages.gain_button, callback_data=f"gain:{audio_id}"),
+            InlineKeyboardButton(messages.speed_button, callback_data=f"speed:{audio_id}")
+        ],
+        [
+            InlineKeyboardButton(
+                messages.normalize_button.format("✅" if "normalize" in effect_types else "❌"),
+                callback_data=f"normalize:{audio_id}"
+            ),
+            InlineKeyboardButton(
+                messages.reverse_button.format("✅" if "reverse" in effect_types else "❌"),
+                callback_data=f"reverse:{audio_id}"
+            )
+        ],
+        [
+            InlineKeyboardButton(
+                messages.loudness_button.format("✅" if "loudness" in effect_types else "❌"),
+                callback_data=f"loudness:{audio_id}"
+            ),
+            InlineKeyboardButton(messages.crossfade_button, callback_data=f"crossfade:{audio_id}")
+        ],
+        [
+            InlineKeyboardButton(messages.clear_effects_button, callback_data=f"clear_effects:{audio_id}"),
+            InlineKeyboardButton(messages.back_button, callback_data=f"cancel:{audio_id}")
+        ]
+    ]
+    return InlineKeyboardMarkup(buttons)
+
+
+def presets_buttons(language: str, audio_id: int, output_preset: str | None = None):
+    messages = Messages(language=language)
+    presets = [*OUTPUT_PRESETS, *(f"{FIT_PREFIX}{size}" for size in FIT_SIZES)]
+    buttons = []
+    row = []
+    for i, preset in enumerate(presets, start=1):
+        label = preset_label(preset, language)
+        row.append(InlineKeyboardButton(f"✅ {label}" if preset == output_preset else label,
+                                        callback_data=f"preset_{preset}:{audio_id}"))
+        if i % 2 == 0:
+            buttons.append(row)
+            row = []
+    if row:
+        buttons.append(row)
+    buttons.append([
+        InlineKeyboardButton(f"✅ {messages.format_original}" if not output_preset else messages.format_original,
+                             callback_data=f"preset_original:{audio_id}"),
+        InlineKeyboardButton(messages.back_button, callback_data=f"cancel:{audio_id}")
+    ])
+    return InlineKeyboardMarkup(buttons)
+
+
+def split_buttons(language: str, audio_id: int, parts_count: int):
+    messages = Messages(language=language)
+    buttons = [
+        [InlineKeyboardButton(messages.split_run_button.format(parts_count), callback_data=f"split_run:{audio_id}")],
+        [
+            InlineKeyboardButton(messages.split_button, callback_data=f"split:{audio_id}"),
+            InlineKeyboardButton(messages.back_button, callback_data=f"cancel:{audio_id}")
+        ]
+    ]
+    return InlineKeyboardMarkup(buttons)
+
+
+def batch_buttons(language: str, batch_id: int, output_preset: str | None = None, as_archive: bool = False):
+    messages = Messages(language=language)
+    delivery = messages.delivery_zip if as_archive else messages.delivery_audios
+    buttons = [
+        [
+            InlineKeyboardButton(messages.album_button, callback_data=f"batch_album:{batch_id}"),
+            InlineKeyboardButton(messages.artist_button, callback_data=f"batch_artist:{batch_id}")
+        ],
+        [
+            InlineKeyboardButton(messages.genre_button, callback_data=f"batch_genre:{batch_id}"),
+            InlineKeyboardButton(messages.date_button, callback_data=f"batch_date:{batch_id}")
+        ],
+        [
+            InlineKeyboardButton(messages.image_button, callback_data=f"batch_image:{batch_id}"),
+            InlineKeyboardButton(messages.batch_titles_button, callback_data=f"batch_titles:{batch_id}")
+        ],
+        [
+            InlineKeyboardButton(messages.batch_format_button.format(preset_label(output_preset, language)),
+                                 callback_data=f"batch_format:{batch_id}"),
+            InlineKeyboardButton(messages.batch_delivery_button.format(delivery),
+                                 callback_data=f"batch_delivery:{batch_id}")
+        ],
+        [
+            InlineKeyboardButton(messages.batch_done_button, callback_data=f"batch_done:{batch_id}")
+        ],
+        [
+            InlineKeyboardButton(messages.cancel, callback_data=f"batch_cancel:{batch_id}")
+        ]
+    ]
+    return InlineKeyboardMarkup(buttons)
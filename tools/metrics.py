@@ -0,0 +1,317 @@
+"""
+Lightweight in-process metrics for the bot.
+
+Provides counters, gauges and histograms that can be rendered in the
+Prometheus text exposition format, plus a tiny asyncio HTTP server that
+serves them on ``/metrics``. No external dependency is required.
+"""
+
+import asyncio
+import inspect
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+from typing import Callable, Dict, Iterable, Tuple
+from tools.logger import logger
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labelnames: Tuple[str, ...], labelvalues: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, labelvalues)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    """Base class holding the label handling shared by all metric types."""
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"Metric {self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _samples(self) -> Iterable[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """A monotonically increasing value."""
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        if amount < 0:
+            raise ValueError("Counters can only be incremented")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self) -> Iterable[str]:
+        with self._lock:
+            items = list(self._values.items())
+        if not items and not self.labelnames:
+            items = [((), 0)]
+        for key, value in items:
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Gauge(_Metric):
+    """A value that can go up and down, or be read from a callback."""
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._functions: Dict[Tuple[str, ...], Callable[[], float]] = {}
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def set_function(self, function: Callable[[], float], **labels) -> None:
+        """Read the gauge value from ``function`` every time it is rendered."""
+        key = self._key(labels)
+        with self._lock:
+            self._functions[key] = function
+
+    def get(self, **labels) -> float:
+        key = self._key(labels)
+        if key in self._functions:
+            return self._functions[key]()
+        return self._values.get(key, 0)
+
+    def _samples(self) -> Iterable[str]:
+        with self._lock:
+            items = dict(self._values)
+            functions = dict(self._functions)
+        for key, function in functions.items():
+            try:
+                items[key] = function()
+            except Exception as e:
+                logger.debug(f"Gauge {self.name} callback failed: {e}")
+        if not items and not self.labelnames:
+            items[()] = 0
+        for key, value in items.items():
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class _Timer:
+    """Context manager and decorator observing elapsed seconds into a histogram."""
+
+    def __init__(self, histogram: "Histogram", labels: Dict[str, str]):
+        self.histogram = histogram
+        self.labels = labels
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+        return False
+
+    def __call__(self, func):
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with _Timer(self.histogram, self.labels):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with _Timer(self.histogram, self.labels):
+                return func(*args, **kwargs)
+        return wrapper
+
+
+class Histogram(_Metric):
+    """Cumulative histogram with fixed upper bounds."""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            state[0][bisect_left(self.buckets, value)] += 1
+            state[1] += value
+            state[2] += 1
+
+    def time(self, **labels) -> _Timer:
+        """Time a block of code or a (sync or async) function."""
+        return _Timer(self, labels)
+
+    def _samples(self) -> Iterable[str]:
+        with self._lock:
+            items = [(key, list(counts), total, count) for key, (counts, total, count) in self._values.items()]
+        for key, counts, total, count in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, key)} {count}"
+
+
+class MetricsRegistry:
+    """Collection of metrics rendered together."""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+registry = MetricsRegistry()
+
+HANDLER_DURATION = registry.histogram("bot_handler_duration_seconds", "Time spent in update handlers", ("handler",))
+HANDLER_ERRORS = registry.counter("bot_handler_errors_total", "Unhandled exceptions raised by update handlers", ("handler",))
+HANDLERS_IN_PROGRESS = registry.gauge("bot_handlers_in_progress", "Update handlers currently running")
+UPDATES_QUEUE_SIZE = registry.gauge("bot_updates_queue_size", "Updates waiting in the dispatcher queue")
+DB_QUERY_DURATION = registry.histogram("bot_db_query_duration_seconds", "Time spent in database calls", ("model", "method"))
+DB_QUERY_ERRORS = registry.counter("bot_db_query_errors_total", "Database calls that raised", ("model", "method"))
+RENDER_DURATION = registry.histogram("bot_render_duration_seconds", "Time spent rendering audio", ("operation",))
+RENDER_JOBS = registry.gauge("bot_render_jobs", "Render pool jobs by lane and state", ("lane", "state"))
+RENDER_CPU_SECONDS = registry.counter("bot_render_cpu_seconds_total", "CPU time of render jobs, their ffmpeg processes included", ("operation",))
+RENDER_PEAK_RSS = registry.histogram("bot_render_peak_rss_bytes", "Peak memory of render jobs", ("operation",),
+                                     buckets=tuple(mb * 1024 * 1024 for mb in (16, 32, 64, 128, 256, 512, 1024, 2048)))
+RENDER_TEMP_BYTES = registry.counter("bot_render_temp_bytes_total", "Temp and output bytes written by render jobs", ("operation",))
+RENDER_BUDGET_BYTES = registry.gauge("bot_render_budget_bytes", "Estimated bytes of admitted render jobs, and the limits", ("resource", "state"))
+IMAGE_DURATION = registry.histogram("bot_image_processing_duration_seconds", "Time spent downloading and processing cover images")
+TRANSFER_DURATION = registry.histogram("bot_transfer_duration_seconds", "Telegram media transfer time", ("direction", "media"))
+TRANSFER_BYTES = registry.counter("bot_transfer_bytes_total", "Telegram media bytes transferred", ("direction", "media"))
+CACHE_LOOKUPS = registry.counter("bot_cache_lookups_total", "Cache lookups by the tier that answered them", ("cache", "result"))
+CACHE_SIZE_BYTES = registry.gauge("bot_cache_size_bytes", "Bytes held by each cache tier", ("cache", "tier"))
+
+
+def instrument_model(model) -> None:
+    """Time every async classmethod of a database model into ``DB_QUERY_DURATION``."""
+    model_name = model.__name__
+    for attr_name, attr in list(vars(model).items()):
+        if not isinstance(attr, classmethod) or not inspect.iscoroutinefunction(attr.__func__):
+            continue
+
+        def make_wrapper(func, method_name):
+            @wraps(func)
+            async def wrapper(cls, *args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await func(cls, *args, **kwargs)
+                except Exception:
+                    DB_QUERY_ERRORS.inc(model=model_name, method=method_name)
+                    raise
+                finally:
+                    DB_QUERY_DURATION.observe(time.perf_counter() - start, model=model_name, method=method_name)
+            return wrapper
+
+        setattr(model, attr_name, classmethod(make_wrapper(attr.__func__, attr_name)))
+
+
+async def _handle_request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+        # Drain the request headers
+        while True:
+            line = await asyncio.wait_for(reader.readline(), timeout=5)
+            if not line or line in (b"\r\n", b"\n"):
+                break
+        parts = request_line.decode("latin-1").split()
+        path = parts[1].split("?")[0] if len(parts) > 1 else ""
+        if path in ("/metrics", "/"):
+            body = registry.render().encode("utf-8")
+            status = "200 OK"
+        else:
+            body = b"Not Found\n"
+            status = "404 Not Found"
+        writer.write(
+            f"HTTP/1.1 {status}\r\n"
+            "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n".encode("latin-1") + body
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    except Exception as e:
+        logger.error(f"Error serving metrics request: {e}")
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(host: str = "127.0.0.1", port: int = 9100) -> asyncio.AbstractServer:
+    """Serve the registry in Prometheus text format on ``http://host:port/metrics``."""
+    server = await asyncio.start_server(_handle_request, host, port)
+    logger.info(f"Metrics exporter listening on http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,96 @@
+"""
+Output presets: format and encoder settings for the rendered file.
+
+A preset name is stored on ``AudioFiles.output_preset`` (and
+``AudioBatches.output_preset`` for album sessions); None keeps the input's
+format with the encoder defaults of ``OUTPUT_FORMATS``. Besides the fixed
+presets, "fit_<MB>" encodes a CBR MP3 at the highest standard bitrate that
+keeps the file under that many megabytes for the rendered duration.
+"""
+
+import os
+from typing import List, NamedTuple, Optional
+
+
+class OutputPreset(NamedTuple):
+    extension: str
+    codec_args: List[str]
+    label: str
+
+
+OUTPUT_PRESETS = {
+    "mp3_320": OutputPreset("mp3", ["-c:a", "libmp3lame", "-b:a", "320k"], "MP3 320k"),
+    "mp3_192": OutputPreset("mp3", ["-c:a", "libmp3lame", "-b:a", "192k"], "MP3 192k"),
+    "mp3_128": OutputPreset("mp3", ["-c:a", "libmp3lame", "-b:a", "128k"], "MP3 128k"),
+    "mp3_v0": OutputPreset("mp3", ["-c:a", "libmp3lame", "-q:a", "0"], "MP3 VBR V0"),
+    "mp3_v2": OutputPreset("mp3", ["-c:a", "libmp3lame", "-q:a", "2"], "MP3 VBR V2"),
+    "opus_128": OutputPreset("opus", ["-c:a", "libopus", "-b:a", "128k"], "Opus 128k"),
+    "opus_64": OutputPreset("opus", ["-c:a", "libopus", "-b:a", "64k"], "Opus 64k"),
+    "aac_256": OutputPreset("m4a", ["-c:a", "aac", "-b:a", "256k"], "AAC 256k"),
+    "aac_128": OutputPreset("m4a", ["-c:a", "aac", "-b:a", "128k"], "AAC 128k"),
+    "flac": OutputPreset("flac", ["-c:a", "flac", "-compression_level", "5"], "FLAC"),
+}
+FIT_PREFIX = "fit_"
+# Size limits offered in the menu, in MB
+FIT_SIZES = tuple(int(size) for size in os.getenv("FIT_SIZES", "10,20,50").split(",") if size.strip())
+# Standard MPEG-1 Layer III bitrates, kbps
+MP3_BITRATES = (32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320)
+# Container framing and tags, on top of the cover art
+FIT_OVERHEAD_BYTES = 64 * 1024
+# Room for the encoder overshooting its bitrate
+FIT_MARGIN = 0.97
+# Bitrate when the rendered duration isn't known
+FIT_FALLBACK_KBPS = 128
+
+
+def fit_size(preset: Optional[str]) -> Optional[float]:
+    """The MB limit of a "fit_<MB>" preset, or None for other presets."""
+    if not preset or not preset.startswith(FIT_PREFIX):
+        return None
+    try:
+        size = float(preset[len(FIT_PREFIX):])
+    except ValueError:
+        return None
+    return size if size > 0 else None
+
+
+def is_preset(preset: Optional[str]) -> bool:
+    return preset in OUTPUT_PRESETS or fit_size(preset) is not None
+
+
+def fit_bitrate(max_bytes: float, duration: Optional[float], overhead_bytes: int = 0) -> int:
+    """Highest standard MP3 bitrate (kbps) that keeps ``duration`` seconds under ``max_bytes``."""
+    if not duration or duration <= 0:
+        return FIT_FALLBACK_KBPS
+    budget = max_bytes * FIT_MARGIN - FIT_OVERHEAD_BYTES - overhead_bytes
+    kbps = budget * 8 / duration / 1000
+    fitting = [bitrate for bitrate in MP3_BITRATES if bitrate <= kbps]
+    # Nothing fits: the lowest bitrate is the best effort
+    return fitting[-1] if fitting else MP3_BITRATES[0]
+
+
+def preset_extension(preset: Optional[str], default: str = "mp3") -> str:
+    """Output file extension for ``preset``; ``default`` (the input's) when there is none."""
+    if preset in OUTPUT_PRESETS:
+        return OUTPUT_PRESETS[preset].extension
+    if fit_size(preset) is not None:
+        return "mp3"
+    return default
+
+
+def preset_codec_args(preset: Optional[str], duration: Optional[float] = None,
+                      overhead_bytes: int = 0) -> Optional[List[str]]:
+    """
+    ffmpeg encoder arguments for ``preset``, or None for the format's defaults.
+
+    ``duration`` is the rendered length in seconds and ``overhead_bytes``
+    what is embedded besides the audio (cover art); both only matter for
+    "fit_<MB>" presets.
+    """
+    if preset in OUTPUT_PRESETS:
+        return list(OUTPUT_PRESETS[preset].codec_args)
+    size = fit_size(preset)
+    if size is None:
+        return None
+    bitrate = fit_bitrate(size * 1024 * 1024, duration, overhead_bytes)
+    return ["-c:a", "libmp3lame", "-b:a", f"{bitrate}k"]
@@ -0,0 +1,209 @@
+"""
+Worker threads for CPU-bound rendering.
+
+Handlers hand blocking render calls (``process_audio`` and friends) to the
+shared ``render_pool`` instead of running them on the event loop. Rendering
+time is spent in ffmpeg processes and in numpy, which both release the
+GIL, so threads render in parallel without the cost of pickling PCM across
+processes. Jobs run in a copy of the caller's context, so tracing spans
+opened inside a job nest under the handler that submitted it.
+
+Short interactive jobs (previews) go to a separate priority lane with its
+own threads, so they never wait behind full renders queued on the main lane.
+
+Main lane jobs can carry a ``RenderBudget``: their estimated peak memory
+and temp disk (see ``tools.audio_utils.estimate_render``). A job is only
+handed to a thread while the budgets of the admitted jobs plus its own fit
+``RENDER_MEMORY_LIMIT`` and ``RENDER_TEMP_LIMIT``, first come first served;
+one job over a limit still runs, alone. Every job's actual usage is
+measured (see tools.usage), exported as metrics and, for jobs with a
+``user_id``, passed to ``usage_recorder`` for the per-user log.
+"""
+
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, NamedTuple, Optional
+from tools.logger import logger
+from tools.metrics import RENDER_BUDGET_BYTES, RENDER_CPU_SECONDS, RENDER_JOBS, RENDER_PEAK_RSS, RENDER_TEMP_BYTES
+from tools.usage import JobUsage, track_job
+
+
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", "0")) or min(4, os.cpu_count() or 1)
+RENDER_PRIORITY_WORKERS = int(os.getenv("RENDER_PRIORITY_WORKERS", "1"))
+# Limits on the summed budgets of admitted main lane jobs, in MB; 0 disables a limit
+RENDER_MEMORY_LIMIT = int(os.getenv("RENDER_MEMORY_LIMIT", "1024")) * 1024 * 1024
+RENDER_TEMP_LIMIT = int(os.getenv("RENDER_TEMP_LIMIT", "4096")) * 1024 * 1024
+LANES = ("main", "priority")
+RESOURCES = ("memory", "temp")
+
+
+class RenderBudget(NamedTuple):
+    """Estimated bytes a job needs, and whose job it is for the usage log."""
+    memory: int = 0
+    temp: int = 0
+    user_id: Optional[int] = None
+    operation: Optional[str] = None
+
+
+class RenderPool:
+    """Lazily started thread pools, one per lane, with budget admission and queue depth metrics.
+
+    Args:
+        workers: Number of render threads on the main lane
+        priority_workers: Number of render threads on the priority lane
+        memory_limit: Bytes of estimated memory admitted main lane jobs may add up to (0: no limit)
+        temp_limit: Bytes of estimated temp disk admitted main lane jobs may add up to (0: no limit)
+    """
+
+    def __init__(self, workers: int, priority_workers: int = 1, memory_limit: int = 0, temp_limit: int = 0):
+        self.workers = {"main": max(1, workers), "priority": max(1, priority_workers)}
+        self.limits = {"memory": memory_limit, "temp": temp_limit}
+        self._executors: Dict[str, ThreadPoolExecutor] = {}
+        self.waiting = dict.fromkeys(LANES, 0)
+        self.queued = dict.fromkeys(LANES, 0)
+        self.running = dict.fromkeys(LANES, 0)
+        self.reserved = dict.fromkeys(RESOURCES, 0)
+        # Async callable taking user_id, operation, the usage and the estimates as keyword arguments
+        self.usage_recorder: Optional[Callable[..., Awaitable[Any]]] = None
+        self._admission: Optional[asyncio.Condition] = None
+        self._admission_queue: deque = deque()
+        self._recordings: set = set()
+        self._lock = threading.Lock()
+        for lane in LANES:
+            RENDER_JOBS.set_function(lambda lane=lane: self.waiting[lane], lane=lane, state="waiting")
+            RENDER_JOBS.set_function(lambda lane=lane: self.queued[lane], lane=lane, state="queued")
+            RENDER_JOBS.set_function(lambda lane=lane: self.running[lane], lane=lane, state="running")
+        for resource in RESOURCES:
+            RENDER_BUDGET_BYTES.set_function(lambda resource=resource: self.reserved[resource],
+                                             resource=resource, state="reserved")
+            RENDER_BUDGET_BYTES.set_function(lambda resource=resource: self.limits[resource],
+                                             resource=resource, state="limit")
+
+    def _get_executor(self, lane: str) -> ThreadPoolExecutor:
+        with self._lock:
+            if lane not in self._executors:
+                self._executors[lane] = ThreadPoolExecutor(max_workers=self.workers[lane],
+                                                           thread_name_prefix=f"render-{lane}")
+                logger.debug(f"Render pool {lane} lane started with {self.workers[lane]} workers")
+            return self._executors[lane]
+
+    def _fits(self, budget: RenderBudget) -> bool:
+        for resource in RESOURCES:
+            limit, reserved = self.limits[resource], self.reserved[resource]
+            if limit and reserved and reserved + getattr(budget, resource) > limit:
+                return False
+        return True
+
+    async def _admit(self, lane: str, budget: RenderBudget) -> None:
+        """Wait until ``budget`` fits next to the admitted jobs and no earlier job is waiting, then reserve it."""
+        if self._admission is None:
+            self._admission = asyncio.Condition()
+        ticket = object()
+        async with self._admission:
+            self._admission_queue.append(ticket)
+            self.waiting[lane] += 1
+            try:
+                await self._admission.wait_for(lambda: self._admission_queue[0] is ticket and self._fits(budget))
+                for resource in RESOURCES:
+                    self.reserved[resource] += getattr(budget, resource)
+            finally:
+                self._admission_queue.remove(ticket)
+                self.waiting[lane] -= 1
+                # The next job in line may fit now
+                self._admission.notify_all()
+
+    async def _release(self, budget: RenderBudget) -> None:
+        async with self._admission:
+            for resource in RESOURCES:
+                self.reserved[resource] -= getattr(budget, resource)
+            self._admission.notify_all()
+
+    def _report(self, operation: str, usage: JobUsage, budget: Optional[RenderBudget], waited: float) -> None:
+        RENDER_CPU_SECONDS.inc(usage.cpu_seconds, operation=operation)
+        RENDER_PEAK_RSS.observe(usage.peak_rss_bytes, operation=operation)
+        RENDER_TEMP_BYTES.inc(usage.temp_bytes, operation=operation)
+        if budget is None or budget.user_id is None:
+            return
+        logger.info(f"Render usage user={budget.user_id} operation={operation} wall={usage.wall_seconds:.2f}s "
+                    f"cpu={usage.cpu_seconds:.2f}s rss={usage.peak_rss_bytes / 1048576:.1f}MB "
+                    f"temp={usage.temp_bytes / 1048576:.1f}MB estimate={budget.memory / 1048576:.1f}MB "
+                    f"waited={waited:.2f}s")
+        if self.usage_recorder is None:
+            return
+        # Recorded in the background so the handler gets its result without waiting on the database
+        task = asyncio.create_task(self._record(operation, usage, budget, waited))
+        self._recordings.add(task)
+        task.add_done_callback(self._recordings.discard)
+
+    async def _record(self, operation: str, usage: JobUsage, budget: RenderBudget, waited: float) -> None:
+        try:
+            await self.usage_recorder(user_id=budget.user_id, operation=operation,
+                                      wall_seconds=usage.wall_seconds, cpu_seconds=usage.cpu_seconds,
+                                      peak_rss_bytes=usage.peak_rss_bytes, temp_bytes=usage.temp_bytes,
+                                      estimated_memory=budget.memory, estimated_temp=budget.temp,
+                                      waited_seconds=waited)
+        except Exception as e:
+            logger.error(f"Error recording render usage of {budget.user_id}: {e}", exc_info=True)
+
+    async def _submit(self, lane: str, func: Callable[..., Any], *args,
+                      budget: Optional[RenderBudget] = None, **kwargs) -> Any:
+        context = contextvars.copy_context()
+        usages = []
+
+        def tracked():
+            with track_job() as usage:
+                usages.append(usage)
+                return func(*args, **kwargs)
+
+        def job():
+            with self._lock:
+                self.queued[lane] -= 1
+                self.running[lane] += 1
+            try:
+                return context.run(tracked)
+            finally:
+                with self._lock:
+                    self.running[lane] -= 1
+
+        # Previews are small and a user is waiting on them: the priority lane isn't admitted
+        admitted = lane == "main" and budget is not None and (budget.memory or budget.temp)
+        wait_start = time.perf_counter()
+        if admitted:
+            await self._admit(lane, budget)
+        waited = time.perf_counter() - wait_start
+        try:
+            executor = self._get_executor(lane)
+            with self._lock:
+                self.queued[lane] += 1
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(executor, job)
+        finally:
+            if admitted:
+                await self._release(budget)
+            if usages:
+                self._report((budget and budget.operation) or getattr(func, "__name__", "job"), usages[0],
+                             budget, waited)
+
+    async def run(self, func: Callable[..., Any], *args, budget: Optional[RenderBudget] = None, **kwargs) -> Any:
+        """Run ``func(*args, **kwargs)`` on a main lane render thread, once ``budget`` is admitted, and return its result."""
+        return await self._submit("main", func, *args, budget=budget, **kwargs)
+
+    async def run_priority(self, func: Callable[..., Any], *args, budget: Optional[RenderBudget] = None,
+                           **kwargs) -> Any:
+        """Like ``run``, on the priority lane; for short jobs a user is waiting on. ``budget`` is only used for the usage log."""
+        return await self._submit("priority", func, *args, budget=budget, **kwargs)
+
+    def shutdown(self, wait: bool = True) -> None:
+        with self._lock:
+            executors = list(self._executors.values())
+            self._executors.clear()
+        for executor in executors:
+            executor.shutdown(wait=wait, cancel_futures=True)
+
+
+render_pool = RenderPool(RENDER_WORKERS, RENDER_PRIORITY_WORKERS, RENDER_MEMORY_LIMIT, RENDER_TEMP_LIMIT)
@@ -0,0 +1,73 @@
+"""
+Leading and trailing silence detection on streamed PCM.
+
+Frames of ``FRAME_SECONDS`` are reduced to their RMS level with numpy as
+blocks arrive from ``AudioBackend.decode``; only the first and last loud
+frame positions are kept, so a track of any length is scanned with the
+memory of a single block.
+"""
+
+import math
+import os
+from typing import Iterable, Optional, Tuple
+import numpy as np
+
+
+SILENCE_THRESHOLD_DB = float(os.getenv("AUTO_TRIM_THRESHOLD", -50))
+# Silence left in place before the first and after the last loud frame
+TRIM_PADDING = float(os.getenv("AUTO_TRIM_PADDING", 0.1))
+FRAME_SECONDS = 0.01
+
+
+def find_sound_bounds(blocks: Iterable[np.ndarray], sample_rate: int,
+                      threshold_db: float = SILENCE_THRESHOLD_DB) -> Tuple[Optional[float], Optional[float], float]:
+    """
+    Scan a block stream for the first and last frame louder than ``threshold_db`` (dBFS RMS).
+
+    Returns:
+        Tuple of (first sound in seconds or None, end of last sound in
+        seconds or None, total duration in seconds)
+    """
+    frame = max(1, int(sample_rate * FRAME_SECONDS))
+    threshold = 10 ** (threshold_db / 20)
+    # Compare mean squares to avoid a sqrt per frame
+    threshold_power = threshold * threshold
+    pending = None
+    frames_done = 0
+    total = 0
+    first_loud = last_loud = None
+    for block in blocks:
+        total += len(block)
+        data = block if pending is None else np.concatenate([pending, block])
+        count = len(data) // frame
+        if count:
+            power = np.square(data[:count * frame], dtype=np.float32).reshape(count, -1).mean(axis=1)
+            loud = np.flatnonzero(power > threshold_power)
+            if len(loud):
+                if first_loud is None:
+                    first_loud = frames_done + int(loud[0])
+                last_loud = frames_done + int(loud[-1])
+            frames_done += count
+        pending = data[count * frame:]
+    if pending is not None and len(pending):
+        if float(np.square(pending, dtype=np.float32).mean()) > threshold_power:
+            if first_loud is None:
+                first_loud = frames_done
+            last_loud = frames_done
+    duration = total / sample_rate
+    if first_loud is None:
+        return None, None, duration
+    return first_loud * frame / sample_rate, min(duration, (last_loud + 1) * frame / sample_rate), duration
+
+
+def trim_range(first: float, last: float, duration: float,
+               padding: float = TRIM_PADDING) -> Tuple[Optional[float], Optional[float]]:
+    """
+    Turn sound bounds into a ``cut_start``/``cut_end`` pair with ``padding`` kept around the sound.
+
+    Returns None for a side that needs no trimming. Values are rounded
+    outward to hundredths of a second so the sound is never clipped.
+    """
+    start = math.floor(max(0.0, first - padding) * 100) / 100
+    end = math.ceil(min(duration, last + padding) * 100) / 100
+    return (start if start > 0 else None), (end if end < duration else None)
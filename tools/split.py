@@ -0,0 +1,144 @@
+"""
+Splitting a track into parts at timestamps.
+
+Split points come from a plain timestamp list ("10:00, 25:30"), a chapter
+list with one "timestamp title" per line, or a CUE sheet. They are stored
+on ``AudioFiles.split_points`` as ``[{"start": 0.0, "title": "Intro"}, ...]``
+and turned into parts with ``plan_parts`` when the split is rendered.
+"""
+
+import os
+import re
+from typing import List, Optional
+from tools.audio_utils import parse_time
+from tools.enums import Messages, format_timestamp
+
+
+MAX_SPLIT_PARTS = int(os.getenv("MAX_SPLIT_PARTS", 50))
+# Telegram accepts 2 to 10 items per media group
+MEDIA_GROUP_SIZE = 10
+# Parts shorter than this (after clipping to the cut) are dropped
+MIN_PART_SECONDS = 0.5
+
+_CUE_TRACK = re.compile(r"^\s*TRACK\s+\d+", re.IGNORECASE)
+_CUE_INDEX = re.compile(r"^\s*INDEX\s+01\s+(\d+):(\d{1,2}):(\d{1,2})", re.IGNORECASE)
+_CUE_FIELD = re.compile(r'^\s*(TITLE|PERFORMER)\s+"?(.*?)"?\s*$', re.IGNORECASE)
+
+
+def is_cue_sheet(text: str) -> bool:
+    return bool(re.search(r"^\s*INDEX\s+01\s", text or "", re.IGNORECASE | re.MULTILINE))
+
+
+def parse_cue_sheet(text: str) -> List[dict]:
+    """
+    Read the tracks of a CUE sheet as split points.
+
+    Only ``TRACK``, ``TITLE``, ``PERFORMER`` and ``INDEX 01`` lines are used;
+    index times are mm:ss:ff with 75 frames per second.
+    """
+    points = []
+    current: Optional[dict] = None
+    for line in text.splitlines():
+        if _CUE_TRACK.match(line):
+            current = {}
+            points.append(current)
+        elif current is None:
+            # Album level TITLE/PERFORMER before the first track
+            continue
+        elif match := _CUE_INDEX.match(line):
+            minutes, seconds, frames = (int(group) for group in match.groups())
+            current["start"] = minutes * 60 + seconds + frames / 75
+        elif (match := _CUE_FIELD.match(line)) and match.group(2):
+            current[match.group(1).lower()] = match.group(2)
+    return [point for point in points if "start" in point]
+
+
+def parse_split_points(text: str, language: str) -> List[dict]:
+    """
+    Parse split points from a timestamp list, a chapter list or a CUE sheet.
+
+    A part starting at 0 is added when the first point is later, so
+    "10:00, 25:30" gives three parts.
+
+    Raises ValueError if invalid.
+    """
+    messages = Messages(language=language)
+    if not text or not text.strip():
+        raise ValueError(messages.error_split_empty)
+    if is_cue_sheet(text):
+        points = parse_cue_sheet(text)
+    else:
+        text = text.strip()
+        # Chapter titles may contain commas, so a multi-line list is split by line only
+        items = text.splitlines() if "\n" in text else re.split(r"[,;]", text)
+        points = []
+        for item in (item.strip() for item in items):
+            if not item:
+                continue
+            stamp, _, title = item.partition(" ")
+            try:
+                point = {"start": parse_time(stamp)}
+            except ValueError:
+                raise ValueError(messages.error_split_point.format(item))
+            title = title.strip(" -–—:|")
+            if title:
+                point["title"] = title[:64]
+            points.append(point)
+    if not points:
+        raise ValueError(messages.error_split_empty)
+    for previous, point in zip(points, points[1:]):
+        if point["start"] <= previous["start"]:
+            raise ValueError(messages.error_split_order)
+    if points[0]["start"] > 0:
+        points.insert(0, {"start": 0.0})
+    if len(points) < 2:
+        raise ValueError(messages.error_split_empty)
+    if len(points) > MAX_SPLIT_PARTS:
+        raise ValueError(messages.error_split_too_many.format(MAX_SPLIT_PARTS))
+    return points
+
+
+def plan_parts(points: List[dict], duration: Optional[float], cut_start: Optional[float] = None,
+               cut_end: Optional[float] = None, segments: Optional[list] = None) -> List[dict]:
+    """
+    Turn split points into parts with ``start`` and ``end``, clipped to the cut range.
+
+    The last part ends at ``cut_end`` or the end of the track (None when
+    the duration is unknown). With a multi-range cut (``segments``, see
+    ``AudioFiles.cut_segments``) a part keeps only the ranges inside it,
+    as its own ``segments`` when there is more than one; points stay in
+    the track's timeline.
+    """
+    lower = cut_start or 0.0
+    upper = cut_end if cut_end is not None else duration
+    parts = []
+    for index, point in enumerate(points):
+        start = max(point["start"], lower)
+        end = points[index + 1]["start"] if index + 1 < len(points) else upper
+        if end is not None and upper is not None:
+            end = min(end, upper)
+        part_segments = None
+        if segments:
+            kept = [(max(segment_start, start), segment_end if end is None else min(segment_end, end))
+                    for segment_start, segment_end in segments]
+            kept = [(kept_start, kept_end) for kept_start, kept_end in kept if kept_end > kept_start]
+            if sum(kept_end - kept_start for kept_start, kept_end in kept) < MIN_PART_SECONDS:
+                continue
+            start, end = kept[0][0], kept[-1][1]
+            part_segments = [list(segment) for segment in kept] if len(kept) > 1 else None
+        if end is not None and end - start < MIN_PART_SECONDS:
+            continue
+        parts.append({**point, "start": start, "end": end, "segments": part_segments})
+    return parts
+
+
+def describe_parts(parts: List[dict]) -> str:
+    """One line per part: number, time range and title."""
+    lines = []
+    for number, part in enumerate(parts, start=1):
+        end = format_timestamp(part["end"]) if part.get("end") is not None else "…"
+        line = f"{number}. {format_timestamp(part['start'])} - {end}"
+        if part.get("title"):
+            line += f" {part['title']}"
+        lines.append(line)
+    return "\n".join(lines)
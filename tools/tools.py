@@ -1,7 +1,7 @@
 import datetime
 import re
 from dateutil import parser as date_parser
-from pyrogram import Client
+from pyrogram import Client, ContinuePropagation, StopPropagation
 from pyrogram.enums import ChatType
 from pyrogram.types import CallbackQuery, Message
 from database import Chats, Users, AdminsPermissions, BotSettings
@@ -11,8 +11,13 @@ from functools import wraps
 from tools.logger import logger
 from typing import Union
 import os
+import time
 from tools.inline_keyboards import select_language_buttons
+from tools.metrics import HANDLER_DURATION, HANDLER_ERRORS, HANDLERS_IN_PROGRESS
+from tools.tracing import span
+from tools.traffic_recorder import traffic_recorder
 from pyrogram.filters import create, Filter
+from pyrogram.handlers.handler import Handler
 
 
 def is_valid_chat_id(chat_id) -> bool:
@@ -47,7 +52,10 @@ def is_admin_message(permission_require="can_restrict_members"):
             else:
                 user_id = message.from_user.id
                 chat_id = message.chat.id
-                access = await AdminsPermissions.is_admin(client, chat_id, user_id, permission_require)
+                with span("is_admin_message", permission=permission_require) as admin_span:
+                    access = await AdminsPermissions.is_admin(client, chat_id, user_id, permission_require)
+                    if admin_span:
+                        admin_span.set_attribute("access", access.name)
                 if access == AccessPermission.ALLOW:
                     return await func(client, message, *args, **kwargs)
                 elif access == AccessPermission.DENY:
@@ -81,37 +89,38 @@ def with_language(func):
         else:
             raise ValueError("Invalid Object, expected Message or CallbackQuery only")
 
-        default_language = os.getenv("DEFAULT_LANGUAGE") or "he"
+        with span("with_language", chat_type=chat_type.name):
+            default_language = os.getenv("DEFAULT_LANGUAGE") or "he"
 
-        if chat_type in [ChatType.GROUP, ChatType.SUPERGROUP]:
-            chat_id = msg.chat.id
-            chat = await Chats.get(chat_id=chat_id)
-            if not chat:
-                await Chats.create(chat_id=chat_id,
-                             chat_type=chat_type,
-                             chat_title=msg.chat.title)
+            if chat_type in [ChatType.GROUP, ChatType.SUPERGROUP]:
+                chat_id = msg.chat.id
                 chat = await Chats.get(chat_id=chat_id)
-            if isinstance(chat, dict) and chat.get("is_banned"):
-                await msg.chat.leave()
-                return
-            language = chat.get("language") or default_language
-        elif chat_type == ChatType.PRIVATE:
-            user_id = msg.from_user.id
-            user = await Users.get(user_id=user_id)
-            if not user:
-                await Users.create(user_id=user_id,
-                             username=msg.from_user.username,
-                             full_name=msg.from_user.full_name,
-                             is_active=True)
+                if not chat:
+                    await Chats.create(chat_id=chat_id,
+                                 chat_type=chat_type,
+                                 chat_title=msg.chat.title)
+                    chat = await Chats.get(chat_id=chat_id)
+                if isinstance(chat, dict) and chat.get("is_banned"):
+                    await msg.chat.leave()
+                    return
+                language = chat.get("language") or default_language
+            elif chat_type == ChatType.PRIVATE:
+                user_id = msg.from_user.id
                 user = await Users.get(user_id=user_id)
-                await msg.reply(Messages(language=default_language).select_language,
-                                reply_markup=select_language_buttons())
-                return
-            if isinstance(user, dict) and user.get("is_banned"):
-                return
-            language = user.get("language") or default_language
-        else:
-            raise TypeError("Invalid chat type only groups, supergroups or private allowd")
+                if not user:
+                    await Users.create(user_id=user_id,
+                                 username=msg.from_user.username,
+                                 full_name=msg.from_user.full_name,
+                                 is_active=True)
+                    user = await Users.get(user_id=user_id)
+                    await msg.reply(Messages(language=default_language).select_language,
+                                    reply_markup=select_language_buttons())
+                    return
+                if isinstance(user, dict) and user.get("is_banned"):
+                    return
+                language = user.get("language") or default_language
+            else:
+                raise TypeError("Invalid chat type only groups, supergroups or private allowd")
         try:
             return await func(client, msg, language, *args, **kwargs)
         except Exception as e:
@@ -157,7 +166,9 @@ def owner_only(func):
             else:
                 language = update.from_user.language_code or "en"
 
-            if user_id != (await BotSettings.get_settings()).owner_id:
+            with span("owner_only"):
+                owner_id = (await BotSettings.get_settings()).owner_id
+            if user_id != owner_id:
                 if isinstance(update, CallbackQuery):
                     await update.answer(Messages(language=language).unauthorized_user, show_alert=True)
                 return
@@ -172,9 +183,53 @@ def owner_only(func):
     return wrapper
 
 
+def instrument_handler(handler: Handler) -> Handler:
+    """Wrap a handler callback in a root trace span and record its latency and failures in metrics.
+
+    When ``TRAFFIC_RECORD_FILE`` is set, the update is also recorded for replay.
+    """
+    callback = handler.callback
+    if getattr(callback, "__instrumented__", False):
+        return handler
+    name = callback.__name__
+
+    @wraps(callback)
+    async def wrapper(client: Client, update, *args):
+        HANDLERS_IN_PROGRESS.inc()
+        started = time.time()
+        start = time.perf_counter()
+        status = "ok"
+        try:
+            with span(f"update.{name}", handler=name, update_type=type(update).__name__):
+                return await callback(client, update, *args)
+        except StopPropagation:
+            status = "stop"
+            raise
+        except ContinuePropagation:
+            status = None
+            raise
+        except Exception:
+            status = "error"
+            HANDLER_ERRORS.inc(handler=name)
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            HANDLER_DURATION.observe(elapsed, handler=name)
+            HANDLERS_IN_PROGRESS.dec()
+            # Updates passed on with ContinuePropagation are recorded by the handler that takes them
+            if traffic_recorder and status:
+                traffic_recorder.record(name, update, started, elapsed, status)
+
+    wrapper.__instrumented__ = True
+    handler.callback = wrapper
+    return handler
+
+
 def register_handlers(app: Client, *handler_lists: list) -> None:
     """Register multiple lists of handlers with the client.
     
+    Every handler callback is instrumented with metrics and tracing before registration.
+
     Args:
         app: The Pyrogram Client instance
         *handler_lists: Variable number of handler lists to register
@@ -184,7 +239,7 @@ def register_handlers(app: Client, *handler_lists: list) -> None:
         if not isinstance(handler_list, list):
             raise ValueError("All handler lists must be of type list")
         for handler in handler_list:
-            app.add_handler(handler)
+            app.add_handler(instrument_handler(handler))
             count_handlers += 1
     logger.info(f"Registered {count_handlers} handlers")
 
@@ -0,0 +1,292 @@
+"""
+Lightweight per-update tracing.
+
+Spans are nested through a ``contextvars.ContextVar`` so they follow an
+update across decorators, awaits and worker threads started with a copied
+context. Finished traces are kept in an in-memory "slowest traces" list and
+can be exported as JSON lines to a local file (``TRACE_FILE``) and/or as
+OTLP/HTTP JSON to a collector (``TRACE_OTLP_ENDPOINT``).
+"""
+
+import heapq
+import inspect
+import json
+import os
+import queue
+import secrets
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Any, Dict, Iterator, List, Optional
+from pyrogram import ContinuePropagation, StopPropagation
+from tools.logger import logger
+
+
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "true").lower() not in ("0", "false", "no")
+TRACE_FILE = os.getenv("TRACE_FILE")
+TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT")
+TRACE_SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "music-editor-bot")
+TRACE_KEEP_SLOWEST = int(os.getenv("TRACE_KEEP_SLOWEST", 20))
+
+
+class Span:
+    """A timed unit of work inside a trace."""
+    __slots__ = ("name", "trace", "span_id", "parent_id", "start_time", "duration",
+                 "attributes", "error", "_start")
+
+    def __init__(self, name: str, trace: "Trace", parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.name = name
+        self.trace = trace
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.start_time = time.time()
+        self.duration = 0.0
+        self.attributes = attributes
+        self.error = None
+        self._start = time.perf_counter()
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def finish(self) -> None:
+        self.duration = time.perf_counter() - self._start
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_time": self.start_time,
+            "duration": self.duration,
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class Trace:
+    """All spans recorded for one root span (usually one update)."""
+
+    def __init__(self):
+        self.trace_id = secrets.token_hex(16)
+        self.spans: List[Span] = []
+        self.root: Optional[Span] = None
+        self._lock = threading.Lock()
+
+    def add(self, span: Span) -> None:
+        with self._lock:
+            self.spans.append(span)
+
+    @property
+    def duration(self) -> float:
+        return self.root.duration if self.root else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            spans = [span.to_dict() for span in self.spans]
+        return {"trace_id": self.trace_id, "name": self.root.name if self.root else None,
+                "duration": self.duration, "spans": spans}
+
+    def format_tree(self) -> str:
+        """Render the trace as an indented list of span names and durations."""
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s.start_time)
+        children: Dict[Optional[str], List[Span]] = {}
+        for span in spans:
+            children.setdefault(span.parent_id, []).append(span)
+        lines = []
+
+        def walk(parent_id: Optional[str], depth: int) -> None:
+            for span in children.get(parent_id, []):
+                marker = " ❌" if span.error else ""
+                lines.append(f"{'  ' * depth}{span.name} {span.duration * 1000:.1f}ms{marker}")
+                walk(span.span_id, depth + 1)
+
+        walk(self.root.parent_id if self.root else None, 0)
+        return "\n".join(lines)
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+class _SlowTraces:
+    """Keep the N slowest finished traces."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self._heap: List[tuple] = []
+        self._counter = 0
+        self._lock = threading.Lock()
+
+    def add(self, trace: Trace) -> None:
+        with self._lock:
+            self._counter += 1
+            item = (trace.duration, self._counter, trace)
+            if len(self._heap) < self.size:
+                heapq.heappush(self._heap, item)
+            elif item[0] > self._heap[0][0]:
+                heapq.heapreplace(self._heap, item)
+
+    def slowest(self, limit: Optional[int] = None) -> List[Trace]:
+        with self._lock:
+            items = sorted(self._heap, reverse=True)
+        return [trace for _, _, trace in items[:limit]]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._heap.clear()
+
+
+slow_traces = _SlowTraces(TRACE_KEEP_SLOWEST)
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_payload(trace: Trace) -> Dict[str, Any]:
+    spans = []
+    for span in list(trace.spans):
+        start_ns = int(span.start_time * 1e9)
+        otlp_span = {
+            "traceId": trace.trace_id,
+            "spanId": span.span_id,
+            "name": span.name,
+            "kind": 1,
+            "startTimeUnixNano": str(start_ns),
+            "endTimeUnixNano": str(start_ns + int(span.duration * 1e9)),
+            "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in span.attributes.items()],
+            "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+        }
+        if span.parent_id:
+            otlp_span["parentSpanId"] = span.parent_id
+        spans.append(otlp_span)
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": TRACE_SERVICE_NAME}}]},
+            "scopeSpans": [{"scope": {"name": "tools.tracing"}, "spans": spans}],
+        }]
+    }
+
+
+class _Exporter(threading.Thread):
+    """Background thread writing finished traces so exporting never blocks the event loop."""
+
+    def __init__(self, file_path: Optional[str], otlp_endpoint: Optional[str]):
+        super().__init__(name="trace-exporter", daemon=True)
+        self.file_path = file_path
+        self.otlp_endpoint = otlp_endpoint
+        self.queue: "queue.Queue[Trace]" = queue.Queue(maxsize=1000)
+
+    def submit(self, trace: Trace) -> None:
+        try:
+            self.queue.put_nowait(trace)
+        except queue.Full:
+            logger.debug(f"Trace export queue full, dropping trace {trace.trace_id}")
+
+    def run(self) -> None:
+        while True:
+            trace = self.queue.get()
+            if self.file_path:
+                try:
+                    with open(self.file_path, "a", encoding="utf-8") as f:
+                        f.write(json.dumps(trace.to_dict(), ensure_ascii=False, default=str) + "\n")
+                except Exception as e:
+                    logger.error(f"Error writing trace to {self.file_path}: {e}")
+            if self.otlp_endpoint:
+                try:
+                    request = urllib.request.Request(
+                        self.otlp_endpoint,
+                        data=json.dumps(_otlp_payload(trace), default=str).encode("utf-8"),
+                        headers={"Content-Type": "application/json"},
+                        method="POST"
+                    )
+                    urllib.request.urlopen(request, timeout=5).close()
+                except Exception as e:
+                    logger.debug(f"Error exporting trace to {self.otlp_endpoint}: {e}")
+
+
+_exporter: Optional[_Exporter] = None
+if TRACE_FILE or TRACE_OTLP_ENDPOINT:
+    _exporter = _Exporter(TRACE_FILE, TRACE_OTLP_ENDPOINT)
+    _exporter.start()
+
+
+def _finish_trace(trace: Trace) -> None:
+    slow_traces.add(trace)
+    if _exporter:
+        _exporter.submit(trace)
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Optional[Span]]:
+    """Open a span as a child of the current one, starting a new trace if there is none.
+
+    Usable in both sync and async code::
+
+        with span("download_media", media="audio"):
+            path = await client.download_media(file_id)
+    """
+    if not TRACING_ENABLED:
+        yield None
+        return
+    parent = _current_span.get()
+    trace = parent.trace if parent else Trace()
+    new_span = Span(name, trace, parent.span_id if parent else None, attributes)
+    if parent is None:
+        trace.root = new_span
+    token = _current_span.set(new_span)
+    try:
+        yield new_span
+    except (StopPropagation, ContinuePropagation):
+        # How handlers pass an update along the chain, not a failure
+        raise
+    except BaseException as e:
+        new_span.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        new_span.finish()
+        _current_span.reset(token)
+        trace.add(new_span)
+        if parent is None:
+            _finish_trace(trace)
+
+
+def traced(name: Optional[str] = None, **attributes: Any):
+    """Decorator wrapping a sync or async function in a span."""
+    def decorator(func):
+        span_name = name or func.__name__
+
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name, **attributes):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name, **attributes):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def trace_model(model) -> None:
+    """Wrap every async classmethod of a database model in a ``db.<Model>.<method>`` span."""
+    for attr_name, attr in list(vars(model).items()):
+        if isinstance(attr, classmethod) and inspect.iscoroutinefunction(attr.__func__):
+            wrapped = traced(f"db.{model.__name__}.{attr_name}")(attr.__func__)
+            setattr(model, attr_name, classmethod(wrapped))
@@ -0,0 +1,139 @@
+"""
+Opt-in recorder of anonymized update traffic.
+
+When ``TRAFFIC_RECORD_FILE`` is set, every update that reaches a handler is
+appended to that file as one JSON line describing its shape only: update
+type, handler, callback action, command name, media size/duration/type and
+timing. Users are replaced by a keyed hash, cut ranges by their count and
+total length, and other free text by its length, so the file can be
+shared for capacity planning and fed to ``benchmarks/replay.py``.
+"""
+
+import hashlib
+import json
+import os
+import re
+import secrets
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+from pyrogram.types import CallbackQuery, Message
+from tools.audio_utils import parse_cut_segments, segments_duration
+from tools.logger import logger
+
+
+TRAFFIC_RECORD_FILE = os.getenv("TRAFFIC_RECORD_FILE")
+# Keep the salt stable across restarts to link the same user between recordings
+TRAFFIC_RECORD_SALT = os.getenv("TRAFFIC_RECORD_SALT")
+
+_NUMBER_PATTERN = re.compile(r"^-?\d+$")
+
+
+def _describe_text(text: str) -> Dict[str, Any]:
+    """Classify a text message without keeping its content.
+
+    Text that parses as a cut is reduced to its number of ranges and the
+    seconds they keep, never the times themselves (a phone number can parse
+    as one); everything else is reduced to its length.
+    """
+    text = text.strip()
+    if text.startswith("/"):
+        return {"text_kind": "command", "command": text.split()[0][1:].split("@")[0].lower()}
+    if _NUMBER_PATTERN.match(text):
+        return {"text_kind": "number", "text_length": len(text)}
+    try:
+        segments = parse_cut_segments(text, "en")
+    except ValueError:
+        return {"text_kind": "text", "text_length": len(text)}
+    return {"text_kind": "time_range", "segments": len(segments), "seconds": round(segments_duration(segments))}
+
+
+def _describe_media(message: Message) -> Optional[Dict[str, Any]]:
+    if message.photo:
+        size = message.photo.sizes[-1] if message.photo.sizes else None
+        return {"media": "photo", "file_size": size and size.file_size,
+                "width": size and size.width, "height": size and size.height}
+    for kind in ("audio", "voice", "document"):
+        media = getattr(message, kind, None)
+        if media:
+            file_name = getattr(media, "file_name", None) or ""
+            return {"media": kind, "file_size": media.file_size, "duration": getattr(media, "duration", None),
+                    "mime_type": media.mime_type,
+                    "extension": os.path.splitext(file_name)[1].lower().lstrip(".") or None}
+    return None
+
+
+class TrafficRecorder:
+    """Append anonymized update descriptions to a JSON lines file."""
+
+    def __init__(self, path: str, salt: Optional[str] = None):
+        self.path = path
+        self._key = hashlib.sha256((salt or secrets.token_hex(16)).encode()).digest()
+        self._owner_id = os.getenv("BOT_OWNER_ID")
+        self._lock = threading.Lock()
+        self._seen: "OrderedDict[tuple, None]" = OrderedDict()
+        self._file = open(path, "a", encoding="utf-8", buffering=1)
+
+    def anonymize(self, user_id: Optional[int]) -> Optional[str]:
+        if user_id is None:
+            return None
+        return hashlib.blake2b(str(user_id).encode(), key=self._key, digest_size=8).hexdigest()
+
+    def _first_time(self, key: tuple) -> bool:
+        """Return True the first time an update is seen, so one update is recorded once."""
+        if key in self._seen:
+            return False
+        self._seen[key] = None
+        if len(self._seen) > 1024:
+            self._seen.popitem(last=False)
+        return True
+
+    def describe(self, handler: str, update: Any, started: float, elapsed: float, status: str) -> Optional[Dict[str, Any]]:
+        user = getattr(update, "from_user", None)
+        event = {
+            "ts": round(started, 3),
+            "handler": handler,
+            "user": self.anonymize(user.id if user else None),
+            "owner": bool(user and self._owner_id and str(user.id) == self._owner_id),
+            "elapsed": round(elapsed, 4),
+            "status": status,
+        }
+        if isinstance(update, CallbackQuery):
+            key = ("callback_query", update.id)
+            event["type"] = "callback_query"
+            # Numbers (audio ids, user ids) are replaced so the data can be re-targeted on replay
+            event["data"] = re.sub(r"\d+", "{n}", update.data or "")
+        elif isinstance(update, Message):
+            key = ("message", update.chat.id if update.chat else None, update.id)
+            event["type"] = "message"
+            event["chat_type"] = update.chat.type.value if update.chat else None
+            event["media_group"] = bool(update.media_group_id)
+            if update.text:
+                event.update(_describe_text(update.text))
+            media = _describe_media(update)
+            if media:
+                event.update(media)
+        else:
+            return None
+        if not self._first_time(key):
+            return None
+        return event
+
+    def record(self, handler: str, update: Any, started: float, elapsed: float, status: str) -> None:
+        try:
+            with self._lock:
+                event = self.describe(handler, update, started, elapsed, status)
+                if event is not None:
+                    self._file.write(json.dumps(event, ensure_ascii=False) + "\n")
+        except Exception as e:
+            logger.error(f"Error recording update traffic: {e}")
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+
+traffic_recorder: Optional[TrafficRecorder] = None
+if TRAFFIC_RECORD_FILE:
+    traffic_recorder = TrafficRecorder(TRAFFIC_RECORD_FILE, TRAFFIC_RECORD_SALT)
+    logger.info(f"Recording anonymized update traffic to {TRAFFIC_RECORD_FILE}")
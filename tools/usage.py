@@ -0,0 +1,214 @@
+"""
+Resource accounting for render jobs.
+
+The render pool runs every job inside ``track_job``, which makes a
+``JobUsage`` current for the job's thread. CPU time spent in Python is read
+from the thread's own clock. ffmpeg processes started through
+``TrackedPopen`` or ``run_process`` are reaped with ``os.wait4``, so their
+CPU time and peak RSS are charged to the job that started them. Temp files
+count when the code writing them calls ``add_temp_bytes``.
+
+Render threads share one address space, so a job's own peak RSS can't be
+told apart from its neighbours'. ``rss_bytes`` is how far the process grew
+past its size at the start of the job while the job ran, sampled in the
+background, which is an upper bound when jobs overlap.
+"""
+
+import contextvars
+import os
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+
+RSS_SAMPLE_INTERVAL = 0.05
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def process_rss() -> int:
+    """Current resident set size of this process in bytes, 0 where /proc isn't available."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+class JobUsage:
+    """Resources one render job used; filled in while it runs."""
+
+    def __init__(self):
+        self.wall_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.rss_bytes = 0
+        self.ffmpeg_rss_bytes = 0
+        self.temp_bytes = 0
+        self.processes = 0
+        self._lock = threading.Lock()
+        self._baseline_rss = process_rss()
+
+    @property
+    def peak_rss_bytes(self) -> int:
+        """Python side growth plus the largest ffmpeg process."""
+        return self.rss_bytes + self.ffmpeg_rss_bytes
+
+    def charge_process(self, rusage) -> None:
+        with self._lock:
+            self.cpu_seconds += rusage.ru_utime + rusage.ru_stime
+            # ru_maxrss is in kilobytes on Linux
+            self.ffmpeg_rss_bytes = max(self.ffmpeg_rss_bytes, rusage.ru_maxrss * 1024)
+            self.processes += 1
+
+    def add_temp_bytes(self, size: int) -> None:
+        with self._lock:
+            self.temp_bytes += max(0, size)
+
+    def sample_rss(self, rss: int) -> None:
+        self.rss_bytes = max(self.rss_bytes, rss - self._baseline_rss)
+
+    def to_dict(self) -> Dict[str, float]:
+        return {"wall_seconds": self.wall_seconds, "cpu_seconds": self.cpu_seconds,
+                "peak_rss_bytes": self.peak_rss_bytes, "rss_bytes": self.rss_bytes,
+                "ffmpeg_rss_bytes": self.ffmpeg_rss_bytes, "temp_bytes": self.temp_bytes,
+                "processes": self.processes}
+
+
+_current_job: contextvars.ContextVar[Optional[JobUsage]] = contextvars.ContextVar("render_job_usage", default=None)
+
+
+def current_job() -> Optional[JobUsage]:
+    return _current_job.get()
+
+
+def add_temp_bytes(size: int) -> None:
+    """Charge ``size`` bytes of scratch or output files to the running job, if any."""
+    job = _current_job.get()
+    if job is not None:
+        job.add_temp_bytes(size)
+
+
+class _RssSampler(threading.Thread):
+    """Poll the process RSS while jobs are running and record each job's peak growth."""
+
+    def __init__(self, interval: float = RSS_SAMPLE_INTERVAL):
+        super().__init__(name="render-usage", daemon=True)
+        self.interval = interval
+        self.jobs = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+
+    def add(self, job: JobUsage) -> None:
+        with self._lock:
+            self.jobs.add(job)
+        self._wake.set()
+
+    def remove(self, job: JobUsage) -> None:
+        with self._lock:
+            self.jobs.discard(job)
+        job.sample_rss(process_rss())
+
+    def run(self) -> None:
+        while True:
+            self._wake.wait()
+            with self._lock:
+                jobs = list(self.jobs)
+                if not jobs:
+                    self._wake.clear()
+                    continue
+            rss = process_rss()
+            for job in jobs:
+                job.sample_rss(rss)
+            time.sleep(self.interval)
+
+
+_sampler: Optional[_RssSampler] = None
+_sampler_lock = threading.Lock()
+
+
+def _get_sampler() -> _RssSampler:
+    global _sampler
+    with _sampler_lock:
+        if _sampler is None:
+            _sampler = _RssSampler()
+            _sampler.start()
+        return _sampler
+
+
+@contextmanager
+def track_job() -> Iterator[JobUsage]:
+    """Account the resources used inside the block (on this thread) to a new ``JobUsage``."""
+    usage = JobUsage()
+    token = _current_job.set(usage)
+    sampler = _get_sampler()
+    sampler.add(usage)
+    wall_start = time.perf_counter()
+    cpu_start = time.thread_time()
+    try:
+        yield usage
+    finally:
+        usage.cpu_seconds += time.thread_time() - cpu_start
+        usage.wall_seconds = time.perf_counter() - wall_start
+        sampler.remove(usage)
+        _current_job.reset(token)
+
+
+class TrackedPopen(subprocess.Popen):
+    """``subprocess.Popen`` that charges the process's CPU time and peak RSS to the job that started it.
+
+    ``wait`` and ``poll`` (which ``communicate`` and the context manager go
+    through) reap the child with ``os.wait4`` for its rusage before
+    ``Popen`` sees it, so the process is charged however it is reaped.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._usage = _current_job.get()
+        super().__init__(*args, **kwargs)
+
+    def _reap(self, flags: int) -> bool:
+        """Reap the child and charge it to the job; False while it is still running."""
+        if self.returncode is not None or self._usage is None or not hasattr(os, "wait4"):
+            return True
+        try:
+            pid, status, rusage = os.wait4(self.pid, flags)
+        except ChildProcessError:
+            # Reaped elsewhere (SIGCHLD ignored): the exit status is lost, Popen assumes 0 too
+            self.returncode = 0
+            return True
+        if pid != self.pid:
+            return False
+        self._usage.charge_process(rusage)
+        self.returncode = os.waitstatus_to_exitcode(status)
+        return True
+
+    def poll(self) -> Optional[int]:
+        self._reap(os.WNOHANG)
+        return super().poll()
+
+    def wait(self, timeout: Optional[float] = None) -> int:
+        if timeout is None:
+            self._reap(0)
+        else:
+            deadline = time.monotonic() + timeout
+            delay = 0.0005
+            while not self._reap(os.WNOHANG):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise subprocess.TimeoutExpired(self.args, timeout)
+                time.sleep(min(delay, remaining))
+                delay = min(delay * 2, 0.05)
+        return super().wait(timeout)
+
+
+def run_process(command, input: Optional[bytes] = None, **kwargs) -> subprocess.CompletedProcess:
+    """``subprocess.run`` through ``TrackedPopen``."""
+    if input is not None:
+        kwargs["stdin"] = subprocess.PIPE
+    with TrackedPopen(command, **kwargs) as process:
+        try:
+            stdout, stderr = process.communicate(input)
+        except BaseException:
+            process.kill()
+            raise
+    return subprocess.CompletedProcess(command, process.returncode, stdout, stderr)
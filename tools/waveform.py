@@ -0,0 +1,160 @@
+"""
+Waveform previews for picking cut points.
+
+``compute_peaks`` reduces a decoded block stream to the minimum and maximum
+sample of every pixel column with numpy's ``reduceat``, so the decode is
+streamed and only ``columns`` pairs are kept. Peaks are cached by the
+audio's ``file_unique_id``; drawing the PNG (with the current cut marked)
+is cheap and done on every request.
+"""
+
+import os
+import struct
+import tempfile
+from typing import Iterable, List, Optional, Tuple
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+from tools.cache import TieredCache
+from tools.enums import format_timestamp
+from tools.metrics import RENDER_DURATION
+from tools.tracing import traced
+
+
+WAVEFORM_WIDTH = 1000
+WAVEFORM_HEIGHT = 300
+# Seconds between time markers; the smallest step giving at most MAX_MARKERS is used
+MARKER_STEPS = (1, 2, 5, 10, 15, 30, 60, 120, 300, 600, 900, 1800, 3600)
+MAX_MARKERS = 10
+BACKGROUND = (24, 26, 33)
+WAVE_COLOR = (98, 160, 234)
+CUT_COLOR = (120, 220, 140)
+TEXT_COLOR = (200, 200, 200)
+GRID_COLOR = (60, 64, 76)
+
+waveform_cache = TieredCache(
+    "waveforms",
+    memory_limit=int(float(os.getenv("WAVEFORM_CACHE_MEMORY_MB", 8)) * 1024 * 1024),
+    disk_dir=os.getenv("WAVEFORM_CACHE_DIR") or os.path.join(tempfile.gettempdir(), "music_editor_waveforms"),
+    disk_limit=int(float(os.getenv("WAVEFORM_CACHE_DISK_MB", 64)) * 1024 * 1024),
+)
+
+
+def waveform_cache_key(file_unique_id: str, columns: int = WAVEFORM_WIDTH) -> str:
+    return f"{file_unique_id}:{columns}"
+
+
+def pack_peaks(peaks: np.ndarray, duration: float) -> bytes:
+    """Serialize (columns, 2) peaks as a float64 duration followed by float16 pairs."""
+    return struct.pack("<d", duration) + peaks.astype("<f2").tobytes()
+
+
+def unpack_peaks(data: bytes) -> Tuple[np.ndarray, float]:
+    (duration,) = struct.unpack_from("<d", data)
+    return np.frombuffer(data, dtype="<f2", offset=8).astype(np.float32).reshape(-1, 2), duration
+
+
+def compute_peaks(blocks: Iterable[np.ndarray], sample_rate: int, duration: Optional[float],
+                  columns: int = WAVEFORM_WIDTH) -> Tuple[np.ndarray, float]:
+    """
+    Reduce a block stream to per-column (min, max) sample values over all channels.
+
+    ``duration`` (from a probe) maps frames to columns up front; frames past
+    it land in the last column. Without it, peaks are gathered at a fixed
+    resolution and resampled to ``columns`` at the end.
+
+    Returns:
+        Tuple of (peaks shaped (columns, 2), decoded duration in seconds)
+    """
+    if duration:
+        frames_per_column = max(1.0, duration * sample_rate / columns)
+        slots = columns
+    else:
+        # 20 slots per second, merged down once the length is known
+        frames_per_column = sample_rate / 20
+        slots = None
+    lows, highs = [], []
+    position = 0
+    for block in blocks:
+        if not len(block):
+            continue
+        mono_low = block.min(axis=1)
+        mono_high = block.max(axis=1)
+        column = ((position + np.arange(len(block))) / frames_per_column).astype(np.int64)
+        if slots is not None:
+            np.minimum(column, slots - 1, out=column)
+        # reduceat over the frame offsets where the column changes
+        starts = np.flatnonzero(np.diff(column, prepend=-1))
+        lows.append((column[starts], np.minimum.reduceat(mono_low, starts)))
+        highs.append(np.maximum.reduceat(mono_high, starts))
+        position += len(block)
+
+    decoded = position / sample_rate
+    size = slots or max(1, int(np.ceil(position / frames_per_column)))
+    low = np.zeros(size, dtype=np.float32)
+    high = np.zeros(size, dtype=np.float32)
+    if lows:
+        indices = np.concatenate([index for index, _ in lows])
+        # A column split across two blocks appears twice; combine with ufunc.at
+        np.minimum.at(low, indices, np.concatenate([values for _, values in lows]))
+        np.maximum.at(high, indices, np.concatenate(highs))
+    if slots is None and size != columns:
+        edges = np.linspace(0, size, columns + 1).astype(np.int64)
+        edges = np.minimum(edges, size - 1)
+        low = np.minimum.reduceat(low, edges[:-1])
+        high = np.maximum.reduceat(high, edges[:-1])
+    return np.stack([low, high], axis=1), decoded
+
+
+def _marker_step(duration: float) -> int:
+    for step in MARKER_STEPS:
+        if duration / step <= MAX_MARKERS:
+            return step
+    return MARKER_STEPS[-1]
+
+
+@RENDER_DURATION.time(operation="waveform_png")
+@traced("waveform_png")
+def render_waveform(peaks: np.ndarray, duration: float, output_path: str, cut_start: Optional[float] = None,
+                    cut_end: Optional[float] = None, width: int = WAVEFORM_WIDTH,
+                    height: int = WAVEFORM_HEIGHT, segments: Optional[List[List[float]]] = None) -> str:
+    """Draw the peaks as a PNG with time markers and the selected cut range (or ranges) highlighted."""
+    image = Image.new("RGB", (width, height), BACKGROUND)
+    draw = ImageDraw.Draw(image)
+    font = ImageFont.load_default()
+    axis_height = 20
+    wave_height = height - axis_height
+    middle = wave_height / 2
+
+    def x_of(seconds: float) -> int:
+        return int(round(min(max(seconds, 0.0), duration) / duration * (width - 1))) if duration else 0
+
+    if segments:
+        ranges = segments
+    elif cut_start is not None or cut_end is not None:
+        ranges = [(cut_start or 0.0, cut_end if cut_end is not None else duration)]
+    else:
+        ranges = []
+    for range_start, range_end in ranges if duration else []:
+        draw.rectangle((x_of(range_start), 0, x_of(range_end), wave_height), fill=(32, 52, 40))
+
+    step = _marker_step(duration) if duration else 0
+    if step:
+        for second in range(0, int(duration) + 1, step):
+            x = x_of(second)
+            draw.line((x, 0, x, wave_height), fill=GRID_COLOR)
+            draw.text((x + 2, wave_height + 4), format_timestamp(second), fill=TEXT_COLOR, font=font)
+
+    # Peaks are stretched to the image width if the cache holds another column count
+    columns = np.linspace(0, len(peaks) - 1, width).astype(np.int64)
+    tops = middle - np.clip(peaks[columns, 1], -1, 1) * middle
+    bottoms = middle - np.clip(peaks[columns, 0], -1, 1) * middle
+    for x, (top, bottom) in enumerate(zip(tops, bottoms)):
+        draw.line((x, top, x, max(top, bottom)), fill=WAVE_COLOR)
+
+    for range_start, range_end in ranges if duration else []:
+        for marker in (range_start, range_end):
+            x = x_of(marker)
+            draw.line((x, 0, x, wave_height), fill=CUT_COLOR, width=2)
+    draw.line((0, middle, width, middle), fill=GRID_COLOR)
+    image.save(output_path, "PNG", optimize=True)
+    return output_path